@@ -1,10 +1,13 @@
 #!/bin/sh
 
+set -e
 echo ':: making backup...'
 mkdir -p backup
-docker run \
+# consistent copy with the SQLite backup API, safe while the bot is running
+docker-compose run \
     --rm \
-    -v multi_vote_bot:/multi_vote_bot \
+    --no-deps \
     -v "$PWD"/backup:/backup \
-    alpine cp -a /multi_vote_bot /backup/
+    bot \
+    python src/run.py --backup --backup-dir /backup
 echo ':: done: making backup.'
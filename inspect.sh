@@ -2,4 +2,4 @@
 
 set -e
 ./backup.sh
-sqlite3 ./backup/multi_vote_bot/data.db -column -header
+sqlite3 "$(ls -1 ./backup/data-*.db | tail -n 1)" -column -header
@@ -0,0 +1,26 @@
+"""
+unique votes
+"""
+
+from yoyo import step
+
+__depends__ = {'20190316_03_HIDVo-persistent-conversation-handler'}
+
+steps = [
+    # drop duplicates left by concurrent delete-and-reinsert of voters
+    step("""
+        DELETE FROM votes
+         WHERE rowid NOT IN (
+            SELECT MIN(rowid)
+              FROM votes
+             GROUP BY poll_id, answer_id, user_id
+         );
+    """),
+    step("""
+        DROP INDEX index_votes;
+    """),
+    # order of columns in index is important
+    step("""
+        CREATE UNIQUE INDEX index_votes ON votes (poll_id, answer_id, user_id);
+    """),
+]
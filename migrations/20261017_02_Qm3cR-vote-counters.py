@@ -0,0 +1,92 @@
+"""
+vote counters
+"""
+
+from yoyo import step
+
+__depends__ = {'20261017_01_Vt7Qk-unique-votes'}
+
+steps = [
+    step("""
+        CREATE TABLE answer_counts (
+            answer_id INTEGER PRIMARY KEY NOT NULL,
+            poll_id   INTEGER             NOT NULL,
+            votes     INTEGER             NOT NULL DEFAULT 0
+        );
+    """),
+    step("""
+        ALTER TABLE polls ADD COLUMN distinct_voters INTEGER NOT NULL DEFAULT 0;
+    """),
+    # looking up other votes of the same user in a poll
+    step("""
+        CREATE INDEX index_votes_poll_id_user_id ON votes (poll_id, user_id);
+    """),
+    step("""
+        INSERT INTO answer_counts (answer_id, poll_id, votes)
+        SELECT a.id, a.poll_id, (
+            SELECT COUNT(*)
+              FROM votes v
+             WHERE v.poll_id = a.poll_id AND v.answer_id = a.id
+        )
+          FROM answers a;
+    """),
+    step("""
+        UPDATE polls
+           SET distinct_voters = (
+            SELECT COUNT(DISTINCT v.user_id)
+              FROM votes v
+             WHERE v.poll_id = polls.id
+        );
+    """),
+    step("""
+        CREATE TRIGGER trigger_answers_insert_count AFTER INSERT ON answers
+        BEGIN
+            INSERT INTO answer_counts (answer_id, poll_id, votes)
+            VALUES (NEW.id, NEW.poll_id, 0);
+        END;
+    """),
+    step("""
+        CREATE TRIGGER trigger_answers_delete_count AFTER DELETE ON answers
+        BEGIN
+            DELETE FROM answer_counts WHERE answer_id = OLD.id;
+        END;
+    """),
+    # a voter is counted once per poll: on their first vote, and until their last vote is taken back
+    step("""
+        CREATE TRIGGER trigger_votes_insert_count AFTER INSERT ON votes
+        BEGIN
+            UPDATE answer_counts
+               SET votes = votes + 1
+             WHERE answer_id = NEW.answer_id;
+
+            UPDATE polls
+               SET distinct_voters = distinct_voters + 1
+             WHERE id = NEW.poll_id
+               AND NOT EXISTS (
+                SELECT 1
+                  FROM votes v
+                 WHERE v.poll_id = NEW.poll_id
+                   AND v.user_id = NEW.user_id
+                   AND v.answer_id != NEW.answer_id
+            );
+        END;
+    """),
+    step("""
+        CREATE TRIGGER trigger_votes_delete_count AFTER DELETE ON votes
+        BEGIN
+            UPDATE answer_counts
+               SET votes = votes - 1
+             WHERE answer_id = OLD.answer_id;
+
+            UPDATE polls
+               SET distinct_voters = distinct_voters - 1
+             WHERE id = OLD.poll_id
+               AND NOT EXISTS (
+                SELECT 1
+                  FROM votes v
+                 WHERE v.poll_id = OLD.poll_id
+                   AND v.user_id = OLD.user_id
+            );
+        END;
+    """),
+]
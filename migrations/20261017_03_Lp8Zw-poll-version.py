@@ -0,0 +1,57 @@
+"""
+poll version
+"""
+
+from yoyo import step
+
+__depends__ = {'20261017_02_Qm3cR-vote-counters'}
+
+steps = [
+    # incremented on every change of votes, so anything derived from votes can be cached by it
+    step("""
+        ALTER TABLE polls ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+    """),
+    step("""
+        DROP TRIGGER trigger_votes_insert_count;
+    """),
+    step("""
+        DROP TRIGGER trigger_votes_delete_count;
+    """),
+    step("""
+        CREATE TRIGGER trigger_votes_insert_count AFTER INSERT ON votes
+        BEGIN
+            UPDATE answer_counts
+               SET votes = votes + 1
+             WHERE answer_id = NEW.answer_id;
+
+            UPDATE polls
+               SET version = version + 1,
+                   distinct_voters = distinct_voters + NOT EXISTS (
+                    SELECT 1
+                      FROM votes v
+                     WHERE v.poll_id = NEW.poll_id
+                       AND v.user_id = NEW.user_id
+                       AND v.answer_id != NEW.answer_id
+                   )
+             WHERE id = NEW.poll_id;
+        END;
+    """),
+    step("""
+        CREATE TRIGGER trigger_votes_delete_count AFTER DELETE ON votes
+        BEGIN
+            UPDATE answer_counts
+               SET votes = votes - 1
+             WHERE answer_id = OLD.answer_id;
+
+            UPDATE polls
+               SET version = version + 1,
+                   distinct_voters = distinct_voters - NOT EXISTS (
+                    SELECT 1
+                      FROM votes v
+                     WHERE v.poll_id = OLD.poll_id
+                       AND v.user_id = OLD.user_id
+                   )
+             WHERE id = OLD.poll_id;
+        END;
+    """),
+]
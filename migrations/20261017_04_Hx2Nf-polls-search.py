@@ -0,0 +1,30 @@
+"""
+polls full-text search
+"""
+
+from yoyo import step
+
+__depends__ = {'20261017_03_Lp8Zw-poll-version'}
+
+steps = [
+    # owner is stored as a single token 'u<owner_id>', so that filtering by owner
+    # is a part of full-text query itself.
+    step("""
+        CREATE VIRTUAL TABLE polls_search USING fts5 (
+            owner,
+            topic,
+            answers,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '1 2 3'
+        );
+    """),
+    step("""
+        INSERT INTO polls_search (rowid, owner, topic, answers)
+        SELECT
+            p.id,
+            'u' || p.owner_id,
+            p.topic,
+            (SELECT group_concat(a.txt, char(10)) FROM answers a WHERE a.poll_id = p.id)
+          FROM polls p;
+    """),
+]
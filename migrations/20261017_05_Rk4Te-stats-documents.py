@@ -0,0 +1,24 @@
+"""
+stats documents
+"""
+
+from yoyo import step
+
+__depends__ = {'20261017_04_Hx2Nf-polls-search'}
+
+steps = [
+    # Telegram file_id of the last uploaded statistics document of a poll in each format
+    step("""
+        CREATE TABLE stats_documents (
+            poll_id    INTEGER NOT NULL,
+            format     TEXT    NOT NULL,
+            version    INTEGER NOT NULL,
+            file_id    TEXT    NOT NULL,
+            created_at INTEGER NOT NULL,
+            PRIMARY KEY (poll_id, format)
+        );
+    """),
+    step("""
+        CREATE INDEX index_stats_documents_created_at ON stats_documents (created_at);
+    """),
+]
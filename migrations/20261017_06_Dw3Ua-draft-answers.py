@@ -0,0 +1,40 @@
+"""
+draft answers
+"""
+import json
+
+from yoyo import step
+
+__depends__ = {'20261017_05_Rk4Te-stats-documents'}
+
+
+def move_draft_answers(conn):
+    """ move answers out of JSON blobs in user_states, leaving only the topic there """
+    cur = conn.cursor()
+    cur.execute("""SELECT id, state FROM user_states""")
+    for user_id, blob in cur.fetchall():
+        try:
+            state = json.loads(blob.decode('utf-8'))
+        except (AttributeError, ValueError):
+            continue
+
+        cur.executemany("""
+            INSERT INTO draft_answers (user_id, position, txt)
+            VALUES (?, ?, ?)
+            """, [(user_id, position, text) for position, text in enumerate(state.pop('answers', []))])
+        cur.execute("""UPDATE user_states SET state = ? WHERE id = ?""",
+                    (json.dumps(state).encode('utf-8'), user_id))
+
+
+steps = [
+    # answers of a poll being created, appended one by one
+    step("""
+        CREATE TABLE draft_answers (
+            user_id  INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            txt      TEXT    NOT NULL,
+            PRIMARY KEY (user_id, position)
+        );
+    """),
+    step(move_draft_answers),
+]
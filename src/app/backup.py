@@ -0,0 +1,156 @@
+"""
+online backups of the database with the SQLite backup API.
+
+the database is copied a few pages at a time, with a pause after each step, so that
+writers are never stalled for long.  the copy is a consistent snapshot: the source
+connection holds a read transaction for the whole backup, which in WAL mode blocks
+nobody, and keeps the backup from restarting whenever a vote is written meanwhile.
+
+backups are written as `data-YYYYmmdd-HHMMSS-ffffff.db` files, and only the latest are kept.
+every backup is a full copy: the backup API has no incremental mode.
+"""
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from os.path import getsize, join
+from typing import Any, Dict, List, Optional
+
+from . import fs, log
+
+logger = log.getLogger(__name__)
+
+# pages copied in one step; 4 MiB with the default page size
+BACKUP_PAGES = 1024
+
+# seconds to pause after each step
+BACKUP_SLEEP = 0.01
+
+# number of backups to keep, 0 to keep all of them
+BACKUP_KEEP = 7
+
+
+def backups(directory: str) -> List[str]:
+    """backup files in a directory, from the oldest to the latest."""
+    if not os.path.isdir(directory):
+        return []
+    return [join(directory, name) for name in sorted(os.listdir(directory))
+            if name.startswith('data-') and name.endswith('.db')]
+
+
+def backup(directory: str,
+           db_path: Optional[str] = None,
+           pages: int = BACKUP_PAGES,
+           sleep: float = BACKUP_SLEEP,
+           keep: int = BACKUP_KEEP) -> Dict[str, Any]:
+    """
+    copy the database into a new file in `directory`, and delete old backups.
+
+    :param db_path: database to copy, `fs.DB_PATH` by default.
+    :param pages: pages to copy in one step.
+    :param sleep: seconds to pause after each step.
+    :param keep: number of backups to keep, including the new one, or 0 to keep all of them.
+    :raise FileNotFoundError: if there is no database at `db_path`.
+    :return: path, duration in seconds, size in bytes and number of steps of the backup.
+    """
+    db_path = db_path or fs.DB_PATH
+    # a missing database, e.g. on an unmounted volume, must not be backed up as an empty one
+    if not os.path.isfile(db_path):
+        raise FileNotFoundError("database {} not found".format(db_path))
+
+    os.makedirs(directory, exist_ok=True)
+    # microseconds, so that backups made within a second neither overwrite nor misorder
+    # each other; names sort in the order the backups were made
+    path = join(directory, datetime.now().strftime('data-%Y%m%d-%H%M%S-%f.db'))
+    while os.path.exists(path):
+        path = join(directory, datetime.now().strftime('data-%Y%m%d-%H%M%S-%f.db'))
+    partial = path + '.partial'
+
+    steps = 0
+
+    def progress(status: int, remaining: int, total: int):
+        nonlocal steps
+        steps += 1
+        if remaining > 0 and sleep > 0:
+            time.sleep(sleep)
+
+    started = time.perf_counter()
+    src = sqlite3.connect('file:{}?mode=ro'.format(db_path), uri=True, isolation_level=None, timeout=30)
+    dst = sqlite3.connect(partial)
+    try:
+        # snapshot of the database, for all the steps
+        src.execute("BEGIN")
+        src.execute("SELECT count(*) FROM sqlite_master").fetchall()
+        src.backup(dst, pages=pages, progress=progress)
+        src.execute("ROLLBACK")
+    except BaseException:
+        dst.close()
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        src.close()
+    dst.close()
+    os.replace(partial, path)
+
+    if keep > 0:
+        old = backups(directory)
+        for old_path in old[:max(0, len(old) - keep)]:
+            os.remove(old_path)
+
+    result = {
+        'path': path,
+        'seconds': round(time.perf_counter() - started, 3),
+        'bytes': getsize(path),
+        'steps': steps,
+    }
+    logger.info("backup %s: %d bytes in %.3f s, %d steps", path, result['bytes'], result['seconds'], steps)
+    return result
+
+
+class BackupJob:
+    """
+    periodic backups, e.g. on `JobQueue`: `job_queue.run_repeating(job.run, interval)`.
+    """
+
+    def __init__(self, directory: str, keep: int = BACKUP_KEEP):
+        self.directory = directory
+        self.keep = keep
+
+        self._lock = threading.Lock()
+
+        self.backups = 0
+        self.failures = 0
+        self.last_seconds = 0.0
+        self.last_bytes = 0
+        self.last_time = 0.0
+
+    def run(self, context=None):
+        """
+        :param context: `CallbackContext` of a job, unused.
+        """
+        if not self._lock.acquire(blocking=False):
+            logger.warning("previous backup is still running, skipping")
+            return
+        try:
+            result = backup(self.directory, keep=self.keep)
+        except Exception:
+            self.failures += 1
+            logger.exception("backup failed")
+        else:
+            self.backups += 1
+            self.last_seconds = result['seconds']
+            self.last_bytes = result['bytes']
+            self.last_time = time.time()
+        finally:
+            self._lock.release()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'backups': self.backups,
+            'failures': self.failures,
+            'last_seconds': self.last_seconds,
+            'last_bytes': self.last_bytes,
+            'last_time': self.last_time,
+        }
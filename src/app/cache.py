@@ -0,0 +1,93 @@
+"""
+in-process caches.
+"""
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class LRUCache(Generic[K, V]):
+    """
+    thread-safe mapping which evicts least recently used entries.
+
+    size of the cache is bounded both by number of entries and by their total weight,
+    e.g. an estimate of memory in bytes, as measured by `weigh` function.
+    """
+
+    def __init__(self, max_entries: int,
+                 max_weight: Optional[int] = None,
+                 weigh: Callable[[V], int] = lambda value: 1):
+        """
+        :param max_entries: maximum number of entries; 0 disables caching.
+        :param max_weight: maximum total weight of entries, None for unbounded.
+        :param weigh: function which calculates weight of a value once it is put.
+        """
+        self.max_entries = max_entries
+        self.max_weight = max_weight
+        self.weigh = weigh
+
+        self._entries: 'OrderedDict[K, Tuple[V, int]]' = OrderedDict()
+        self._weight = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: K, value: V):
+        if self.max_entries <= 0:
+            return
+
+        weight = self.weigh(value)
+        if self.max_weight is not None and weight > self.max_weight:
+            return
+
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (value, weight)
+            self._weight += weight
+
+            while (len(self._entries) > self.max_entries
+                   or self.max_weight is not None and self._weight > self.max_weight):
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, key: K):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._weight = 0
+
+    def _pop(self, key: K):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._weight -= entry[1]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'entries': len(self._entries),
+            'weight': self._weight,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,186 @@
+"""
+coalescing of message edits.
+
+in a busy group, many users vote on the same poll message within a second.  every vote
+would edit the message, but only the last edit matters, while the rest are superseded
+immediately and count towards Telegram's flood limits.
+"""
+import threading
+import time
+from typing import Callable, Dict, Hashable, Optional
+
+from telegram.error import RetryAfter
+
+from . import log
+
+logger = log.getLogger(__name__)
+
+Edit = Callable[[], None]
+
+
+class _MessageState:
+    __slots__ = ('last', 'version', 'pending', 'pending_version')
+
+    def __init__(self):
+        self.last: float = float('-inf')
+        """time of the last edit."""
+        self.version: int = -1
+        """version of the content of the last edit."""
+        self.pending: Optional[Edit] = None
+        self.pending_version: int = -1
+
+
+class EditCoalescer:
+    """
+    debounce edits of each message to at most one per `interval` seconds.
+
+    an edit is executed right away if the message hasn't been edited during the last
+    `interval`.  otherwise it's scheduled for the end of the interval, replacing an edit
+    scheduled earlier, so that only the latest content is sent.
+
+    an edit which hits the flood limit (`RetryAfter`) is scheduled again once the limit
+    expires, unless newer content has been scheduled meanwhile.
+    """
+
+    def __init__(self, interval: float):
+        """
+        :param interval: minimum time between edits of a message, in seconds.
+        """
+        self.interval = interval
+
+        self._messages: Dict[Hashable, _MessageState] = {}
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.executed = 0
+        self.retries = 0
+
+    @property
+    def saved(self) -> int:
+        """number of edits which were superseded and never sent."""
+        with self._lock:
+            return self._saved_locked()
+
+    def _saved_locked(self) -> int:
+        return self.submitted - self.executed - self._pending_locked()
+
+    def submit(self, key: Hashable, version: int, edit: Edit):
+        """
+        edit a message now or later.
+
+        :param key: identifies a message, e.g. inline_message_id or (chat_id, message_id).
+        :param version: version of the content; an edit with content not newer than
+            already sent, or older than already scheduled, is dropped.
+        :param edit: function which sends the edit.
+        """
+        with self._lock:
+            self.submitted += 1
+            now = time.monotonic()
+
+            state = self._messages.get(key)
+            if state is None:
+                self._prune(now)
+                state = self._messages[key] = _MessageState()
+
+            if version <= state.version or version < state.pending_version:
+                return
+
+            if state.pending is not None:
+                # timer is already running, just replace the content
+                state.pending, state.pending_version = edit, version
+                return
+
+            delay = state.last + self.interval - now
+            if delay > 0:
+                state.pending, state.pending_version = edit, version
+                self._schedule(key, delay)
+                return
+
+            state.last, state.version = now, version
+            self.executed += 1
+
+        self._run(key, version, edit)
+
+    def _schedule(self, key: Hashable, delay: float):
+        timer = threading.Timer(delay, self._flush, (key,))
+        timer.daemon = True
+        timer.start()
+
+    def _flush(self, key: Hashable, force: bool = False):
+        with self._lock:
+            state = self._messages.get(key)
+            if state is None or state.pending is None:
+                return
+            now = time.monotonic()
+            delay = state.last + self.interval - now
+            if delay > 0 and not force:
+                # postponed by a flood limit after this timer was started
+                self._schedule(key, delay)
+                return
+            edit, version = state.pending, state.pending_version
+            state.last, state.version = now, version
+            state.pending, state.pending_version = None, -1
+            self.executed += 1
+
+        self._run(key, version, edit)
+
+    def flush(self):
+        """execute all scheduled edits now, e.g. before shutdown."""
+        with self._lock:
+            keys = [key for key, state in self._messages.items() if state.pending is not None]
+        for key in keys:
+            self._flush(key, force=True)
+
+    def _run(self, key: Hashable, version: int, edit: Edit):
+        try:
+            edit()
+        except RetryAfter as e:
+            self._retry(key, version, edit, e.retry_after)
+        except Exception:
+            logger.exception("coalesced message edit failed")
+
+    def _retry(self, key: Hashable, version: int, edit: Edit, retry_after: float):
+        """schedule an edit which hit the flood limit again, once the limit expires."""
+        logger.warning("message edit hit flood limit, retrying in %s seconds", retry_after)
+        with self._lock:
+            state = self._messages.get(key)
+            if state is None:
+                state = self._messages[key] = _MessageState()
+            self.retries += 1
+            # the edit has not been sent after all
+            self.executed -= 1
+            if state.version == version:
+                state.version = -1
+            # no edits of this message until the limit expires
+            state.last = time.monotonic() + retry_after - self.interval
+            if state.pending is not None:
+                # newer content is already scheduled, and its timer will wait
+                return
+            state.pending, state.pending_version = edit, version
+            self._schedule(key, retry_after)
+
+    def _prune(self, now: float):
+        """forget messages which are neither pending nor edited during last interval."""
+        if len(self._messages) < 1024:
+            return
+        for key in [key for key, state in self._messages.items()
+                    if state.pending is None and state.last + self.interval < now]:
+            del self._messages[key]
+
+    def pending(self) -> int:
+        """number of messages with a scheduled edit."""
+        with self._lock:
+            return self._pending_locked()
+
+    def _pending_locked(self) -> int:
+        return sum(1 for state in self._messages.values() if state.pending is not None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'submitted': self.submitted,
+                'executed': self.executed,
+                'retries': self.retries,
+                'pending': self._pending_locked(),
+                'saved': self._saved_locked(),
+            }
@@ -1,9 +1,17 @@
+import argparse
+import configparser
 import os
 import sys
-from dataclasses import asdict, dataclass, replace
-from typing import Optional
+from dataclasses import asdict, dataclass, fields, replace
+from os.path import expanduser
+from typing import List, Optional
 from abc import ABCMeta, abstractmethod
 
+DEFAULT_DATA_DIR = expanduser("~/.local/share/multi_vote_bot")
+
+# section of configuration file
+SECTION = 'multi_vote_bot'
+
 
 class ConfigurationError(RuntimeError):
     pass
@@ -27,24 +35,164 @@ class ConfigurationSource(metaclass=ABCMeta):
     def listen(self) -> Optional[str]:
         pass
 
+    @abstractmethod
+    def data_dir(self) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def workers(self) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    def con_pool_size(self) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    def sqlite_pool_size(self) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    def sqlite_synchronous(self) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def sqlite_mmap_size(self) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    def sqlite_cache_size(self) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    def render_cache_size(self) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    def render_cache_weight(self) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    def profiles_cache_size(self) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    def edit_interval(self) -> Optional[float]:
+        pass
+
+    @abstractmethod
+    def votes_write_behind(self) -> Optional[bool]:
+        pass
+
+    @abstractmethod
+    def votes_flush_interval(self) -> Optional[float]:
+        pass
+
+    @abstractmethod
+    def votes_flush_batch(self) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    def lanes(self) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    def metrics_port(self) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    def metrics_listen(self) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def admin_id(self) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    def sql_trace(self) -> Optional[bool]:
+        pass
+
+    @abstractmethod
+    def sql_slow_seconds(self) -> Optional[float]:
+        pass
+
+    @abstractmethod
+    def record_updates(self) -> Optional[bool]:
+        pass
+
+    @abstractmethod
+    def backup_interval(self) -> Optional[float]:
+        pass
+
+    @abstractmethod
+    def backup_dir(self) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def backup_keep(self) -> Optional[int]:
+        pass
+
     def partial(self) -> 'PartialConfiguration':
         return PartialConfiguration(
             token=self.token(),
             webhook_url=self.webhook_url(),
             port=self.port(),
             listen=self.listen(),
+            data_dir=self.data_dir(),
+            workers=self.workers(),
+            con_pool_size=self.con_pool_size(),
+            sqlite_pool_size=self.sqlite_pool_size(),
+            sqlite_synchronous=self.sqlite_synchronous(),
+            sqlite_mmap_size=self.sqlite_mmap_size(),
+            sqlite_cache_size=self.sqlite_cache_size(),
+            render_cache_size=self.render_cache_size(),
+            render_cache_weight=self.render_cache_weight(),
+            profiles_cache_size=self.profiles_cache_size(),
+            edit_interval=self.edit_interval(),
+            votes_write_behind=self.votes_write_behind(),
+            votes_flush_interval=self.votes_flush_interval(),
+            votes_flush_batch=self.votes_flush_batch(),
+            lanes=self.lanes(),
+            metrics_port=self.metrics_port(),
+            metrics_listen=self.metrics_listen(),
+            admin_id=self.admin_id(),
+            sql_trace=self.sql_trace(),
+            sql_slow_seconds=self.sql_slow_seconds(),
+            record_updates=self.record_updates(),
+            backup_interval=self.backup_interval(),
+            backup_dir=self.backup_dir(),
+            backup_keep=self.backup_keep(),
         )
 
 
-class EnvConfigurationSource(ConfigurationSource):
+class KeyValueConfigurationSource(ConfigurationSource, metaclass=ABCMeta):
+    """
+    source of raw string values by environment variable names, e.g. 'WEBHOOK_URL'.
+    """
 
+    @abstractmethod
     def get_raw(self, key: str) -> Optional[str]:
-        return os.getenv(key)
+        pass
 
     def get_int(self, key: str) -> Optional[int]:
         raw = self.get_raw(key)
         if raw is not None:
-            return int(raw)
+            try:
+                return int(raw)
+            except ValueError:
+                raise ConfigurationError("Configuration {} is not a number: {!r}".format(key, raw))
+
+    def get_float(self, key: str) -> Optional[float]:
+        raw = self.get_raw(key)
+        if raw is not None:
+            try:
+                return float(raw)
+            except ValueError:
+                raise ConfigurationError("Configuration {} is not a number: {!r}".format(key, raw))
+
+    def get_bool(self, key: str) -> Optional[bool]:
+        raw = self.get_raw(key)
+        if raw is not None:
+            return raw.lower() in ('1', 'true', 'yes', 'on')
 
     def token(self) -> Optional[str]:
         return self.get_raw('TOKEN')
@@ -58,6 +206,118 @@ class EnvConfigurationSource(ConfigurationSource):
     def listen(self) -> Optional[str]:
         return self.get_raw('LISTEN')
 
+    def data_dir(self) -> Optional[str]:
+        return self.get_raw('DATA_DIR')
+
+    def workers(self) -> Optional[int]:
+        return self.get_int('WORKERS')
+
+    def con_pool_size(self) -> Optional[int]:
+        return self.get_int('CON_POOL_SIZE')
+
+    def sqlite_pool_size(self) -> Optional[int]:
+        return self.get_int('SQLITE_POOL_SIZE')
+
+    def sqlite_synchronous(self) -> Optional[str]:
+        return self.get_raw('SQLITE_SYNCHRONOUS')
+
+    def sqlite_mmap_size(self) -> Optional[int]:
+        return self.get_int('SQLITE_MMAP_SIZE')
+
+    def sqlite_cache_size(self) -> Optional[int]:
+        return self.get_int('SQLITE_CACHE_SIZE')
+
+    def render_cache_size(self) -> Optional[int]:
+        return self.get_int('RENDER_CACHE_SIZE')
+
+    def render_cache_weight(self) -> Optional[int]:
+        return self.get_int('RENDER_CACHE_WEIGHT')
+
+    def profiles_cache_size(self) -> Optional[int]:
+        return self.get_int('PROFILES_CACHE_SIZE')
+
+    def edit_interval(self) -> Optional[float]:
+        return self.get_float('EDIT_INTERVAL')
+
+    def votes_write_behind(self) -> Optional[bool]:
+        return self.get_bool('VOTES_WRITE_BEHIND')
+
+    def votes_flush_interval(self) -> Optional[float]:
+        return self.get_float('VOTES_FLUSH_INTERVAL')
+
+    def votes_flush_batch(self) -> Optional[int]:
+        return self.get_int('VOTES_FLUSH_BATCH')
+
+    def lanes(self) -> Optional[int]:
+        return self.get_int('LANES')
+
+    def metrics_port(self) -> Optional[int]:
+        return self.get_int('METRICS_PORT')
+
+    def metrics_listen(self) -> Optional[str]:
+        return self.get_raw('METRICS_LISTEN')
+
+    def admin_id(self) -> Optional[int]:
+        return self.get_int('ADMIN_ID')
+
+    def sql_trace(self) -> Optional[bool]:
+        return self.get_bool('SQL_TRACE')
+
+    def sql_slow_seconds(self) -> Optional[float]:
+        return self.get_float('SQL_SLOW_SECONDS')
+
+    def record_updates(self) -> Optional[bool]:
+        return self.get_bool('RECORD_UPDATES')
+
+    def backup_interval(self) -> Optional[float]:
+        return self.get_float('BACKUP_INTERVAL')
+
+    def backup_dir(self) -> Optional[str]:
+        return self.get_raw('BACKUP_DIR')
+
+    def backup_keep(self) -> Optional[int]:
+        return self.get_int('BACKUP_KEEP')
+
+
+class EnvConfigurationSource(KeyValueConfigurationSource):
+
+    def get_raw(self, key: str) -> Optional[str]:
+        return os.getenv(key)
+
+
+class FileConfigurationSource(KeyValueConfigurationSource):
+    """
+    INI file with options in `SECTION`, named as lowercase environment variables:
+
+        [multi_vote_bot]
+        token = 123:abc
+        sqlite_pool_size = 16
+    """
+
+    def __init__(self, path: str):
+        self.parser = configparser.ConfigParser(interpolation=None)
+        try:
+            with open(path, encoding='utf-8') as f:
+                self.parser.read_file(f)
+        except (OSError, configparser.Error) as e:
+            raise ConfigurationError("Can not read configuration file {}: {}".format(path, e))
+
+    def get_raw(self, key: str) -> Optional[str]:
+        return self.parser.get(SECTION, key.lower(), fallback=None)
+
+
+class ArgsConfigurationSource(KeyValueConfigurationSource):
+    """
+    command line options, named as environment variables in lowercase with dashes, e.g.
+    `--webhook-url`.
+    """
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+
+    def get_raw(self, key: str) -> Optional[str]:
+        return getattr(self.args, key.lower(), None)
+
 
 @dataclass
 class PartialConfiguration:
@@ -66,6 +326,30 @@ class PartialConfiguration:
     webhook_url: Optional[str]
     port: Optional[int]
     listen: Optional[str]
+    data_dir: Optional[str] = None
+    workers: Optional[int] = None
+    con_pool_size: Optional[int] = None
+    sqlite_pool_size: Optional[int] = None
+    sqlite_synchronous: Optional[str] = None
+    sqlite_mmap_size: Optional[int] = None
+    sqlite_cache_size: Optional[int] = None
+    render_cache_size: Optional[int] = None
+    render_cache_weight: Optional[int] = None
+    profiles_cache_size: Optional[int] = None
+    edit_interval: Optional[float] = None
+    votes_write_behind: Optional[bool] = None
+    votes_flush_interval: Optional[float] = None
+    votes_flush_batch: Optional[int] = None
+    lanes: Optional[int] = None
+    metrics_port: Optional[int] = None
+    metrics_listen: Optional[str] = None
+    admin_id: Optional[int] = None
+    sql_trace: Optional[bool] = None
+    sql_slow_seconds: Optional[float] = None
+    record_updates: Optional[bool] = None
+    backup_interval: Optional[float] = None
+    backup_dir: Optional[str] = None
+    backup_keep: Optional[int] = None
 
     def merge_from(self, other: 'PartialConfiguration') -> 'PartialConfiguration':
         d = {
@@ -83,6 +367,30 @@ class PartialConfiguration:
             webhook_url=self.webhook_url,
             port=self.port,
             listen=self.listen,
+            data_dir=self.data_dir or DEFAULT_DATA_DIR,
+            workers=self.workers or 4,
+            con_pool_size=self.con_pool_size,
+            sqlite_pool_size=self.sqlite_pool_size or 8,
+            sqlite_synchronous=self.sqlite_synchronous or 'NORMAL',
+            sqlite_mmap_size=self.sqlite_mmap_size if self.sqlite_mmap_size is not None else 64 * 1024 * 1024,
+            sqlite_cache_size=self.sqlite_cache_size if self.sqlite_cache_size is not None else -8 * 1024,
+            render_cache_size=self.render_cache_size if self.render_cache_size is not None else 1024,
+            render_cache_weight=self.render_cache_weight if self.render_cache_weight is not None else 16 * 1024 * 1024,
+            profiles_cache_size=self.profiles_cache_size if self.profiles_cache_size is not None else 64 * 1024,
+            edit_interval=self.edit_interval if self.edit_interval is not None else 1.0,
+            votes_write_behind=self.votes_write_behind or False,
+            votes_flush_interval=self.votes_flush_interval or 0.05,
+            votes_flush_batch=self.votes_flush_batch or 1000,
+            lanes=self.lanes or 0,
+            metrics_port=self.metrics_port,
+            metrics_listen=self.metrics_listen or '127.0.0.1',
+            admin_id=self.admin_id,
+            sql_trace=self.sql_trace or False,
+            sql_slow_seconds=self.sql_slow_seconds if self.sql_slow_seconds is not None else 0.05,
+            record_updates=self.record_updates or False,
+            backup_interval=self.backup_interval or None,
+            backup_dir=self.backup_dir,
+            backup_keep=self.backup_keep if self.backup_keep is not None else 7,
         )
 
 
@@ -92,6 +400,37 @@ class Configuration:
     webhook_url: Optional[str]
     port: Optional[int]
     listen: Optional[str]
+    data_dir: str
+    workers: int
+    con_pool_size: Optional[int]
+    """None for enough connections for all workers and lanes."""
+    sqlite_pool_size: int
+    sqlite_synchronous: str
+    sqlite_mmap_size: int
+    sqlite_cache_size: int
+    render_cache_size: int
+    render_cache_weight: int
+    profiles_cache_size: int
+    edit_interval: float
+    votes_write_behind: bool
+    votes_flush_interval: float
+    votes_flush_batch: int
+    lanes: int
+    metrics_port: Optional[int]
+    """None to disable metrics."""
+    metrics_listen: str
+    admin_id: Optional[int]
+    """telegram user id of the operator of the bot, allowed to run admin commands."""
+    sql_trace: bool
+    sql_slow_seconds: float
+    record_updates: bool
+    """record incoming updates into `updates` directory in data directory, see `recorder`."""
+    backup_interval: Optional[float]
+    """seconds between backups, None to disable them."""
+    backup_dir: Optional[str]
+    """None for `backups` directory in data directory."""
+    backup_keep: int
+    """0 to keep all backups."""
 
     @classmethod
     def get_from_env(cls) -> 'PartialConfiguration':
@@ -99,15 +438,79 @@ class Configuration:
         return source.partial()
 
     @classmethod
-    def get(cls) -> 'Configuration':
+    def get_from_file(cls, path: str) -> 'PartialConfiguration':
+        source = FileConfigurationSource(path)
+        return source.partial()
+
+    @classmethod
+    def get_from_args(cls, args: argparse.Namespace) -> 'PartialConfiguration':
+        source = ArgsConfigurationSource(args)
+        return source.partial()
+
+    @classmethod
+    def parse_args(cls, argv: Optional[List[str]] = None) -> argparse.Namespace:
         """
-        Merge and get combined configuration from environment and command line options.
+        parse command line: an option for every configuration key, and a few actions.
 
-        NOTE: currently supports only environment variables.
+        :param argv: arguments without program name, defaults to `sys.argv[1:]`.
         """
+        parser = argparse.ArgumentParser(
+            description="multiple-choice polls in telegram.",
+            epilog="every option can also be set by an environment variable, e.g. "
+                   "WEBHOOK_URL for --webhook-url, or in the [{}] section of a configuration "
+                   "file, e.g. webhook_url.  command line overrides environment, which "
+                   "overrides configuration file.".format(SECTION))
+        parser.add_argument('--config', metavar='FILE',
+                            help="configuration file, also CONFIG environment variable")
+        parser.add_argument('--print-config', action='store_true',
+                            help="print effective configuration and exit")
+        parser.add_argument('--migrate', action='store_true',
+                            help="apply database migrations and exit; needs no token")
+        parser.add_argument('--backup', action='store_true',
+                            help="back up the database into backup directory and exit; needs no token")
+        for field in fields(PartialConfiguration):
+            parser.add_argument('--' + field.name.replace('_', '-'), dest=field.name, metavar='VALUE')
+        return parser.parse_args(argv)
+
+    @classmethod
+    def get(cls, args: Optional[argparse.Namespace] = None) -> 'Configuration':
+        """
+        Merge and get combined configuration from configuration file, environment and
+        command line options, latter ones taking precedence.
+
+        :param args: result of `parse_args`, defaults to parsing `sys.argv`.
+        """
+        return cls.get_partial(args).build()
+
+    @classmethod
+    def get_partial(cls, args: Optional[argparse.Namespace] = None) -> 'PartialConfiguration':
+        """
+        combined configuration as in `get`, without defaults and required values.
+        """
+        if args is None:
+            args = cls.parse_args()
+
         builder = PartialConfiguration(None, None, None, None)
 
-        partial = cls.get_from_env()
-        builder = builder.merge_from(partial)
+        path = args.config or os.getenv('CONFIG')
+        if path is not None:
+            builder = builder.merge_from(cls.get_from_file(path))
 
-        return builder.build()
+        builder = builder.merge_from(cls.get_from_env())
+        builder = builder.merge_from(cls.get_from_args(args))
+
+        return builder
+
+    def dump(self) -> str:
+        """
+        configuration in the format of configuration file, with the token hidden.
+        """
+        lines = ['[{}]'.format(SECTION)]
+        for key, value in asdict(self).items():
+            if key == 'token':
+                value = value.split(':', 1)[0] + ':***'
+            if value is None:
+                lines.append('# {} ='.format(key))
+            else:
+                lines.append('{} = {}'.format(key, value))
+        return '\n'.join(lines) + '\n'
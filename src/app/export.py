@@ -0,0 +1,197 @@
+"""
+export of poll statistics.
+
+voters are streamed from a database cursor straight into a spooled temporary file, which
+stays in memory while small and rolls over to disk otherwise, so exporting a poll with
+any number of votes never holds all of them in memory at once.
+
+formats:
+- json: a single document, same layout as the one built with `json.dumps(indent=4)`;
+- jsonl: one JSON object per vote;
+- csv: one row per vote, with a header.
+
+once uploaded, a document is remembered by its Telegram file_id, so it can be sent again
+without generating and uploading it, as long as the poll's version hasn't changed.
+"""
+import csv
+import json
+import time
+from itertools import groupby
+from tempfile import SpooledTemporaryFile
+from typing import Dict, Iterator, Optional, Tuple
+
+from .fs import connection
+from .model.answer import Answer
+from .model.poll import Poll
+
+FORMATS = ('json', 'jsonl', 'csv')
+
+SPOOL_SIZE = 1024 * 1024
+
+# seconds to remember file_id of an uploaded document
+DOCUMENTS_MAX_AGE = 7 * 24 * 60 * 60
+
+VOTER_FIELDS = ('id', 'first_name', 'last_name', 'username')
+
+
+class _Utf8Writer:
+    """text-mode adapter for a binary file, for `csv.writer`."""
+
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, text: str):
+        self.file.write(text.encode('utf-8'))
+
+
+def _answers(poll: Poll) -> Iterator[Tuple[Answer, Iterator[Dict[str, Optional[str]]]]]:
+    """
+    stream answers of a poll with their voters from a single cursor.
+
+    voters of each answer are ordered by user id descending, same as `Answer.query_many`,
+    and must be consumed before the next answer.
+    """
+    answers: Dict[int, Answer] = {answer.id: answer for answer in poll.answers()}
+
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT
+                a.id         AS answer_id,
+                u.id         AS id,
+                u.first_name AS first_name,
+                u.last_name  AS last_name,
+                u.username   AS username
+              FROM answers a
+              LEFT JOIN votes v
+                ON v.poll_id = a.poll_id AND v.answer_id = a.id
+              LEFT JOIN users u
+                ON u.id = v.user_id
+             WHERE a.poll_id = ?
+             ORDER BY a.id ASC, u.id DESC
+            """, (poll.id,))
+
+        for answer_id, rows in groupby(cur, key=lambda row: row['answer_id']):
+            answer = answers.get(answer_id)
+            if answer is None:
+                # added after the poll was loaded
+                continue
+            yield answer, ({
+                k: row[k]
+                for k in VOTER_FIELDS
+                if row[k]
+            } for row in rows if row['id'] is not None)
+
+
+def filename(poll: Poll, fmt: str) -> str:
+    return "statistics for poll #{}.{}".format(poll.id, fmt)
+
+
+def export(poll: Poll, fmt: str) -> SpooledTemporaryFile:
+    """
+    write statistics of a poll in a given format.
+
+    :param poll: poll loaded in any mode; voters are read from the database.
+    :param fmt: one of `FORMATS`.
+    :return: file positioned at the beginning.
+    """
+    assert fmt in FORMATS
+
+    f = SpooledTemporaryFile(max_size=SPOOL_SIZE, mode='w+b')
+    writer = _Utf8Writer(f)
+
+    if fmt == 'json':
+        _write_json(writer, poll)
+    elif fmt == 'jsonl':
+        _write_jsonl(writer, poll)
+    else:
+        _write_csv(writer, poll)
+
+    f.seek(0)
+    return f
+
+
+def cached_file_id(poll: Poll, fmt: str) -> Optional[str]:
+    """
+    file_id of a document previously uploaded for the same version of the poll.
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT file_id FROM stats_documents
+             WHERE poll_id = ? AND format = ? AND version = ? AND created_at >= ?
+            """, (poll.id, fmt, poll.version, int(time.time()) - DOCUMENTS_MAX_AGE))
+        row = cur.fetchone()
+
+    if row is not None:
+        return row['file_id']
+
+
+def remember_file_id(poll: Poll, fmt: str, file_id: str):
+    """
+    remember file_id of an uploaded document, and forget documents older than `DOCUMENTS_MAX_AGE`.
+    """
+    now = int(time.time())
+
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT OR REPLACE INTO stats_documents (poll_id, format, version, file_id, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            """, (poll.id, fmt, poll.version, file_id, now))
+        cur.execute("""DELETE FROM stats_documents WHERE created_at < ?""",
+                    (now - DOCUMENTS_MAX_AGE,))
+
+
+def forget_file_id(poll: Poll, fmt: str):
+    with connection() as conn:
+        conn.execute("""DELETE FROM stats_documents WHERE poll_id = ? AND format = ?""",
+                     (poll.id, fmt))
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _write_json(writer: _Utf8Writer, poll: Poll):
+    indent = ' ' * 4
+
+    writer.write('{\n' + indent + '"answers": [')
+    empty_poll = True
+    for answer, voters in _answers(poll):
+        writer.write((',\n' if not empty_poll else '\n') + indent * 2 + '{\n')
+        empty_poll = False
+        writer.write(indent * 3 + '"id": {},\n'.format(_dumps(answer.id)))
+        writer.write(indent * 3 + '"text": {},\n'.format(_dumps(answer.text)))
+        writer.write(indent * 3 + '"voters": {\n')
+        writer.write(indent * 4 + '"total": {},\n'.format(_dumps(answer.count())))
+        writer.write(indent * 4 + '"_": [')
+
+        empty = True
+        for voter in voters:
+            writer.write((',\n' if not empty else '\n') + indent * 5)
+            writer.write(
+                json.dumps(voter, indent=4, ensure_ascii=False).replace('\n', '\n' + indent * 5))
+            empty = False
+
+        writer.write(']' if empty else '\n' + indent * 4 + ']')
+        writer.write('\n' + indent * 3 + '}\n' + indent * 2 + '}')
+
+    writer.write(']' if empty_poll else '\n' + indent + ']')
+    writer.write('\n}')
+
+
+def _write_jsonl(writer: _Utf8Writer, poll: Poll):
+    for answer, voters in _answers(poll):
+        for voter in voters:
+            record = {'answer_id': answer.id, 'answer': answer.text}
+            record.update(voter)
+            writer.write(_dumps(record) + '\n')
+
+
+def _write_csv(writer: _Utf8Writer, poll: Poll):
+    out = csv.writer(writer)
+    out.writerow(('answer_id', 'answer') + VOTER_FIELDS)
+    for answer, voters in _answers(poll):
+        for voter in voters:
+            out.writerow((answer.id, answer.text) + tuple(voter.get(k, '') for k in VOTER_FIELDS))
@@ -6,8 +6,10 @@ tables:
   - id PRIMARY KEY
   - owner_id => users.id
   - topic
+  - distinct_voters: number of unique voters, maintained by triggers on votes
+  - version: incremented by triggers on every change of votes
 
-- users:
+- users: written through `model.user.UserProfiles`
   - id PRIMARY KEY
   - first_name
   - last_name
@@ -22,35 +24,398 @@ tables:
   - user_id => users.id
   - poll_id => polls.id
   - answer_id => answers.id
+  - UNIQUE (poll_id, answer_id, user_id)
+
+- answer_counts: maintained by triggers on answers and votes
+  - answer_id PRIMARY KEY => answers.id
+  - poll_id => polls.id
+  - votes
+
+- user_states: draft of a poll being created, see `state.UserState`
+  - id PRIMARY KEY => users.id
+  - state: JSON with the topic
+
+- draft_answers: answers of a draft, appended one by one
+  - user_id => users.id
+  - position
+  - txt
+  - PRIMARY KEY (user_id, position)
+
+- polls_search: FTS5 index, written by `Poll.store`
+  - rowid => polls.id
+  - owner: 'u' || owner_id
+  - topic
+  - answers: texts of all answers, one per line
 """
 
+import hashlib
 import os
-from os.path import expanduser, join
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from os.path import abspath, dirname, join
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Type
 
-from yoyo import get_backend, read_migrations
+from . import log, metrics
+from .config import DEFAULT_DATA_DIR
 
-from . import log
+if TYPE_CHECKING:
+    from .sqltrace import SQLTracer
 
 logger = log.getLogger('app.fs')
 
-DATA_DIR: str = expanduser("~/.local/share/multi_vote_bot")
-if not os.path.exists(DATA_DIR):
-    logger.info("Creating data dir at path %s", DATA_DIR)
-    os.makedirs(DATA_DIR, exist_ok=True)
-
+DATA_DIR: str = DEFAULT_DATA_DIR
 DB_PATH: str = join(DATA_DIR, "data.db")
 
+# migrations in the repository root, wherever the bot is started from
+MIGRATIONS_DIR = join(dirname(dirname(dirname(abspath(__file__)))), 'migrations')
+
+
+def schema_version(migrations_dir: Optional[str] = None) -> int:
+    """
+    version of the schema made by all migrations in a directory, for `PRAGMA user_version`.
+
+    it is a hash of ids of migrations, so it only takes a directory listing to compute.
+
+    :param migrations_dir: `MIGRATIONS_DIR` by default.
+    """
+    migrations_dir = migrations_dir or MIGRATIONS_DIR
+    ids = sorted(name[:-len('.py')] for name in os.listdir(migrations_dir)
+                 if name.endswith('.py') and not name.startswith('_'))
+    digest = hashlib.sha256('\n'.join(ids).encode('utf-8')).digest()
+    # user_version is a signed 32-bit integer, and 0 means no version
+    return int.from_bytes(digest[:4], 'big') & 0x7fffffff or 1
+
+
+def schema_is_current(migrations_dir: Optional[str] = None) -> bool:
+    """whether all migrations have been applied to `DB_PATH`, without yoyo."""
+    if not os.path.exists(DB_PATH):
+        return False
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        (version,), = conn.execute("PRAGMA user_version").fetchall()
+    finally:
+        conn.close()
+    return version == schema_version(migrations_dir)
+
+
+def migrate(force: bool = False, migrations_dir: Optional[str] = None) -> bool:
+    """
+    apply yoyo migrations, unless `schema_is_current`.
+
+    :param force: run yoyo even if the schema looks current.
+    :param migrations_dir: `MIGRATIONS_DIR` by default.
+    :return: whether yoyo has been run.
+    """
+    migrations_dir = migrations_dir or MIGRATIONS_DIR
+    if not force and schema_is_current(migrations_dir):
+        logger.debug("Schema is current")
+        return False
+
+    # yoyo takes a while to import, and it is not needed when the schema is current
+    from yoyo import get_backend, read_migrations
 
-def migrate():
-    """ apply yoyo migrations """
     logger.info("Migrating to the latest schema")
     log.getLogger('yoyo').setLevel(log.DEBUG)
 
     backend = get_backend('sqlite:///' + DB_PATH)
-    migrations = read_migrations('./migrations')
+    migrations = read_migrations(migrations_dir)
     with backend.lock():
         backend.apply_migrations(backend.to_apply(migrations))
 
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        with conn:
+            conn.execute("PRAGMA user_version = {:d}".format(schema_version(migrations_dir)))
+    finally:
+        conn.close()
+    return True
+
+
+sql_queries = metrics.counter(
+    'sqlite_queries_total', "SQL statements executed, by call site", ('site',))
+sql_seconds = metrics.counter(
+    'sqlite_query_seconds_total', "time spent executing SQL statements, by call site", ('site',))
+
+
+def _call_site(depth: int) -> str:
+    frame = sys._getframe(depth + 1)
+    return '{}.{}'.format(frame.f_globals.get('__name__', '?'), frame.f_code.co_name)
+
+
+# receives every statement executed over `TimedConnection`s, if set
+tracer: Optional['SQLTracer'] = None
+
+
+def _timed(site: str, method: Callable, cursor: sqlite3.Cursor, *args):
+    started = time.perf_counter()
+    try:
+        return method(cursor, *args)
+    finally:
+        elapsed = time.perf_counter() - started
+        sql_seconds.inc(site, amount=elapsed)
+        sql_queries.inc(site)
+        if tracer is not None:
+            tracer.record(site, elapsed, cursor.connection,
+                          method is sqlite3.Cursor.executemany, *args)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    cursor which counts and times statements by the function which executes them, and
+    passes them on to `tracer`.
+
+    only execution is timed, rows fetched later are not.
+    """
+
+    def execute(self, *args):
+        return _timed(_call_site(1), sqlite3.Cursor.execute, self, *args)
+
+    def executemany(self, *args):
+        return _timed(_call_site(1), sqlite3.Cursor.executemany, self, *args)
+
+
+class TimedConnection(sqlite3.Connection):
+    """connection which creates `TimedCursor`s, also for its shortcut methods."""
+
+    def cursor(self, factory: Type[sqlite3.Cursor] = TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return _timed(_call_site(1), sqlite3.Cursor.execute, self.cursor(), *args)
+
+    def executemany(self, *args):
+        return _timed(_call_site(1), sqlite3.Cursor.executemany, self.cursor(), *args)
+
+
+# seconds between checks whether the pool has been closed, while waiting for a connection
+ACQUIRE_POLL_INTERVAL = 1.0
+
+
+class PoolClosedError(RuntimeError):
+    pass
+
+
+class ConnectionPool:
+    """
+    thread-safe pool of SQLite connections to a single database file.
+
+    connections are opened lazily up to `size`, switched to WAL mode, so readers don't block
+    the writer, and tuned with the given pragmas.  each connection caches up to
+    `cached_statements` prepared statements, which is why they are kept open and reused.
+
+    a thread which already holds a connection gets the same one back from nested
+    `connection()` calls, so they share one transaction.  in-memory state which mirrors the
+    database should be updated from `on_commit` callbacks, which are dropped on rollback.
+    """
+
+    def __init__(self, path: str,
+                 size: int = 8,
+                 synchronous: str = 'NORMAL',
+                 mmap_size: int = 64 * 1024 * 1024,
+                 cache_size: int = -8 * 1024,
+                 cached_statements: int = 256,
+                 timeout: float = 5.0,
+                 factory: Type[sqlite3.Connection] = sqlite3.Connection):
+        """
+        :param path: database file path.
+        :param size: maximum number of open connections.
+        :param synchronous: value for `PRAGMA synchronous`; NORMAL is safe in WAL mode.
+        :param mmap_size: value for `PRAGMA mmap_size`, in bytes.
+        :param cache_size: value for `PRAGMA cache_size`; negative values are in KiB.
+        :param cached_statements: size of per-connection prepared statements cache.
+        :param timeout: how long to wait for a database lock, in seconds.
+        :param factory: connection class, e.g. `TimedConnection`.
+        """
+        assert size >= 1
+
+        self.path = path
+        self.size = size
+        self.pragmas: Dict[str, str] = {
+            'journal_mode': 'WAL',
+            'synchronous': synchronous,
+            'mmap_size': str(mmap_size),
+            'cache_size': str(cache_size),
+            'busy_timeout': str(int(timeout * 1000)),
+        }
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        self.factory = factory
+
+        self._idle: 'queue.LifoQueue[sqlite3.Connection]' = queue.LifoQueue()
+        self._all: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        self._closed = False
+        self._opening = 0
+
+        self.acquisitions = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path,
+                               timeout=self.timeout,
+                               check_same_thread=False,
+                               cached_statements=self.cached_statements,
+                               factory=self.factory)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute("PRAGMA {} = {}".format(name, value))
+        logger.debug("opened connection #%d to %s", len(self._all) + 1, self.path)
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise PoolClosedError("connection pool of {} is closed".format(self.path))
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            opening = len(self._all) + self._opening < self.size
+            if opening:
+                self._opening += 1
+        if opening:
+            # opening a connection takes a while, don't make others wait for the lock
+            try:
+                conn = self._open()
+            finally:
+                with self._lock:
+                    self._opening -= 1
+            with self._lock:
+                self._all.append(conn)
+            return conn
+
+        started = time.perf_counter()
+        while True:
+            try:
+                conn = self._idle.get(timeout=ACQUIRE_POLL_INTERVAL)
+                break
+            except queue.Empty:
+                if self._closed:
+                    raise PoolClosedError("connection pool of {} is closed".format(self.path))
+        waited = time.perf_counter() - started
+
+        with self._lock:
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+        if waited > 0.1:
+            logger.warning("waited %.3f seconds for a database connection", waited)
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        borrow a connection for the duration of a `with` block.
+
+        outermost block commits on success and rolls back on exception.
+        """
+        conn: Optional[sqlite3.Connection] = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self._acquire()
+        self.acquisitions += 1
+        self._local.conn = conn
+        self._local.on_commit = callbacks = []
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._local.conn = None
+            self._local.on_commit = None
+            self._release(conn)
+
+        for callback in callbacks:
+            callback()
+
+    def _release(self, conn: sqlite3.Connection):
+        with self._lock:
+            if not self._closed:
+                self._idle.put(conn)
+                return
+            self._all.remove(conn)
+        conn.close()
+
+    def on_commit(self, callback: Callable[[], None]):
+        """
+        call `callback` once the current thread's outermost transaction is committed.
+
+        must be called inside a `connection()` block.
+        """
+        callbacks: Optional[List[Callable[[], None]]] = getattr(self._local, 'on_commit', None)
+        assert callbacks is not None, "not in a transaction"
+        callbacks.append(callback)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'connections': len(self._all),
+            'idle': self._idle.qsize(),
+            'acquisitions': self.acquisitions,
+            'wait_time': self.wait_time,
+            'max_wait_time': self.max_wait_time,
+        }
+
+    def close(self):
+        """
+        close idle connections.  connections in use are closed when returned, and threads
+        waiting for a connection get `PoolClosedError`.
+        """
+        with self._lock:
+            self._closed = True
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                conn.close()
+                self._all.remove(conn)
+
+
+pool = ConnectionPool(DB_PATH)
+
+
+def configure_data_dir(path: str):
+    """
+    move `DATA_DIR` and the database in it to another path, creating it if needed.
+
+    must be called before `migrate` and `configure_pool`.
+    """
+    global DATA_DIR, DB_PATH
+    if not os.path.exists(path):
+        logger.info("Creating data dir at path %s", path)
+        os.makedirs(path, exist_ok=True)
+
+    DATA_DIR = path
+    DB_PATH = join(DATA_DIR, "data.db")
+
+
+def configure_pool(**kw) -> ConnectionPool:
+    """
+    replace shared connection pool with a new one for `DB_PATH`.
+
+    :param kw: keyword arguments for `ConnectionPool`.
+    """
+    global pool
+    old, pool = pool, ConnectionPool(DB_PATH, **kw)
+    old.close()
+    logger.info("SQLite connection pool: size %d, pragmas %s", pool.size, pool.pragmas)
+    return pool
+
+
+def connection():
+    """ borrow a connection from the shared pool, see `ConnectionPool.connection` """
+    return pool.connection()
+
 
-# auto migrate when imported
-migrate()
+def on_commit(callback: Callable[[], None]):
+    """ see `ConnectionPool.on_commit` """
+    pool.on_commit(callback)
@@ -0,0 +1,126 @@
+"""
+serial lanes for handling updates.
+
+updates which concern the same poll must be handled in order, one at a time, while
+updates of different polls may run in parallel.  each poll is hashed onto one of a fixed
+set of lanes, and every lane is a single worker thread with its own queue.
+"""
+import queue
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional
+
+from . import log
+
+logger = log.getLogger(__name__)
+
+Task = Callable[[], None]
+
+
+class _Lane:
+    __slots__ = ('queue', 'thread', 'max_depth', 'completed', 'wait_time', 'max_wait_time')
+
+    def __init__(self):
+        self.queue: 'queue.Queue[Optional[tuple]]' = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+        self.max_depth = 0
+        self.completed = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+
+class Lanes:
+    """
+    fixed set of serial executors, selected by hash of a key.
+
+    tasks with equal keys run in the order they were submitted, never concurrently.
+    """
+
+    def __init__(self, count: int):
+        """
+        :param count: number of lanes, i.e. worker threads.
+        """
+        assert count >= 1
+
+        self._lanes: List[_Lane] = [_Lane() for _ in range(count)]
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.failures = 0
+
+    def __len__(self):
+        return len(self._lanes)
+
+    def start(self):
+        for i, lane in enumerate(self._lanes):
+            lane.thread = threading.Thread(target=self._run, args=(lane,),
+                                           name='lane-{}'.format(i), daemon=True)
+            lane.thread.start()
+        logger.info("serial lanes: %d", len(self._lanes))
+
+    def stop(self):
+        """run all submitted tasks and stop worker threads."""
+        for lane in self._lanes:
+            lane.queue.put(None)
+        for lane in self._lanes:
+            if lane.thread is not None:
+                lane.thread.join()
+                lane.thread = None
+
+    def lane(self, key: Hashable) -> int:
+        """index of the lane for a key."""
+        return hash(key) % len(self._lanes)
+
+    def submit(self, key: Hashable, task: Task):
+        """
+        queue a task on the lane of `key`.
+
+        :param key: e.g. poll id.
+        :param task: function to run; exceptions are logged, see `_run`.
+        """
+        lane = self._lanes[self.lane(key)]
+        lane.queue.put((time.perf_counter(), task))
+
+        with self._lock:
+            self.submitted += 1
+            lane.max_depth = max(lane.max_depth, lane.queue.qsize())
+
+    def _run(self, lane: _Lane):
+        while True:
+            item = lane.queue.get()
+            if item is None:
+                return
+
+            submitted, task = item
+            waited = time.perf_counter() - submitted
+            try:
+                task()
+            except Exception:
+                logger.exception("task failed in lane %s", threading.current_thread().name)
+                with self._lock:
+                    self.failures += 1
+
+            with self._lock:
+                lane.completed += 1
+                lane.wait_time += waited
+                lane.max_wait_time = max(lane.max_wait_time, waited)
+
+    def depths(self) -> List[int]:
+        """number of queued tasks in each lane."""
+        return [lane.queue.qsize() for lane in self._lanes]
+
+    def stats(self) -> Dict[str, float]:
+        depths = self.depths()
+        with self._lock:
+            completed = sum(lane.completed for lane in self._lanes)
+            return {
+                'lanes': len(self._lanes),
+                'submitted': self.submitted,
+                'completed': completed,
+                'failures': self.failures,
+                'depth': sum(depths),
+                'max_lane_depth': max(depths),
+                'max_depth': max(lane.max_depth for lane in self._lanes),
+                'wait_time': sum(lane.wait_time for lane in self._lanes),
+                'max_wait_time': max(lane.max_wait_time for lane in self._lanes),
+            }
@@ -13,20 +13,28 @@ Notes:
                 update poll view in private chat with poll's owner.
             - .admin_vote <poll_id>
                 poll's owner want to vote him/herself, show keyboard with answers.
-            - .stats <poll_id>
-                upload statistics in json to poll's owner.
+            - .stats <poll_id> [json|jsonl|csv]
+                upload statistics to poll's owner, in json by default.
+            - .manage <offset> [next|prev <poll_id>]
+                page of owner's polls list, starting after (next) or before (prev) <poll_id>.
 """
-import json
+import contextlib
+import functools
+import html
 import re
+import signal
+import sqlite3
 import sys
+import time
 import urllib.parse
 import warnings
-from io import BytesIO
-from typing import Callable, List, Optional, TypeVar
+from os.path import join
+from typing import Callable, Hashable, Iterator, List, NamedTuple, Optional, Tuple, TypeVar
 from uuid import uuid4
 
 from dotenv import load_dotenv
 from telegram import (
+    Bot,
     CallbackQuery,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
@@ -34,9 +42,11 @@ from telegram import (
     InlineQueryResultArticle,
     InputTextMessageContent,
     Message,
+    ParseMode,
     Update,
     User,
 )
+from telegram.error import BadRequest
 from telegram.ext import (
     CallbackContext,
     CallbackQueryHandler,
@@ -44,17 +54,28 @@ from telegram.ext import (
     ConversationHandler,
     Dispatcher,
     Filters,
+    Handler as UpdateHandler,
     InlineQueryHandler,
     MessageHandler,
+    TypeHandler,
     Updater,
 )
 
-from . import log
-from .config import Configuration
+from . import backup, export, fs, log, metrics
+from .cache import LRUCache
+from .coalesce import EditCoalescer
+from .config import DEFAULT_DATA_DIR, Configuration
 from .filters import FiltersExt
+from .lanes import Lanes
 from .model.answer import Answer
-from .model.poll import MAX_ANSWERS, MAX_POLLS_PER_USER, Poll
-from .paginate import paginate
+from .model.poll import MAX_ANSWERS, Poll, PollSummary, Tally
+from .model.user import profiles as user_profiles
+from .model.vote_queue import VoteQueue
+from .paginate import paginate_keyset
+from .profiling import MODES as PROFILE_MODES, Profiler
+from .recorder import UpdateRecorder
+from .request import TimedRequest
+from .sqltrace import SQLTracer
 from .state import PersistentConversationHandler, StateManager
 from .util import ignore_not_modified
 
@@ -65,6 +86,13 @@ logger.setLevel(log.INFO)
 
 POLLS_PER_PAGE = 5
 
+# defaults, overridden by configuration in `main`
+RENDER_CACHE_SIZE = 1024
+RENDER_CACHE_WEIGHT = 16 * 1024 * 1024
+
+# seconds between edits of the same poll message
+EDIT_INTERVAL = 1.0
+
 ###############################################################################
 # utils
 ###############################################################################
@@ -72,18 +100,21 @@ POLLS_PER_PAGE = 5
 HandlerCallback = Callable[[Update, CallbackContext], Optional[int]]
 
 
-def inline_keyboard_markup_answers(poll: Poll) -> InlineKeyboardMarkup:
+def inline_keyboard_markup_answers(poll: Poll, tally: Optional[Tally] = None) -> InlineKeyboardMarkup:
     def text(title: str, count: int):
         if count == 0:
             return title
         else:
             return "{} - {}".format(title, count)
 
+    if tally is None:
+        tally = poll.tally()
+
     keyboard = [
         [InlineKeyboardButton(
-            text(answer.text, len(answer.voters())),
+            text(answer.text, count),
             callback_data=".vote {} {}".format(poll.id, answer.id))]
-        for answer in poll.answers()]
+        for answer, count in zip(poll.answers(), tally.counts)]
     return InlineKeyboardMarkup(keyboard)
 
 
@@ -94,31 +125,227 @@ def inline_keyboard_markup_admin(poll: Poll) -> InlineKeyboardMarkup:
         [
             InlineKeyboardButton("update", callback_data=".update {}".format(poll.id)),
             InlineKeyboardButton("vote", callback_data=".admin_vote {}".format(poll.id))],
-        [InlineKeyboardButton("statistics", callback_data=".stats {}".format(poll.id))],
+        [
+            InlineKeyboardButton("statistics", callback_data=".stats {}".format(poll.id)),
+            InlineKeyboardButton("csv", callback_data=".stats {} csv".format(poll.id)),
+            InlineKeyboardButton("json lines", callback_data=".stats {} jsonl".format(poll.id))],
     ]
 
     return InlineKeyboardMarkup(keyboard)
 
 
+class RenderedPoll(NamedTuple):
+    """
+    everything needed to send or edit a poll message.
+
+    keyboards are serialized once, Bot API methods accept them as JSON strings as is.
+    """
+    text: str
+    answers: InlineKeyboardMarkup
+    """answers keyboard as an object, for inline query results."""
+    answers_json: str
+    admin_json: str
+
+
+# cached by poll id, each entry holds (poll version, RenderedPoll)
+render_cache: LRUCache[int, Tuple[int, RenderedPoll]] = LRUCache(
+    max_entries=RENDER_CACHE_SIZE,
+    max_weight=RENDER_CACHE_WEIGHT,
+    weigh=lambda entry: sum(map(len, (entry[1].text, entry[1].answers_json, entry[1].admin_json))))
+
+
+def render_poll(poll: Poll) -> RenderedPoll:
+    """
+    render text and keyboards of a poll message, or get them from `render_cache`.
+
+    text and answers keyboard are rendered from a single tally.
+    """
+    key = poll.id
+    if key is not None and poll.version is not None:
+        entry = render_cache.get(key)
+        if entry is not None and entry[0] == poll.version:
+            return entry[1]
+
+    tally = poll.tally()
+    answers = inline_keyboard_markup_answers(poll, tally)
+    rendered = RenderedPoll(
+        text=poll.render(tally),
+        answers=answers,
+        answers_json=answers.to_json(),
+        admin_json=inline_keyboard_markup_admin(poll).to_json(),
+    )
+
+    if key is not None and poll.version is not None:
+        render_cache.put(key, (poll.version, rendered))
+
+    return rendered
+
+
+edits = EditCoalescer(EDIT_INTERVAL)
+
+# write-behind queue for votes, if enabled by configuration
+vote_queue: Optional[VoteQueue] = None
+
+# serial lanes for updates of polls, if enabled by configuration
+lanes: Optional[Lanes] = None
+
+# periodic backups of the database, if enabled by configuration
+backup_job: Optional[backup.BackupJob] = None
+
+# on-demand profiling of handlers, see `profile` and SIGUSR1
+profiler = Profiler(fs.DATA_DIR)
+
+# default duration of profiling, seconds
+PROFILE_SECONDS = 30.0
+
+# limit of text message length in telegram
+MAX_MESSAGE_LENGTH = 4096
+
+Handler = Callable[[Update, CallbackContext], None]
+
+
+@contextlib.contextmanager
+def sql_trace(update: Update, name: str) -> Iterator[None]:
+    """summary of SQL statements executed by handler `name`, if `fs.tracer` is installed."""
+    tracer = fs.tracer
+    if tracer is None:
+        yield
+    else:
+        with tracer.update('{} of update {}'.format(name, update.update_id)):
+            yield
+
+
+handler_seconds = metrics.histogram(
+    'bot_handler_seconds', "time of handling updates, by handler", ('handler',))
+handler_errors = metrics.counter(
+    'bot_handler_errors_total', "exceptions raised by handlers, by handler", ('handler',))
+
+
+def timed(callback: Handler) -> Handler:
+    """
+    wrap a handler to record its time and exceptions in metrics, to profile it while
+    `profiler` is active, and to sum up its SQL statements if they are traced.
+    """
+    if getattr(callback, 'timed', False):
+        return callback
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    def wrapper(update: Update, context: CallbackContext):
+        started = time.perf_counter()
+        try:
+            with profiler.update(), sql_trace(update, name):
+                return callback(update, context)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, name)
+
+    wrapper.timed = True
+    return wrapper
+
+
+def time_handlers(handlers: List[UpdateHandler]):
+    """
+    time callbacks of all handlers, including states of conversation handlers.
+    """
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            time_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                time_handlers(state_handlers)
+            time_handlers(handler.fallbacks)
+        else:
+            handler.callback = timed(handler.callback)
+
+
+def serial(callback: Handler, key: Callable[[Update, CallbackContext], Hashable]) -> Handler:
+    """
+    wrap a handler to run on the lane of `key`, so that updates with the same key are
+    handled in order, while the dispatcher goes on with other updates.
+
+    without `lanes`, the handler runs in the dispatcher thread.  either way it is
+    `timed`, not including time spent in the queue of the lane.
+    """
+    callback = timed(callback)
+
+    @functools.wraps(callback)
+    def wrapper(update: Update, context: CallbackContext):
+        if lanes is None:
+            return callback(update, context)
+
+        def task():
+            try:
+                callback(update, context)
+            except Exception as e:
+                context.dispatcher.dispatch_error(update, e)
+
+        lanes.submit(key(update, context), task)
+
+    wrapper.timed = True
+    return wrapper
+
+
+def poll_key(update: Update, context: CallbackContext) -> Hashable:
+    """lane key of callback queries which match poll id as the first group."""
+    return int(context.match.group(1))
+
+
+def inline_query_key(update: Update, context: CallbackContext) -> Hashable:
+    """lane key of inline queries: poll id if query is one, user otherwise."""
+    inline_query: InlineQuery = update.inline_query
+    if inline_query.query.isdigit():
+        return int(inline_query.query)
+    return 'user', inline_query.from_user.id
+
+
+def load_poll(poll_id: int) -> Optional[Poll]:
+    """
+    load a poll in count-only mode, including votes queued in `vote_queue`.
+    """
+    if vote_queue is not None:
+        return vote_queue.read(lambda: Poll.load(poll_id, voters=False))
+    return Poll.load(poll_id, voters=False)
+
+
+def query_polls(user_id: int, text: str) -> List[Poll]:
+    """
+    query polls in count-only mode, including votes queued in `vote_queue`.
+    """
+    if vote_queue is not None:
+        return vote_queue.read(lambda: Poll.query(user_id, text, voters=False), lambda polls: polls)
+    return Poll.query(user_id, text, voters=False)
+
+
+def toggle_vote(answer: Answer, user: User) -> bool:
+    """
+    toggle a vote, either right away or through `vote_queue`.
+    """
+    if vote_queue is not None:
+        return vote_queue.toggle(answer, user)
+    return answer.toggle_vote(user)
+
+
 def send_vote_poll(message: Message, poll: Poll):
-    markup = inline_keyboard_markup_answers(poll)
+    rendered = render_poll(poll)
 
     message.reply_text(
-        str(poll),
+        rendered.text,
         parse_mode=None,
         disable_web_page_preview=True,
-        reply_markup=markup
+        reply_markup=rendered.answers_json
     )
 
 
 def send_admin_poll(message: Message, poll: Poll):
-    markup = inline_keyboard_markup_admin(poll)
+    rendered = render_poll(poll)
 
     message.reply_text(
-        str(poll),
+        rendered.text,
         parse_mode=None,
         disable_web_page_preview=True,
-        reply_markup=markup)
+        reply_markup=rendered.admin_json)
 
 
 ###############################################################################
@@ -139,13 +366,63 @@ def about(update: Update, context: CallbackContext):
         "then publish it to groups or send it to individual friends.")
 
 
+def send_profile(bot: Bot, chat_id: int, summary: str):
+    text = summary[:MAX_MESSAGE_LENGTH - len('<pre></pre>') - 100]
+    bot.send_message(chat_id, '<pre>{}</pre>'.format(html.escape(text)), parse_mode=ParseMode.HTML)
+
+
+def profile(update: Update, context: CallbackContext):
+    """
+    /profile [<seconds>s | <updates>u] [cprofile | sample]
+
+    profile handlers for some seconds (30 by default) or for the next updates, then send
+    top functions back.  results are written into data directory.
+    """
+    message: Message = update.message
+
+    seconds: Optional[float] = None
+    updates: Optional[int] = None
+    mode = 'cprofile'
+    for arg in context.args:
+        if arg in PROFILE_MODES:
+            mode = arg
+        elif re.fullmatch(r'\d+(\.\d+)?s?', arg):
+            seconds = float(arg.rstrip('s'))
+        elif re.fullmatch(r'\d+u', arg):
+            updates = int(arg[:-1])
+        else:
+            message.reply_text("usage: /profile [<seconds>s | <updates>u] [{}]".format(" | ".join(PROFILE_MODES)))
+            return
+    if seconds is None and updates is None:
+        seconds = PROFILE_SECONDS
+
+    started = profiler.start(seconds=seconds, updates=updates, mode=mode,
+                             done=functools.partial(send_profile, context.bot, message.chat_id))
+    if started:
+        message.reply_text("profiling {} for {}.".format(
+            mode, "{:g} seconds".format(seconds) if updates is None else "{} updates".format(updates)))
+    else:
+        message.reply_text("profiling is already running.")
+
+
+def toggle_profile(bot: Bot, admin_id: Optional[int]):
+    """
+    start profiling for `PROFILE_SECONDS`, or stop it if running; for SIGUSR1.
+    """
+    if profiler.active:
+        profiler.stop()
+    else:
+        done = functools.partial(send_profile, bot, admin_id) if admin_id is not None else None
+        profiler.start(seconds=PROFILE_SECONDS, done=done)
+
+
 def manage(update: Update, context: CallbackContext):
     message: Message = update.message
     user_id = message.from_user.id
 
-    polls = Poll.query(user_id, limit=MAX_POLLS_PER_USER)
+    text, markup = manage_polls_page(user_id, 0)
 
-    if len(polls) == 0:
+    if text is None:
         message.reply_text(
             text="you don't have any polls yet.",
             reply_markup=InlineKeyboardMarkup(
@@ -153,23 +430,63 @@ def manage(update: Update, context: CallbackContext):
 
     else:
         message.reply_text(
-            manage_polls_message(polls, 0, POLLS_PER_PAGE),
+            text,
             parse_mode=None,
             disable_web_page_preview=True,
-            reply_markup=paginate(len(polls), 0, POLLS_PER_PAGE,
-                                  manage_polls_callback_data))
+            reply_markup=markup)
+
+
+def manage_polls_page(user_id: int, offset: int,
+                      before: Optional[int] = None,
+                      after: Optional[int] = None,
+                      ) -> Tuple[Optional[str], InlineKeyboardMarkup]:
+    """
+    text and navigation keyboard of a page of user's polls.
 
+    pages are fetched by keyset pagination: "next" button carries id of the last poll on the
+    page, "previous" button carries id of the first one.  offset is only used for numbering.
+
+    :return: text of the page, or None if there are no polls.
+    """
+    if before is None and after is None:
+        # legacy links from older messages carry only an offset
+        polls = Poll.summaries(user_id, POLLS_PER_PAGE + 1, offset=offset)
+    else:
+        polls = Poll.summaries(user_id, POLLS_PER_PAGE + 1, before=before, after=after)
+
+    if after is None:
+        has_previous = offset > 0
+        has_next = len(polls) > POLLS_PER_PAGE
+        polls = polls[:POLLS_PER_PAGE]
+    else:
+        has_previous = len(polls) > POLLS_PER_PAGE
+        has_next = True
+        polls = polls[-POLLS_PER_PAGE:]
+        if not has_previous:
+            offset = 0
+
+    if len(polls) == 0:
+        return None, InlineKeyboardMarkup([])
+
+    markup = paginate_keyset(
+        manage_polls_callback_data(max(0, offset - POLLS_PER_PAGE), 'prev', polls[0].id)
+        if has_previous else None,
+        manage_polls_callback_data(offset + POLLS_PER_PAGE, 'next', polls[-1].id)
+        if has_next else None)
+
+    return manage_polls_message(polls, offset), markup
 
-def manage_polls_callback_data(offset):
-    return '.manage {}'.format(offset)
 
+def manage_polls_callback_data(offset: int, direction: str, poll_id: int) -> str:
+    return '.manage {} {} {}'.format(offset, direction, poll_id)
 
-def manage_polls_message(polls: List[Poll], offset: int, count: int) -> str:
+
+def manage_polls_message(polls: List[PollSummary], offset: int) -> str:
     text = "your polls\n\n{}".format(
         "\n\n".join(
-            "{}. {}\n/view_{}".format(i + 1, poll.topic, poll.id)
+            "{}. {}\n/view_{} \U0001f465 {}".format(i + 1, poll.topic, poll.id, poll.voters)
             for i, poll in
-            enumerate(polls[offset: offset + count], start=offset))
+            enumerate(polls, start=offset))
     )
     return text
 
@@ -178,7 +495,7 @@ def start_with_poll(update: Update, context: CallbackContext):
     message: Message = update.message
 
     poll_id = int(context.match.groups()[0])
-    poll = Poll.load(poll_id)
+    poll = load_poll(poll_id)
 
     send_vote_poll(message, poll)
 
@@ -187,7 +504,7 @@ def view_poll(update: Update, context: CallbackContext):
     message: Message = update.message
 
     poll_id = int(context.match.groups()[0])
-    poll = Poll.load(poll_id)
+    poll = load_poll(poll_id)
 
     if poll.owner.id == message.from_user.id:
         send_admin_poll(message, poll)
@@ -284,20 +601,21 @@ def inline_query(update: Update, context: CallbackContext):
     inline_query: InlineQuery = update.inline_query
     query: str = inline_query.query
 
-    polls: List[Poll] = Poll.query(inline_query.from_user.id, query)
+    polls: List[Poll] = query_polls(inline_query.from_user.id, query)
 
     results = []
     for poll in polls:
+        rendered = render_poll(poll)
         results.append(
             InlineQueryResultArticle(
                 id=str(uuid4()),
                 title=poll.topic,
                 input_message_content=InputTextMessageContent(
-                    message_text=str(poll),
+                    message_text=rendered.text,
                     parse_mode=None,
                     disable_web_page_preview=True),
                 description=" / ".join(answer.text for answer in poll.answers()),
-                reply_markup=inline_keyboard_markup_answers(poll)))
+                reply_markup=rendered.answers))
 
     inline_query.answer(
         results,
@@ -320,7 +638,7 @@ def callback_query_vote(update: Update, context: CallbackContext):
     # - 0, error: poll / answer not found due to system fault of fraud attempt
     # - 1, set: user don't have active vote in this answer in this poll
     # - 2, reset: user has active vote in this answer in this poll.
-    poll = Poll.load(poll_id)
+    poll = load_poll(poll_id)
     if poll is not None:
         answer: Answer = next((a for a in poll.answers() if a.id == answer_id), None)
 
@@ -335,127 +653,135 @@ def callback_query_vote(update: Update, context: CallbackContext):
     else:
         poll: Poll = answer.poll()
         user: User = query.from_user
-        user_old = next(iter(u for u in answer.voters() if u.id == user.id), None)
 
-        if user_old is None:
+        voted = toggle_vote(answer, user)
+        # previous rendering is outdated, free its memory
+        render_cache.invalidate(poll.id)
+
+        if voted:
             # case 1, set
             logger.debug("user id %d voted for answer id %d in poll id %d",
-                         query.from_user.id, answer.id, answer.poll().id)
+                         user.id, answer.id, poll.id)
 
-            answer.voters().append(user)
-            answer.store()
             query.answer(text="you voted for '{}'.".format(answer.text))
 
         else:
             # case 2, reset
             logger.debug("user id %d took his/her reaction back from answer id %d in poll id %d",
-                         query.from_user.id, answer.id, answer.poll().id)
+                         user.id, answer.id, poll.id)
 
-            answer.voters().remove(user_old)
-            answer.store()
             query.answer(text="you took your reaction back.")
 
-        # in both cases 1 and 2 update the view
+        # in both cases 1 and 2 update the view, but not more often than EDIT_INTERVAL
+        rendered = render_poll(poll)
         if query.message is not None and poll.owner.id == query.message.chat.id:
-            markup = inline_keyboard_markup_admin(poll)
+            markup = rendered.admin_json
 
         else:
-            markup = inline_keyboard_markup_answers(poll)
+            markup = rendered.answers_json
 
-        with ignore_not_modified():
-            query.edit_message_text(
-                text=str(poll),
-                parse_mode=None,
-                disable_web_page_preview=True,
-                reply_markup=markup)
+        def edit():
+            with ignore_not_modified():
+                query.edit_message_text(
+                    text=rendered.text,
+                    parse_mode=None,
+                    disable_web_page_preview=True,
+                    reply_markup=markup)
+
+        if query.inline_message_id is not None:
+            key = query.inline_message_id
+        else:
+            key = (query.message.chat.id, query.message.message_id)
+        edits.submit(key, poll.version, edit)
 
 
 def callback_query_admin_vote(update: Update, context: CallbackContext):
     query: CallbackQuery = update.callback_query
     poll_id = int(context.match.groups()[0])
-    poll = Poll.load(poll_id)
+    poll = load_poll(poll_id)
 
     logger.debug("owner user id %d want to vote in poll id %d", query.from_user.id, poll.id)
 
     with ignore_not_modified():
-        query.edit_message_reply_markup(reply_markup=inline_keyboard_markup_answers(poll))
+        query.edit_message_reply_markup(reply_markup=render_poll(poll).answers_json)
 
 
 def callback_query_update(update: Update, context: CallbackContext):
     query: CallbackQuery = update.callback_query
 
     poll_id = int(context.match.groups()[0])
-    poll = Poll.load(poll_id)
+    poll = load_poll(poll_id)
 
     query.answer(text='\u2705 results updated.')
+    rendered = render_poll(poll)
 
     with ignore_not_modified():
         query.edit_message_text(
-            text=str(poll),
+            text=rendered.text,
             parse_mode=None,
             disable_web_page_preview=True,
-            reply_markup=inline_keyboard_markup_admin(poll))
+            reply_markup=rendered.admin_json)
 
 
 def callback_query_stats(update: Update, context: CallbackContext):
     """
-    generate json file and send it back to poll's owner.
+    generate statistics file and send it back to poll's owner.
     """
     query: CallbackQuery = update.callback_query
 
-    poll_id = int(context.match.groups()[0])
-    poll = Poll.load(poll_id)
+    poll_id, fmt = context.match.groups()
+    poll_id = int(poll_id)
+    fmt = fmt or 'json'
+
+    if vote_queue is not None:
+        vote_queue.flush()
+    poll = Poll.load(poll_id, voters=False)
 
     if poll.owner.id != query.from_user.id:
         logger.debug("user id %d attempted to access stats on poll id %d owner %d",
                      query.from_user.id, poll.id, poll.owner.id)
         return
 
-    message: Message = query.message
-
-    # select
-    data = {
-        'answers': [{
-            'id': answer.id,
-            'text': answer.text,
-            'voters': {
-                'total': len(answer.voters()),
-                '_': [{
-                    k: v
-                    for k, v in {
-                        'id': voter.id,
-                        'first_name': voter.first_name,
-                        'last_name': voter.last_name,
-                        'username': voter.username,
-                    }.items()
-                    if v
-                } for voter in answer.voters()]
-            }
-        } for answer in poll.answers()]
-    }
-
-    content = json.dumps(data, indent=4, ensure_ascii=False)
-    raw = BytesIO(content.encode('utf-8'))
-    name = "statistics for poll #{}.json".format(poll.id)
-
-    context.bot.send_document(poll.owner.id, raw, filename=name)
+    file_id = export.cached_file_id(poll, fmt)
+    if file_id is not None:
+        try:
+            context.bot.send_document(poll.owner.id, file_id)
+            query.answer()
+            return
+
+        except BadRequest as e:
+            logger.debug("failed to resend statistics of poll id %d by file_id: %s", poll.id, e)
+            export.forget_file_id(poll, fmt)
+
+    with export.export(poll, fmt) as raw:
+        message = context.bot.send_document(poll.owner.id, raw, filename=export.filename(poll, fmt))
+    export.remember_file_id(poll, fmt, message.document.file_id)
     query.answer()
 
 
 def callback_query_manage(update: Update, context: CallbackContext):
     query: CallbackQuery = update.callback_query
 
-    offset = int(context.match.groups()[0])
+    offset, direction, poll_id = context.match.groups()
+    offset = int(offset)
+    poll_id = int(poll_id) if poll_id is not None else None
 
-    polls: List[Poll] = Poll.query(query.from_user.id, limit=MAX_POLLS_PER_USER)
+    text, markup = manage_polls_page(
+        query.from_user.id, offset,
+        before=poll_id if direction == 'next' else None,
+        after=poll_id if direction == 'prev' else None)
 
+    if text is None:
+        query.answer(text="you don't have any polls yet.")
+        return
+
+    query.answer()
     with ignore_not_modified():
         query.edit_message_text(
-            text=manage_polls_message(polls, offset, POLLS_PER_PAGE),
+            text=text,
             parse_mode=None,
             disable_web_page_preview=True,
-            reply_markup=paginate(len(polls), offset, POLLS_PER_PAGE,
-                                  manage_polls_callback_data))
+            reply_markup=markup)
 
 
 def callback_query_share(update: Update, context: CallbackContext):
@@ -480,12 +806,25 @@ def callback_query_not_found(update: Update, context: CallbackContext):
     query.answer("invalid query")
 
 
-def get_updater(token: str) -> Updater:
-    updater = Updater(token, use_context=True)
+def get_updater(token: str, workers: int = 4, lanes: int = 0,
+                con_pool_size: Optional[int] = None) -> Updater:
+    """
+    :param con_pool_size: size of Bot API connection pool; by default, enough for the
+        dispatcher, all `workers` and all `lanes` to send requests at the same time.
+    """
+    if con_pool_size is None:
+        con_pool_size = workers + 4 + lanes
+    bot = Bot(token, request=TimedRequest(con_pool_size=con_pool_size))
+    updater = Updater(bot=bot, use_context=True, workers=workers)
     return updater
 
 
-def configure_updater(updater: Updater):
+def configure_updater(updater: Updater, admin_id: Optional[int] = None,
+                      recorder: Optional[UpdateRecorder] = None):
+    """
+    :param admin_id: user allowed to run admin commands, e.g. /profile.
+    :param recorder: records every update before it is handled.
+    """
     # Get the dispatcher to register handlers
     dp: Dispatcher = updater.dispatcher
 
@@ -496,6 +835,7 @@ def configure_updater(updater: Updater):
         warnings.filterwarnings("ignore", category=UserWarning, module=re.escape(ConversationHandler.__module__))
 
         dp.add_handler(PersistentConversationHandler(
+            drafts=states,
             entry_points=[
                 CommandHandler("start", start_from_command),
                 CallbackQueryHandler(start_from_callback_query, pattern=r"\.start"),
@@ -535,21 +875,31 @@ def configure_updater(updater: Updater):
     dp.add_handler(CommandHandler("polls", manage))
     dp.add_handler(MessageHandler(Filters.regex(r"/view_(.+)"), view_poll))
 
-    dp.add_handler(InlineQueryHandler(inline_query))
+    if admin_id is not None:
+        dp.add_handler(CommandHandler("profile", profile, filters=Filters.user(user_id=admin_id)))
+
+    dp.add_handler(InlineQueryHandler(serial(inline_query, inline_query_key)))
 
     for callback, pattern in [
-        (callback_query_vote, r"#?(\d+)/(\d+)"),
-        (callback_query_vote, r"\.vote (\d+) (\d+)"),
-        (callback_query_admin_vote, r"\.admin_vote (\d+)"),
-        (callback_query_update, r"\.update (\d+)"),
-        (callback_query_stats, r"\.stats (\d+)"),
-        (callback_query_manage, r"\.manage (\d+)"),
-        (callback_query_share, r"\.share (\d+)"),
+        (serial(callback_query_vote, poll_key), r"#?(\d+)/(\d+)"),
+        (serial(callback_query_vote, poll_key), r"\.vote (\d+) (\d+)"),
+        (serial(callback_query_admin_vote, poll_key), r"\.admin_vote (\d+)"),
+        (serial(callback_query_update, poll_key), r"\.update (\d+)"),
+        (serial(callback_query_stats, poll_key), r"\.stats (\d+)(?: (json|jsonl|csv))?"),
+        (callback_query_manage, r"\.manage (\d+)(?: (next|prev) (\d+))?"),
+        (serial(callback_query_share, poll_key), r"\.share (\d+)"),
     ]:
         dp.add_handler(CallbackQueryHandler(callback, pattern=pattern))
 
     dp.add_handler(CallbackQueryHandler(callback_query_not_found))
 
+    for group in dp.handlers.values():
+        time_handlers(group)
+
+    # added after the others are timed, so that recording is not counted as handling
+    if recorder is not None:
+        dp.add_handler(TypeHandler(Update, recorder.record_update), group=-1)
+
     # log all errors
     dp.add_error_handler(error)
 
@@ -582,18 +932,168 @@ def start_updater(updater: Updater, config: Configuration) -> None:
         updater.start_polling()
 
 
+def register_gauges(updater: Updater):
+    metrics.gauge('bot_update_queue_depth', "updates waiting for the dispatcher",
+                  lambda: updater.dispatcher.update_queue.qsize())
+    metrics.gauge('bot_pending_edits', "coalesced poll message edits waiting to be sent",
+                  edits.pending)
+    metrics.gauge('bot_edit_retries_total', "poll message edits retried after a flood limit",
+                  lambda: edits.retries, type='counter')
+    metrics.gauge('bot_edits_saved_total', "poll message edits superseded before they were sent",
+                  lambda: edits.saved, type='counter')
+    metrics.gauge('bot_render_cache_entries', "rendered polls in memory",
+                  lambda: len(render_cache))
+    metrics.gauge('sqlite_pool_wait_seconds_total', "time spent waiting for a pooled connection",
+                  lambda: fs.pool.stats()['wait_time'], type='counter')
+    metrics.gauge('sqlite_pool_connections', "open pooled connections",
+                  lambda: fs.pool.stats()['connections'])
+
+    if lanes is not None:
+        metrics.gauge('bot_lane_queue_depth', "updates waiting in each serial lane",
+                      lambda: {(str(i),): depth for i, depth in enumerate(lanes.depths())},
+                      ('lane',))
+        metrics.gauge('bot_lane_wait_seconds_total', "time updates spent waiting in serial lanes",
+                      lambda: lanes.stats()['wait_time'], type='counter')
+
+    if vote_queue is not None:
+        metrics.gauge('bot_queued_votes', "write-behind votes not written yet",
+                      lambda: vote_queue.stats()['pending'])
+
+    if backup_job is not None:
+        metrics.gauge('sqlite_backup_last_seconds', "duration of the last backup",
+                      lambda: backup_job.stats()['last_seconds'])
+        metrics.gauge('sqlite_backup_last_bytes', "size of the last backup",
+                      lambda: backup_job.stats()['last_bytes'])
+        metrics.gauge('sqlite_backup_last_timestamp_seconds', "unix time of the last backup",
+                      lambda: backup_job.stats()['last_time'])
+        metrics.gauge('sqlite_backup_failures_total', "failed backups",
+                      lambda: backup_job.stats()['failures'], type='counter')
+
+
 def main():
+    started = last = time.perf_counter()
+    timings: List[Tuple[str, float]] = []
+
+    def mark(phase: str):
+        nonlocal last
+        now = time.perf_counter()
+        timings.append((phase, now - last))
+        last = now
+
     load_dotenv()
-    config = Configuration.get()
+    args = Configuration.parse_args()
+
+    if args.migrate or args.backup:
+        partial = Configuration.get_partial(args)
+        fs.configure_data_dir(partial.data_dir or DEFAULT_DATA_DIR)
+        if args.migrate:
+            fs.migrate(force=True)
+        if args.backup:
+            backup.backup(partial.backup_dir or join(fs.DATA_DIR, 'backups'),
+                          keep=partial.backup_keep if partial.backup_keep is not None else backup.BACKUP_KEEP)
+        return
+
+    config = Configuration.get(args)
+
+    if args.print_config:
+        print(config.dump(), end='')
+        return
+    mark('configuration')
+
+    fs.configure_data_dir(config.data_dir)
+    # normally a no-op, unless the bot is started before `--migrate` is run
+    mark('schema (migrated)' if fs.migrate() else 'schema')
+
+    profiler.directory = fs.DATA_DIR
+    if config.sql_trace:
+        fs.tracer = SQLTracer(config.sql_slow_seconds)
+    fs.configure_pool(
+        factory=fs.TimedConnection if config.metrics_port is not None or config.sql_trace else sqlite3.Connection,
+        size=config.sqlite_pool_size,
+        synchronous=config.sqlite_synchronous,
+        mmap_size=config.sqlite_mmap_size,
+        cache_size=config.sqlite_cache_size,
+    )
+
+    render_cache.max_entries = config.render_cache_size
+    render_cache.max_weight = config.render_cache_weight
+    user_profiles.resize(config.profiles_cache_size)
+    edits.interval = config.edit_interval
+    mark('pool')
+
+    global vote_queue
+    if config.votes_write_behind:
+        vote_queue = VoteQueue(fs.DATA_DIR,
+                               interval=config.votes_flush_interval,
+                               max_batch=config.votes_flush_batch)
+        vote_queue.start()
+
+    global lanes
+    if config.lanes > 0:
+        lanes = Lanes(config.lanes)
+        lanes.start()
+
+    updater = get_updater(config.token,
+                          workers=config.workers,
+                          lanes=config.lanes,
+                          con_pool_size=config.con_pool_size)
+    recorder = UpdateRecorder(join(fs.DATA_DIR, 'updates')) if config.record_updates else None
+    configure_updater(updater, admin_id=config.admin_id, recorder=recorder)
+    mark('bot')
+
+    global backup_job
+    if config.backup_interval is not None:
+        backup_job = backup.BackupJob(config.backup_dir or join(fs.DATA_DIR, 'backups'),
+                                      keep=config.backup_keep)
+        updater.job_queue.run_repeating(backup_job.run, interval=config.backup_interval,
+                                        first=config.backup_interval)
 
-    updater = get_updater(config.token)
-    configure_updater(updater)
     start_updater(updater, config)
+    mark('webhook' if config.webhook_url is not None else 'polling')
+
+    if hasattr(signal, 'SIGUSR1'):
+        # signal handlers run in the main thread between bytecodes, so only queue a job there
+        signal.signal(signal.SIGUSR1, lambda signum, frame: updater.job_queue.run_once(
+            lambda context: toggle_profile(context.bot, config.admin_id), 0))
+
+    if config.metrics_port is not None:
+        register_gauges(updater)
+        metrics.serve(config.metrics_port, config.metrics_listen)
+        mark('metrics')
+
+    logger.info("started in %.3f s: %s", time.perf_counter() - started,
+                ", ".join("{} {:.3f}".format(phase, seconds) for phase, seconds in timings))
+
     # Run the bot until you press Ctrl-C or the process receives SIGINT,
     # SIGTERM or SIGABRT. This should be used most of the time, since
     # start_polling() is non-blocking and will stop the bot gracefully.
     updater.idle()
 
+    profiler.stop()
+
+    if lanes is not None:
+        lanes.stop()
+        logger.info("serial lanes: %s", lanes.stats())
+
+    edits.flush()
+    logger.info("poll message edits: %s", edits.stats())
+
+    if vote_queue is not None:
+        vote_queue.stop()
+        logger.info("write-behind votes: %s", vote_queue.stats())
+
+    logger.info("user profiles: %s", user_profiles.stats())
+
+    if fs.tracer is not None:
+        logger.info("SQL tracer: %s", fs.tracer.stats())
+
+    if recorder is not None:
+        recorder.close()
+        logger.info("recorded updates: %s", recorder.stats())
+
+    if backup_job is not None:
+        logger.info("backups: %s", backup_job.stats())
+
 
 if __name__ == '__main__':
     main()
@@ -1,13 +1,14 @@
 import sqlite3
 import typing
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from telegram import User
 
-from app.fs import DB_PATH
+from app.fs import connection
+from .user import profiles
 
 if typing.TYPE_CHECKING:
-    from .poll import Poll
+    from .poll import Poll, Tally
 
 
 class Answer(object):
@@ -15,17 +16,29 @@ class Answer(object):
         self.id: Optional[int] = None
         self.text: str = text
         self._voters: List[User] = []
+        self._count: Optional[int] = None
         self._poll: 'Poll' = poll
 
     def voters(self):
         """
         list of users who voted for this answer.
 
+        not available for answers loaded in count-only mode.
+
         Returns:
              List[User]
         """
+        assert self._count is None, "voters are not loaded"
         return self._voters
 
+    def count(self) -> int:
+        """
+        number of users who voted for this answer.
+        """
+        if self._count is not None:
+            return self._count
+        return len(self._voters)
+
     def poll(self) -> 'Poll':
         """
         'many answers to one poll' reference.
@@ -36,56 +49,108 @@ class Answer(object):
         return self._poll
 
     def store(self):
-        with sqlite3.connect(DB_PATH) as conn:
+        """
+        store the answer.  voters are stored only with a new answer: votes of a stored one
+        are changed by `toggle_vote` alone, one row at a time, so that storing never
+        overwrites votes made concurrently.
+        """
+        with connection() as conn:
             cur = conn.cursor()
 
-            # store answers
-            if self.id is None:
-                cur.execute("""INSERT INTO answers (poll_id, txt) VALUES (?, ?)""",
-                            (self._poll.id, self.text))
-                self.id = cur.lastrowid
-            else:
+            if self.id is not None:
                 cur.execute("""UPDATE answers SET poll_id = ?, txt = ? WHERE id = ?""",
                             (self._poll.id, self.text, self.id))
+                return
+
+            cur.execute("""INSERT INTO answers (poll_id, txt) VALUES (?, ?)""",
+                        (self._poll.id, self.text))
+            self.id = cur.lastrowid
 
             # store users
-            for v in self.voters():
-                cur.execute("""SELECT * FROM users WHERE id = ?""", (v.id,))
-
-                if cur.fetchone() is None:
-                    cur.execute("""
-                        INSERT INTO users (id, first_name, last_name, username)
-                        VALUES (?, ?, ?, ?)
-                        """, (v.id, v.first_name, v.last_name, v.username))
-
-                else:
-                    cur.execute("""
-                        UPDATE users
-                        SET first_name = ?, last_name = ?, username = ?
-                        WHERE id = ?
-                        """, (v.first_name, v.last_name, v.username, v.id))
+            profiles.store(cur, self.voters())
 
             # store connections
-            # # remove all connection with this answer
-            cur.execute("""DELETE FROM votes WHERE poll_id = ? AND answer_id = ?""",
-                        (self.poll().id, self.id))
+            cur.executemany("""
+                INSERT INTO votes (user_id, poll_id, answer_id)
+                VALUES (?, ?, ?)
+                """, [(v.id, self._poll.id, self.id) for v in self.voters()])
+
+        assert self.id is not None
+
+    def toggle_vote(self, user: User) -> bool:
+        """
+        add or take back `user`'s vote for this answer.
+
+        exactly one row in `votes` is inserted or deleted, so concurrent toggles
+        on the same answer never overwrite each other's voters.
+
+        Returns:
+            bool: True if user has voted for the answer, False if the vote was taken back.
+        """
+        assert self.id is not None
+
+        with connection() as conn:
+            cur = conn.cursor()
+
+            profiles.store(cur, [user])
+
+            cur.execute("""
+                DELETE FROM votes
+                 WHERE poll_id = ? AND answer_id = ? AND user_id = ?
+                """, (self._poll.id, self.id, user.id))
+            voted = cur.rowcount == 0
 
-            # # store current voters
-            for v in self.voters():
+            if voted:
                 cur.execute("""
-                    INSERT INTO votes (user_id, poll_id, answer_id)
+                    INSERT OR IGNORE INTO votes (user_id, poll_id, answer_id)
                     VALUES (?, ?, ?)
-                    """, (v.id, self._poll.id, self.id))
-            conn.commit()
+                    """, (user.id, self._poll.id, self.id))
 
-        assert self.id is not None
+            if self._count is not None:
+                # count-only mode: refresh all counters maintained by triggers, in the same
+                # transaction, so the poll matches its version.
+                cur.execute("""
+                    SELECT
+                        c.answer_id       AS answer_id,
+                        c.votes           AS votes,
+                        p.version         AS version,
+                        p.distinct_voters AS distinct_voters
+                      FROM answer_counts c
+                      JOIN polls p
+                        ON p.id = c.poll_id
+                     WHERE c.poll_id = ?
+                    """, (self._poll.id,))
+                counts: Dict[int, int] = {}
+                for row in cur:
+                    counts[row['answer_id']] = row['votes']
+                    self._poll.version = row['version']
+                    self._poll._total_voters = row['distinct_voters']
+                for answer in self._poll.answers():
+                    answer._count = counts.get(answer.id, 0)
+
+        if self._count is None:
+            # voters of other answers may have changed since the poll was loaded
+            self._poll.version = None
+            self._voters = [v for v in self._voters if v.id != user.id]
+            if voted:
+                self._voters.append(user)
+
+        return voted
 
     def __str__(self):
+        return self.render(self.poll().tally())
+
+    def render(self, tally: 'Tally') -> str:
+        """
+        text of this answer in a poll message.
+
+        :param tally: vote counts of this answer's poll, see `Poll.tally`.
+        """
         # percentage for the answer is a ratio of this answer's voters to total unique voters count.
 
-        total = self.poll().total_voters()
-        count = len(self.voters())
-        max_count: int = max(len(answer.voters()) for answer in self.poll().answers())
+        total = tally.total
+        count = self.count()
+        max_count: int = tally.max_count
         relative_percentage: float = count / max_count if max_count != 0 else 0
         percentage: float = count / total if total != 0 else 0  # 0..1
 
@@ -100,72 +165,75 @@ class Answer(object):
         return "{} - {}\n{}".format(self.text, count, bar)
 
     @classmethod
-    def load(cls, poll: 'Poll', answer_id: int) -> Optional['Answer']:
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.row_factory = sqlite3.Row
-            cur = conn.cursor()
+    def query_many(cls, cur: sqlite3.Cursor, polls: Dict[int, 'Poll'], voters: bool = True):
+        """
+        load answers and their voters for all given polls with a single query.
 
-            cur.execute("""SELECT txt FROM answers WHERE poll_id = ? AND id = ?""",
-                        (poll.id, answer_id))
-            row: sqlite3.Row = cur.fetchone()
+        answers are assigned to polls in place, in order they were added; voters
+        of each answer are ordered by user id descending.
 
-            if row is None:
-                return
-
-            text: str = row['txt']
-            answer: Answer = cls(poll, text)
-            answer.id = answer_id
+        :param cur: cursor of an open connection with `sqlite3.Row` row factory.
+        :param polls: mapping from poll id to a poll object.
+        :param voters: load voters, or only their count from `answer_counts`.
+        """
+        for poll in polls.values():
+            poll._answers = []
 
-            # next, load voters for this option
+        if len(polls) == 0:
+            return
 
+        if not voters:
             cur.execute("""
                 SELECT
-                    u.id AS id,
-                    u.first_name AS first_name,
-                    u.last_name AS last_name,
-                    u.username AS username
-                FROM users u
-                INNER JOIN
-                (SELECT * FROM votes v WHERE v.poll_id = ? AND v.answer_id = ?) v
+                    a.id                  AS id,
+                    a.poll_id             AS poll_id,
+                    a.txt                 AS txt,
+                    COALESCE(c.votes, 0)  AS votes
+                  FROM answers a
+                  LEFT JOIN answer_counts c
+                    ON c.answer_id = a.id
+                 WHERE a.poll_id IN ({})
+                 ORDER BY a.id ASC
+                """.format(', '.join('?' * len(polls))), tuple(polls.keys()))
+
+            for row in cur:
+                answer = cls(polls[row['poll_id']], row['txt'])
+                answer.id = row['id']
+                answer._count = row['votes']
+                answer.poll()._answers.append(answer)
+            return
+
+        cur.execute("""
+            SELECT
+                a.id         AS id,
+                a.poll_id    AS poll_id,
+                a.txt        AS txt,
+                u.id         AS user_id,
+                u.first_name AS first_name,
+                u.last_name  AS last_name,
+                u.username   AS username
+              FROM answers a
+              LEFT JOIN votes v
+                ON v.poll_id = a.poll_id AND v.answer_id = a.id
+              LEFT JOIN users u
                 ON u.id = v.user_id
-                ORDER BY u.id DESC
-                """, (poll.id, answer.id))
-
-            for row in cur.fetchall():
-                row: sqlite3.Row = row
-                user = User(row['id'],
+             WHERE a.poll_id IN ({})
+             ORDER BY a.id ASC, u.id DESC
+            """.format(', '.join('?' * len(polls))), tuple(polls.keys()))
+
+        answer: Optional[Answer] = None
+        for row in cur:
+            row: sqlite3.Row = row
+            if answer is None or answer.id != row['id']:
+                poll = polls[row['poll_id']]
+                answer = cls(poll, row['txt'])
+                answer.id = row['id']
+                poll._answers.append(answer)
+
+            if row['user_id'] is not None:
+                user = User(row['user_id'],
                             is_bot=False,
                             first_name=row['first_name'],
                             last_name=row['last_name'],
                             username=row['username'])
                 answer._voters.append(user)
-
-        return answer
-
-    @classmethod
-    def query(cls, poll: 'Poll') -> List['Answer']:
-        """
-        load from the database those answer which belong to poll with id == `poll.id`.
-
-        :param poll: a poll object.
-        :return: list of answers options for a given poll.
-        """
-        answers: List[Answer] = []
-
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.row_factory = sqlite3.Row
-            cur = conn.cursor()
-
-            cur.execute("""
-                SELECT id
-                FROM answers
-                WHERE poll_id = ?
-                ORDER BY id ASC
-                """, (poll.id,))
-            rows: List[sqlite3.Row] = cur.fetchall()
-
-        for row in rows:
-            answer_id: int = row['id']
-            answers.append(cls.load(poll, answer_id))
-
-        return answers
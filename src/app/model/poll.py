@@ -1,17 +1,41 @@
+import re
 import sqlite3
-from typing import List, Optional
+from typing import Dict, List, NamedTuple, Optional
 
 from telegram import User
 
 from app import log
-from app.fs import DB_PATH
+from app.fs import connection
 from .answer import Answer
+from .user import profiles
 
 logger = log.getLogger(__name__)
 # logger.setLevel(log.DEBUG)
 
 MAX_ANSWERS = 50
-MAX_POLLS_PER_USER = 50
+
+
+class Tally(NamedTuple):
+    """
+    vote counts of a poll, computed once per rendering.
+    """
+    counts: List[int]
+    """number of voters of each answer, in order of `Poll.answers`."""
+    max_count: int
+    total: int
+    """number of unique voters."""
+
+
+class PollSummary(NamedTuple):
+    """
+    lightweight projection of a poll for listings, see `Poll.summaries`.
+    """
+    id: int
+    topic: str
+    answers: int
+    """number of answers."""
+    voters: int
+    """number of unique voters."""
 
 
 class Poll(object):
@@ -19,7 +43,13 @@ class Poll(object):
         self.id: Optional[int] = None
         self.owner: User = owner
         self.topic: str = topic
+        self.version: Optional[int] = 0
+        """
+        incremented in the database on every vote.  None if this object no longer matches
+        any stored version, see `Answer.toggle_vote`.
+        """
         self._answers: List[Answer] = []
+        self._total_voters: Optional[int] = None
 
     def answers(self) -> List[Answer]:
         """
@@ -34,7 +64,7 @@ class Poll(object):
     def store(self):
         assert len(self.answers()) > 0
 
-        with sqlite3.connect(DB_PATH) as conn:
+        with connection() as conn:
             cur = conn.cursor()
 
             if self.id is None:
@@ -46,39 +76,63 @@ class Poll(object):
                 cur.execute("""UPDATE polls SET owner_id = ?, topic = ? WHERE id = ?""",
                             (self.owner.id, self.topic, self.id))
 
-            u = self.owner
-            cur.execute("""SELECT * from users WHERE id = ?""", (u.id,))
-
-            if cur.fetchone() is None:
-                cur.execute("""
-                    INSERT INTO users (first_name, last_name, username, id)
-                    VALUES (?, ?, ?, ?)
-                    """, (u.first_name, u.last_name, u.username, u.id))
-
-            else:
-                cur.execute("""
-                    UPDATE users
-                    SET first_name = ?, last_name = ?, username = ?
-                    WHERE id = ?
-                    """, (u.first_name, u.last_name, u.username, u.id))
+            profiles.store(cur, [self.owner])
 
-            conn.commit()
+            # answers are stored in the same transaction
+            for answer in self.answers():
+                answer.store()
 
-        for answer in self.answers():
-            answer.store()
+            cur.execute("""
+                INSERT OR REPLACE INTO polls_search (rowid, owner, topic, answers)
+                VALUES (?, ?, ?, ?)
+                """, (self.id, 'u{}'.format(self.owner.id), self.topic,
+                      "\n".join(answer.text for answer in self.answers())))
 
         assert self.id is not None
         assert all(a.id is not None for a in self.answers())
 
+    def toggle_vote(self, user: User, answer_id: int) -> Optional[bool]:
+        """
+        add or take back `user`'s vote for an answer with id `answer_id`.
+
+        :return: True if user has voted, False if the vote was taken back,
+            None if the poll has no such answer.
+        """
+        answer = next((a for a in self.answers() if a.id == answer_id), None)
+        if answer is not None:
+            return answer.toggle_vote(user)
+
     def total_voters(self) -> int:
-        # TODO: replace with sql query
+        """
+        number of unique users who voted for any answer.
+        """
+        if self._total_voters is not None:
+            return self._total_voters
         return len(set(voter.id
                        for answer in self.answers()
                        for voter in answer.voters()))
 
+    def tally(self) -> Tally:
+        """
+        vote counts of all answers, their maximum and number of unique voters.
+        """
+        counts = [answer.count() for answer in self.answers()]
+        return Tally(counts, max(counts, default=0), self.total_voters())
+
     def __str__(self):
+        return self.render()
+
+    def render(self, tally: Optional[Tally] = None) -> str:
+        """
+        text of the poll message.
+
+        :param tally: precomputed `Poll.tally`, if the caller needs it for something else too.
+        """
+        if tally is None:
+            tally = self.tally()
+
         footer = "\U0001f465 "
-        total = self.total_voters()
+        total = tally.total
 
         if total == 0:
             footer += "Nobody voted so far."
@@ -87,34 +141,57 @@ class Poll(object):
             footer += "{} people voted so far.".format(total)
 
         return "{}\n\n{}\n\n{}".format(self.topic,
-                                       "\n\n".join(map(str, self.answers())),
+                                       "\n\n".join(answer.render(tally) for answer in self.answers()),
                                        footer)
 
     def __eq__(self, other):
         return self.id == other.id
 
     @classmethod
-    def load(cls, poll_id: int) -> Optional['Poll']:
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.row_factory = sqlite3.Row
+    def load(cls, poll_id: int, voters: bool = True) -> Optional['Poll']:
+        polls = cls.load_many([poll_id], voters)
+        if len(polls) != 0:
+            return polls[0]
+
+    @classmethod
+    def load_many(cls, poll_ids: List[int], voters: bool = True) -> List['Poll']:
+        """
+        load polls together with all their answers and voters over a single connection.
+
+        exactly two queries are executed regardless of the number of polls, answers and
+        voters: one for polls with their owners, and one for answers with their voters.
+
+        :param poll_ids: ids of polls to load.
+        :param voters: load voters of each answer, or only vote counts.  polls loaded
+            in count-only mode can be rendered and voted in, but not stored.
+        :return: list of found polls in order of `poll_ids`; missing ids are skipped.
+        """
+        poll_ids = list(dict.fromkeys(poll_ids))
+        if len(poll_ids) == 0:
+            return []
+
+        with connection() as conn:
             cur = conn.cursor()
 
             cur.execute("""
                 SELECT
-                    p.id         AS id,
-                    p.owner_id   AS owner_id,
-                    p.topic      AS topic,
-                    u.first_name AS first_name,
-                    u.last_name  AS last_name,
-                    u.username   AS username
+                    p.id              AS id,
+                    p.owner_id        AS owner_id,
+                    p.topic           AS topic,
+                    p.distinct_voters AS distinct_voters,
+                    p.version         AS version,
+                    u.first_name      AS first_name,
+                    u.last_name       AS last_name,
+                    u.username        AS username
                   FROM polls p
                   JOIN users u
                     ON p.owner_id = u.id
-                 WHERE p.id = ?
-                 """, (poll_id,))
-            row: sqlite3.Row = cur.fetchone()
+                 WHERE p.id IN ({})
+                 """.format(', '.join('?' * len(poll_ids))), poll_ids)
 
-            if row is not None:
+            polls: Dict[int, Poll] = {}
+            for row in cur.fetchall():
+                row: sqlite3.Row = row
                 user = User(row['owner_id'],
                             is_bot=False,
                             first_name=row['first_name'],
@@ -122,43 +199,49 @@ class Poll(object):
                             username=row['username'])
                 poll = cls(user, row['topic'])
                 poll.id = row['id']
+                poll.version = row['version']
+                if not voters:
+                    poll._total_voters = row['distinct_voters']
+                polls[poll.id] = poll
 
-                # next, load answers
-                poll._answers = Answer.query(poll)
+            # next, load answers
+            Answer.query_many(cur, polls, voters)
 
-                return poll
+        return [polls[poll_id] for poll_id in poll_ids if poll_id in polls]
 
     @classmethod
-    def query(cls, user_id: int, text: str = '', limit: int = 5) -> List['Poll']:
+    def query(cls, user_id: int, text: str = '', limit: int = 5, voters: bool = True) -> List['Poll']:
         """
         query `Poll`s from the database, sort by last created, limit 50 (telegram limitation).
 
         :param user_id: only creator of a poll can post it
         :param text: query string
         :param limit: maximum results
+        :param voters: see `Poll.load_many`
         :return: list of polls matching query
         """
         polls: List[Poll] = []
 
         # cases:
         # - 0, id: add to results poll with id if valid
-        # - 1, topic: extend results with list of 5 last created polls which topic matches query
+        # - 1, search: extend results with polls which topic or answers match query,
+        #      best matches first, or with last created polls if query is empty
 
         # case 0, id
         try:
             poll_id = int(text)
-        except ValueError as e:
+        except ValueError:
             pass
         else:
-            poll = cls.load(poll_id)
+            poll = cls.load(poll_id, voters)
             if poll is not None:
                 if poll.owner.id == user_id:
                     polls.append(poll)
 
-        # case 2, topic
+        # case 1, search
         # kind of `unique` function.  has to be rewritten.
         polls.extend(p for p in
-                     cls._query_topic(user_id, text, limit)
+                     cls._search(user_id, text, limit, voters)
                      if p not in polls)
 
         logger.debug("query polls for user id %d, query '%s', found %d in total",
@@ -167,19 +250,87 @@ class Poll(object):
         return polls
 
     @classmethod
-    def _query_topic(cls, user_id: int, text: str, limit: int) -> List['Poll']:
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.row_factory = sqlite3.Row
+    def summaries(cls, user_id: int, limit: int,
+                  before: Optional[int] = None,
+                  after: Optional[int] = None,
+                  offset: int = 0) -> List[PollSummary]:
+        """
+        list summaries of polls owned by `user_id`, last created first.
+
+        pages are selected by keyset pagination, so cost of a page doesn't depend on its position.
+
+        :param user_id: owner of polls.
+        :param limit: maximum results.
+        :param before: only polls with id less than `before`, i.e. next page after a poll.
+        :param after: only polls with id greater than `after`, i.e. previous page before a poll.
+        :param offset: skip first results; only for legacy offset-based page links.
+        :return: list of summaries, ordered by id descending.
+        """
+        assert before is None or after is None
+
+        condition, order, params = '', 'DESC', [user_id]
+        if before is not None:
+            condition, params = 'AND p.id < ?', [user_id, before]
+        elif after is not None:
+            condition, order, params = 'AND p.id > ?', 'ASC', [user_id, after]
+
+        with connection() as conn:
             cur = conn.cursor()
 
             cur.execute("""
-                SELECT id FROM polls
-                WHERE owner_id = ? AND topic LIKE ?
-                ORDER BY id DESC
-                LIMIT ?
-                """, (user_id, '%{}%'.format(text), limit))
+                SELECT
+                    p.id                AS id,
+                    p.topic             AS topic,
+                    (SELECT COUNT(*)
+                       FROM answers a
+                      WHERE a.poll_id = p.id)
+                                        AS answers,
+                    p.distinct_voters   AS voters
+                  FROM polls p
+                 WHERE p.owner_id = ? {condition}
+                 ORDER BY p.id {order}
+                 LIMIT ? OFFSET ?
+                """.format(condition=condition, order=order), params + [limit, offset])
+
+            summaries = [PollSummary(*row) for row in cur]
+
+        if after is not None:
+            summaries.reverse()
+        return summaries
+
+    @classmethod
+    def _search(cls, user_id: int, text: str, limit: int, voters: bool) -> List['Poll']:
+        """
+        full-text prefix search over topics and answers of polls owned by `user_id`.
+
+        every word of `text` must be a prefix of some word in the poll's topic or answers.
+        matches in topic rank higher than matches in answers.
+        """
+        # words as the unicode61 tokenizer splits them: `_` is a separator there
+        words = re.findall(r'[^\W_]+', text)
+
+        with connection() as conn:
+            cur = conn.cursor()
+
+            if len(words) == 0:
+                cur.execute("""
+                    SELECT id FROM polls
+                    WHERE owner_id = ?
+                    ORDER BY id DESC
+                    LIMIT ?
+                    """, (user_id, limit))
+
+            else:
+                # owner:u<id> AND ({topic answers}: "word1"* AND "word2"* ...)
+                expression = 'owner:u{} AND {{topic answers}}: ({})'.format(
+                    user_id, ' AND '.join('"{}"*'.format(word) for word in words))
+
+                cur.execute("""
+                    SELECT rowid AS id FROM polls_search
+                    WHERE polls_search MATCH ?
+                    ORDER BY bm25(polls_search, 0.0, 10.0, 1.0), rowid DESC
+                    LIMIT ?
+                    """, (expression, limit))
             ids = cur.fetchall()
 
-        return list(filter(
-            lambda x: x is not None,
-            (Poll.load(poll_id) for (poll_id,) in ids)))
+        return cls.load_many([poll_id for (poll_id,) in ids], voters)
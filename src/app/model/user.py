@@ -1 +1,118 @@
-# TODO: UserModel
+"""
+users table.
+
+profiles are written through a cache of what's known to be stored, so storing a poll
+again, or the same user voting again, doesn't touch the users table unless the user's
+name has actually changed.
+"""
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from telegram import User
+
+from app.cache import LRUCache
+from app.fs import on_commit
+
+PROFILES_CACHE_SIZE = 64 * 1024
+
+# first_name, last_name, username
+Profile = Tuple[str, Optional[str], Optional[str]]
+
+
+def _profile(user: User) -> Profile:
+    return user.first_name, user.last_name, user.username
+
+
+class UserProfiles:
+    """
+    bounded cache of stored user profiles in front of the users table.
+
+    the cache is only updated once a transaction which wrote a profile is committed, so it
+    never claims a profile which has been rolled back.
+    """
+
+    def __init__(self, max_entries: int = PROFILES_CACHE_SIZE):
+        """
+        :param max_entries: maximum number of cached profiles; 0 disables caching.
+        """
+        self._profiles: LRUCache[int, Profile] = LRUCache(max_entries)
+        self._lock = threading.Lock()
+
+        self.checked = 0
+        self.skipped = 0
+        self.unchanged = 0
+        self.written = 0
+
+    def store(self, cur: sqlite3.Cursor, users: Iterable[User]):
+        """
+        insert or update users whose profiles are not known to be stored already.
+
+        :param cur: cursor of the current transaction.
+        :param users: users to store; of duplicates, the last one wins.
+        """
+        latest: Dict[int, Profile] = {}
+        checked = 0
+        for user in users:
+            checked += 1
+            latest[user.id] = _profile(user)
+
+        changed: Dict[int, Profile] = {
+            user_id: profile
+            for user_id, profile in latest.items()
+            if self._profiles.get(user_id) != profile
+        }
+
+        rows: List[tuple] = [(user_id,) + profile for user_id, profile in changed.items()]
+        if len(rows) != 0:
+            cur.executemany("""
+                INSERT INTO users (id, first_name, last_name, username)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE
+                   SET first_name = excluded.first_name,
+                       last_name = excluded.last_name,
+                       username = excluded.username
+                 WHERE first_name IS NOT excluded.first_name
+                    OR last_name IS NOT excluded.last_name
+                    OR username IS NOT excluded.username
+                """, rows)
+            written = cur.rowcount
+
+            on_commit(lambda: self._stored(changed))
+        else:
+            written = 0
+
+        with self._lock:
+            self.checked += checked
+            self.skipped += checked - len(rows)
+            self.unchanged += len(rows) - written
+            self.written += written
+
+    def _stored(self, profiles: Dict[int, Profile]):
+        for user_id, profile in profiles.items():
+            self._profiles.put(user_id, profile)
+
+    def resize(self, max_entries: int):
+        """
+        :param max_entries: maximum number of cached profiles; 0 disables caching.
+        """
+        self._profiles.max_entries = max_entries
+        if max_entries <= 0:
+            self._profiles.clear()
+
+    def clear(self):
+        self._profiles.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = {
+                'checked': self.checked,
+                'skipped': self.skipped,
+                'unchanged': self.unchanged,
+                'written': self.written,
+            }
+        stats.update(('cache_' + k, v) for k, v in self._profiles.stats().items())
+        return stats
+
+
+profiles = UserProfiles()
@@ -0,0 +1,355 @@
+"""
+write-behind queue for votes.
+
+votes are applied to in-memory state right away, and a single writer thread persists
+them in batched transactions, so a burst of votes on a popular poll costs one commit
+per batch instead of one per vote.
+
+every vote is appended to a journal before it is acknowledged.  the journal is written
+to the OS, but not synced to disk, so queued votes survive a crash of the bot, not of the
+host: on power loss, votes of the last moments may be lost, as are commits with
+`PRAGMA synchronous = NORMAL`.  journal records set a vote rather than toggle it, so
+replaying a journal on start is idempotent, whether the batch was committed before the
+bot stopped or not.
+"""
+import glob
+import json
+import os
+import threading
+from os.path import join
+from typing import Callable, Dict, List, Optional, Set, TextIO, Tuple, TypeVar
+
+from telegram import User
+
+from app import log
+from app.fs import connection
+from .answer import Answer
+from .poll import Poll
+from .user import profiles
+
+logger = log.getLogger(__name__)
+
+T = TypeVar('T')
+
+# poll_id, answer_id, user, vote
+Op = Tuple[int, int, User, bool]
+
+
+class _UserVotes:
+    """
+    votes of a user in a poll which has unflushed changes.
+    """
+    __slots__ = ('stored', 'current', 'ops')
+
+    def __init__(self, stored: Set[int]):
+        self.stored: Set[int] = stored
+        """ids of answers voted for, as committed to the database."""
+        self.current: Set[int] = set(stored)
+        """ids of answers voted for, including queued votes."""
+        self.ops: int = 0
+        """number of queued votes."""
+
+
+class VoteQueue:
+    """
+    in-memory vote state on top of the database, with a write-behind writer thread.
+
+    polls read through `read` see committed votes plus queued ones.  reads are consistent
+    with the writer by means of a sequence counter: it is odd while a batch is being
+    committed, and changes when the batch is removed from the queue.
+    """
+
+    def __init__(self, journal_dir: str, interval: float = 0.05, max_batch: int = 1000):
+        """
+        :param journal_dir: directory for journal files.
+        :param interval: flush queued votes at least this often, in seconds.
+        :param max_batch: flush queued votes as soon as there are this many of them.
+        """
+        self.journal_dir = journal_dir
+        self.interval = interval
+        self.max_batch = max_batch
+
+        self._lock = threading.Lock()
+        self._committed = threading.Condition(self._lock)
+        self._writing = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+        self._pending: List[Op] = []
+        self._polls: Dict[int, Dict[int, _UserVotes]] = {}
+        self._poll_ops: Dict[int, int] = {}
+        self._sequence = 0
+
+        self._segment = 0
+        self._journal: Optional[TextIO] = None
+        self._segments: List[str] = []
+
+        self.votes = 0
+        self.batches = 0
+        self.written = 0
+        self.max_written = 0
+        self.failures = 0
+
+    ###########################################################################
+    # journal
+    ###########################################################################
+
+    def _segment_path(self, segment: int) -> str:
+        return join(self.journal_dir, 'votes-{:010d}.journal'.format(segment))
+
+    def _open_segment(self):
+        self._segment += 1
+        path = self._segment_path(self._segment)
+        self._journal = open(path, 'a', buffering=1, encoding='utf-8')
+        self._segments.append(path)
+
+    def _replay(self):
+        paths = sorted(glob.glob(join(self.journal_dir, 'votes-*.journal')))
+        ops: List[Op] = []
+        for path in paths:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        poll_id, answer_id, user_id, first_name, last_name, username, vote = json.loads(line)
+                    except ValueError:
+                        # torn write of the very last record, it has never been acknowledged
+                        continue
+                    user = User(user_id, is_bot=False, first_name=first_name,
+                                last_name=last_name, username=username)
+                    ops.append((poll_id, answer_id, user, vote))
+
+        if len(ops) != 0:
+            logger.info("replaying %d votes from %d journal files", len(ops), len(paths))
+            self._commit(ops)
+
+        for path in paths:
+            os.remove(path)
+        if len(paths) != 0:
+            self._segment = int(os.path.basename(paths[-1])[len('votes-'):-len('.journal')])
+
+    ###########################################################################
+    # lifecycle
+    ###########################################################################
+
+    def start(self):
+        """replay journal left from previous run and start writer thread."""
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self._replay()
+        self._open_segment()
+
+        self._thread = threading.Thread(target=self._run, name='vote-queue-writer', daemon=True)
+        self._thread.start()
+        logger.info("write-behind votes: flush every %.3f seconds or %d votes",
+                    self.interval, self.max_batch)
+
+    def stop(self):
+        """write all queued votes and stop writer thread."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if len(self._pending) == 0:
+                for path in self._segments:
+                    os.remove(path)
+                self._segments = []
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    ###########################################################################
+    # reading and voting
+    ###########################################################################
+
+    def read(self, load: Callable[[], T], polls: Callable[[T], List[Poll]] = lambda result: [result]) -> T:
+        """
+        load count-only polls from the database and apply queued votes to them.
+
+        :param load: function which loads polls, e.g. `lambda: Poll.load(poll_id, voters=False)`.
+        :param polls: function which extracts list of polls from result of `load`.
+        :return: result of `load`.
+        """
+        while True:
+            with self._committed:
+                while self._sequence % 2 == 1:
+                    self._committed.wait()
+                sequence = self._sequence
+
+            result = load()
+
+            with self._lock:
+                if self._sequence == sequence:
+                    for poll in polls(result):
+                        if poll is not None:
+                            self._apply(poll)
+                    return result
+
+    def _apply(self, poll: Poll):
+        users = self._polls.get(poll.id)
+        if users is None:
+            return
+
+        answers: Dict[int, Answer] = {answer.id: answer for answer in poll.answers()}
+        for votes in users.values():
+            for answer_id in votes.current - votes.stored:
+                answers[answer_id]._count += 1
+            for answer_id in votes.stored - votes.current:
+                answers[answer_id]._count -= 1
+            poll._total_voters += bool(votes.current) - bool(votes.stored)
+
+        # database version will be incremented by every queued vote
+        poll.version += self._poll_ops[poll.id]
+
+    def toggle(self, answer: Answer, user: User) -> bool:
+        """
+        queue a vote toggle, and apply it to the answer's count-only poll.
+
+        :return: True if user has voted for the answer, False if the vote was taken back.
+        """
+        poll = answer.poll()
+        assert answer._count is not None, "poll must be loaded in count-only mode"
+
+        # votes read from the database, and the sequence they were read at
+        stored: Optional[Set[int]] = None
+        sequence = -1
+        while True:
+            with self._lock:
+                votes = self._polls.get(poll.id, {}).get(user.id)
+                if votes is None and self._sequence == sequence:
+                    votes = self._polls.setdefault(poll.id, {})[user.id] = _UserVotes(stored)
+                if votes is not None:
+                    vote, pending = self._toggle(poll, answer, user, votes)
+                    break
+                sequence = self._sequence
+
+            # first vote of the user since the last batch: read their votes without the
+            # lock, and retry if a batch has been written meanwhile
+            stored = self._load(poll.id, user.id)
+
+        if pending >= self.max_batch:
+            self._wakeup.set()
+
+        return vote
+
+    def _toggle(self, poll: Poll, answer: Answer, user: User, votes: _UserVotes) -> Tuple[bool, int]:
+        was_voter = bool(votes.current)
+        vote = answer.id not in votes.current
+        if vote:
+            votes.current.add(answer.id)
+        else:
+            votes.current.remove(answer.id)
+        votes.ops += 1
+        self._poll_ops[poll.id] = self._poll_ops.get(poll.id, 0) + 1
+
+        self._journal.write(json.dumps(
+            [poll.id, answer.id, user.id, user.first_name, user.last_name, user.username, vote]) + '\n')
+        self._pending.append((poll.id, answer.id, user, vote))
+        self.votes += 1
+
+        answer._count += 1 if vote else -1
+        poll._total_voters += bool(votes.current) - was_voter
+        poll.version += 1
+
+        return vote, len(self._pending)
+
+    @staticmethod
+    def _load(poll_id: int, user_id: int) -> Set[int]:
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""SELECT answer_id FROM votes WHERE poll_id = ? AND user_id = ?""",
+                        (poll_id, user_id))
+            return {answer_id for (answer_id,) in cur}
+
+    ###########################################################################
+    # writing
+    ###########################################################################
+
+    def flush(self):
+        """write all queued votes in a single transaction, and wait until it is committed."""
+        with self._writing:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                if len(batch) == 0:
+                    return
+                segments, self._segments = self._segments, []
+                if self._journal is not None:
+                    self._journal.close()
+                    self._open_segment()
+                self._sequence += 1
+
+            try:
+                self._commit(batch)
+
+            except Exception:
+                logger.exception("failed to write %d votes, will retry", len(batch))
+                with self._committed:
+                    self._pending[:0] = batch
+                    self._segments[:0] = segments
+                    self._sequence += 1
+                    self.failures += 1
+                    self._committed.notify_all()
+                return
+
+            with self._committed:
+                for poll_id, answer_id, user, vote in batch:
+                    users = self._polls[poll_id]
+                    votes = users[user.id]
+                    if vote:
+                        votes.stored.add(answer_id)
+                    else:
+                        votes.stored.discard(answer_id)
+                    votes.ops -= 1
+                    if votes.ops == 0:
+                        del users[user.id]
+                    self._poll_ops[poll_id] -= 1
+                    if self._poll_ops[poll_id] == 0:
+                        del self._poll_ops[poll_id]
+                        del self._polls[poll_id]
+
+                self._sequence += 1
+                self.batches += 1
+                self.written += len(batch)
+                self.max_written = max(self.max_written, len(batch))
+                self._committed.notify_all()
+
+            for path in segments:
+                os.remove(path)
+
+    @staticmethod
+    def _commit(batch: List[Op]):
+        with connection() as conn:
+            cur = conn.cursor()
+
+            profiles.store(cur, [user for _, _, user, _ in batch])
+
+            for poll_id, answer_id, user, vote in batch:
+                if vote:
+                    cur.execute("""
+                        INSERT OR IGNORE INTO votes (user_id, poll_id, answer_id)
+                        VALUES (?, ?, ?)
+                        """, (user.id, poll_id, answer_id))
+                else:
+                    cur.execute("""
+                        DELETE FROM votes
+                         WHERE poll_id = ? AND answer_id = ? AND user_id = ?
+                        """, (poll_id, answer_id, user.id))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'votes': self.votes,
+                'pending': len(self._pending),
+                'batches': self.batches,
+                'written': self.written,
+                'max_batch': self.max_written,
+                'failures': self.failures,
+            }
@@ -1,35 +1,30 @@
-from typing import Callable
+from typing import Optional
 
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
 
 
-def paginate(total: int, offset: int, items_per_page: int,
-             callback_data_generator: Callable[[int], str]) -> InlineKeyboardMarkup:
+def paginate_keyset(previous_callback_data: Optional[str],
+                    next_callback_data: Optional[str]) -> InlineKeyboardMarkup:
     """
-    make `InlineKeyboardMarkup` with "back" / "forward" buttons if appropriate.
+    make `InlineKeyboardMarkup` with "back" / "forward" buttons for keyset pagination.
 
-    :param total: total number of items in a list.
-    :param offset: current offset, starting at 0.
-    :param items_per_page: maximum number of items displayed in a single message.
-    :param callback_data_generator: function that generates `callback_data` for
-        inline buttons that should switch to page with certain offset.
-        :argument offset: page opened by button should start with item number `offset`.
+    :param previous_callback_data: `callback_data` of button which opens previous page,
+        or None if current page is the first one.
+    :param next_callback_data: `callback_data` of button which opens next page,
+        or None if current page is the last one.
     """
-    assert offset <= total
-    assert items_per_page >= 1
-
     row = []
 
-    if offset > 0:
+    if previous_callback_data is not None:
         row.append(
             InlineKeyboardButton(
                 "\u25c0\ufe0f previous",
-                callback_data=callback_data_generator(max(0, offset - items_per_page))))
+                callback_data=previous_callback_data))
 
-    if offset + items_per_page < total:
+    if next_callback_data is not None:
         row.append(
             InlineKeyboardButton(
                 "next \u25b6\ufe0f",
-                callback_data=callback_data_generator(offset + items_per_page)))
+                callback_data=next_callback_data))
 
     return InlineKeyboardMarkup([row])
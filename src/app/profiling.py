@@ -0,0 +1,231 @@
+"""
+on-demand profiling of update handling.
+
+a profiling session covers every update handled during N seconds or the next N updates,
+in whichever thread it is handled: the dispatcher, a worker or a lane.  two modes:
+
+- cprofile: deterministic profile of handlers, written as a .pstats file;
+- sample: stacks of threads busy with handlers, sampled every few milliseconds, written
+  as a .collapsed file for flame graph tools.
+"""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from os.path import join
+from typing import Callable, Dict, Iterator, List, Optional
+
+from . import log
+
+logger = log.getLogger(__name__)
+
+MODES = ('cprofile', 'sample')
+
+# seconds between samples of stacks in 'sample' mode
+SAMPLE_INTERVAL = 0.005
+
+# number of functions in a summary
+SUMMARY_SIZE = 15
+
+
+def _frame_name(frame) -> str:
+    return '{}:{}'.format(frame.f_globals.get('__name__', '?'), frame.f_code.co_name)
+
+
+class Profiler:
+    """
+    profiling sessions, one at a time.  handlers are wrapped with `update`.
+    """
+
+    def __init__(self, directory: str):
+        """
+        :param directory: where to write results.
+        """
+        self.directory = directory
+
+        self._lock = threading.Lock()
+        self._active = False
+        self._mode = 'cprofile'
+        self._updates_left: Optional[int] = None
+        self._done: Optional[Callable[[str], None]] = None
+        self._timer: Optional[threading.Timer] = None
+        self._started = 0.0
+        self._updates = 0
+
+        self._local = threading.local()
+        self._profiles: Dict[int, cProfile.Profile] = {}
+        self._busy: Dict[int, int] = {}
+        self._samples: 'Counter[str]' = Counter()
+
+    @property
+    def active(self) -> bool:
+        return self._active
+
+    def start(self, seconds: Optional[float] = None, updates: Optional[int] = None,
+              mode: str = 'cprofile', done: Optional[Callable[[str], None]] = None) -> bool:
+        """
+        start a session, which stops after `seconds` or after `updates`, whichever is first.
+
+        :param done: called with a summary when the session stops, e.g. to send it to a chat.
+        :return: False if a session is already running.
+        """
+        assert mode in MODES
+        assert seconds is not None or updates is not None
+
+        with self._lock:
+            if self._active:
+                return False
+
+            self._active = True
+            self._mode = mode
+            self._updates_left = updates
+            self._done = done
+            self._started = time.perf_counter()
+            self._updates = 0
+            self._profiles = {}
+            self._busy = {}
+            self._samples = Counter()
+
+            if seconds is not None:
+                self._timer = threading.Timer(seconds, self.stop)
+                self._timer.daemon = True
+                self._timer.start()
+
+            if mode == 'sample':
+                threading.Thread(target=self._sample, name='profiler', daemon=True).start()
+
+        logger.info("profiling %s: seconds=%s, updates=%s", mode, seconds, updates)
+        return True
+
+    @contextmanager
+    def update(self) -> Iterator[None]:
+        """
+        profile handling of an update, if a session is running.
+        """
+        if not self._active or getattr(self._local, 'inside', False):
+            yield
+            return
+
+        ident = threading.get_ident()
+        profile: Optional[cProfile.Profile] = None
+        with self._lock:
+            # the session may stop, and another one start, before this update is handled
+            busy = self._busy
+            if self._mode == 'cprofile':
+                profile = self._profiles.setdefault(ident, cProfile.Profile())
+            else:
+                busy[ident] = busy.get(ident, 0) + 1
+
+        self._local.inside = True
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            self._local.inside = False
+
+            with self._lock:
+                if profile is None:
+                    busy[ident] -= 1
+                stop = False
+                if self._active and busy is self._busy:
+                    self._updates += 1
+                    if self._updates_left is not None:
+                        self._updates_left -= 1
+                        stop = self._updates_left == 0
+
+            if stop:
+                self.stop()
+
+    def _sample(self):
+        own = threading.get_ident()
+        while self._active:
+            with self._lock:
+                busy = [ident for ident, count in self._busy.items() if count > 0 and ident != own]
+
+            frames = sys._current_frames()
+            for ident in busy:
+                frame = frames.get(ident)
+                stack: List[str] = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                if stack:
+                    self._samples[';'.join(reversed(stack))] += 1
+
+            time.sleep(SAMPLE_INTERVAL)
+
+    def stop(self) -> Optional[str]:
+        """
+        stop the session and write its results.
+
+        :return: path of the written file, or None if nothing has been profiled.
+        """
+        with self._lock:
+            if not self._active:
+                return None
+            self._active = False
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            mode, done = self._mode, self._done
+            profiles, samples = list(self._profiles.values()), self._samples
+            duration, updates = time.perf_counter() - self._started, self._updates
+
+        os.makedirs(self.directory, exist_ok=True)
+        name = join(self.directory, time.strftime('profile-%Y%m%d-%H%M%S'))
+
+        path: Optional[str] = None
+        if mode == 'cprofile' and profiles:
+            stats = pstats.Stats(*profiles)
+            path = name + '.pstats'
+            stats.dump_stats(path)
+            summary = self._summary_cprofile(stats)
+
+        elif mode == 'sample' and samples:
+            path = name + '.collapsed'
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in samples.most_common():
+                    f.write('{} {}\n'.format(stack, count))
+            summary = self._summary_samples(samples)
+
+        else:
+            summary = "nothing to profile"
+
+        header = "{} profile of {} updates in {:.1f} seconds{}".format(
+            mode, updates, duration, ", written to {}".format(path) if path else "")
+        logger.info(header)
+
+        if done is not None:
+            try:
+                done(header + "\n\n" + summary)
+            except Exception:
+                logger.exception("failed to report profile")
+
+        return path
+
+    @staticmethod
+    def _summary_cprofile(stats: pstats.Stats) -> str:
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats('cumulative').print_stats(SUMMARY_SIZE)
+        # skip the header with total time and file names
+        lines = out.getvalue().splitlines()
+        start = next((i for i, line in enumerate(lines) if line.lstrip().startswith('ncalls')), 0)
+        return '\n'.join(line.rstrip() for line in lines[start:] if line.strip())
+
+    @staticmethod
+    def _summary_samples(samples: 'Counter[str]') -> str:
+        total = sum(samples.values())
+        leaves: 'Counter[str]' = Counter()
+        for stack, count in samples.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return '\n'.join('{:5.1f}% {}'.format(100 * count / total, name)
+                         for name, count in leaves.most_common(SUMMARY_SIZE))
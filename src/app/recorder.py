@@ -0,0 +1,142 @@
+"""
+recording of incoming updates, for replay by `bench.replay`.
+
+every update is appended as a line of JSON with the time it was dispatched:
+
+    {"time": 1792108800.123, "update": {"update_id": 1, ...}}
+
+to a gzip-compressed file, which is rotated after `max_bytes` of uncompressed JSON.
+recordings contain messages and names of users, so they must be treated as carefully
+as the database itself.
+"""
+import gzip
+import json
+import os
+import threading
+import time
+from os.path import join
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import CallbackContext
+
+from . import log
+
+logger = log.getLogger(__name__)
+
+CURRENT = 'updates.jsonl.gz'
+
+# uncompressed size of a file before it is rotated
+RECORD_MAX_BYTES = 256 * 1024 * 1024
+
+# number of rotated files to keep
+RECORD_BACKUPS = 8
+
+# seconds between flushes of compressed data to the file
+RECORD_FLUSH_INTERVAL = 1.0
+
+
+class UpdateRecorder:
+    """
+    appends updates to a rotating compressed log in `directory`.
+    """
+
+    def __init__(self, directory: str,
+                 max_bytes: int = RECORD_MAX_BYTES,
+                 backups: int = RECORD_BACKUPS):
+        """
+        :param directory: where to keep recordings, created if missing.
+        :param max_bytes: rotate the current file after this many bytes of JSON.
+        :param backups: number of rotated files to keep; older ones are deleted.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+        self._lock = threading.Lock()
+        self._file: Optional[IO[bytes]] = None
+        self._size = 0
+        self._flushed = 0.0
+
+        self.recorded = 0
+        self.rotations = 0
+
+    def record_update(self, update: Update, context: CallbackContext):
+        """callback of a `TypeHandler` in a group before all others."""
+        self.record(update)
+
+    def record(self, update: Update):
+        line = json.dumps({'time': round(time.time(), 3), 'update': update.to_dict()},
+                          ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+        with self._lock:
+            if self._file is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._file = gzip.open(join(self.directory, CURRENT), 'ab')
+
+            self._file.write(line)
+            self._size += len(line)
+            self.recorded += 1
+
+            now = time.monotonic()
+            if now - self._flushed >= RECORD_FLUSH_INTERVAL:
+                self._file.flush()
+                self._flushed = now
+
+            if self._size >= self.max_bytes:
+                self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        self._size = 0
+        self.rotations += 1
+
+        now = time.time()
+        rotated = join(self.directory, 'updates-{}-{:03d}.jsonl.gz'.format(
+            time.strftime('%Y%m%d-%H%M%S', time.localtime(now)), int(now * 1000) % 1000))
+        os.replace(join(self.directory, CURRENT), rotated)
+        logger.info("rotated recorded updates to %s", rotated)
+
+        old = [path for path in recordings(self.directory) if not path.endswith(CURRENT)]
+        for path in old[:max(0, len(old) - self.backups)]:
+            os.remove(path)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'recorded': self.recorded,
+            'rotations': self.rotations,
+        }
+
+
+def recordings(directory: str) -> List[str]:
+    """files in a directory, from the oldest to the current one."""
+    names = sorted(name for name in os.listdir(directory)
+                   if name.startswith('updates-') and name.endswith('.jsonl.gz'))
+    if os.path.exists(join(directory, CURRENT)):
+        names.append(CURRENT)
+    return [join(directory, name) for name in names]
+
+
+def read(path: str) -> Iterator[Tuple[float, dict]]:
+    """
+    (time, update JSON) of every update recorded in a file.
+
+    a file which is still being written may end with a partial line, which is skipped.
+    """
+    with gzip.open(path, 'rb') as f:
+        try:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                yield entry['time'], entry['update']
+        except EOFError:
+            pass
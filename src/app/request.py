@@ -0,0 +1,51 @@
+"""
+Bot API requests with metrics.
+"""
+import time
+
+from telegram.error import RetryAfter, TelegramError
+from telegram.utils.request import Request
+
+from . import metrics
+
+api_seconds = metrics.histogram(
+    'bot_api_request_seconds', "time of Bot API requests, by method", ('method',))
+api_errors = metrics.counter(
+    'bot_api_errors_total', "failed Bot API requests, by method and error", ('method', 'error'))
+api_flood = metrics.counter(
+    'bot_api_retry_after_total', "Bot API requests refused with 429 Too Many Requests, by method",
+    ('method',))
+
+
+def _method(url: str) -> str:
+    """Bot API method from its URL, e.g. 'sendMessage'."""
+    return url.rsplit('/', 1)[-1].split('?', 1)[0]
+
+
+class TimedRequest(Request):
+    """
+    `Request` which times Bot API calls and counts their errors, including 429s.
+    """
+
+    def _timed(self, method: str, request, *args):
+        started = time.perf_counter()
+        try:
+            return request(*args)
+
+        except RetryAfter:
+            api_flood.inc(method)
+            api_errors.inc(method, 'RetryAfter')
+            raise
+
+        except TelegramError as e:
+            api_errors.inc(method, type(e).__name__)
+            raise
+
+        finally:
+            api_seconds.observe(time.perf_counter() - started, method)
+
+    def get(self, url, timeout=None):
+        return self._timed(_method(url), super().get, url, timeout)
+
+    def post(self, url, data, timeout=None):
+        return self._timed(_method(url), super().post, url, data, timeout)
@@ -0,0 +1,149 @@
+"""
+SQL statements tracer.
+
+sees every statement executed over `fs.TimedConnection`s, with its duration and the
+function which executed it.  slow statements are logged together with their
+`EXPLAIN QUERY PLAN`, and statements executed while handling an update are summed up
+per update, so that N+1 patterns and full scans show up in logs.
+"""
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from . import log
+
+logger = log.getLogger(__name__)
+
+# number of call sites in an update summary
+SUMMARY_SITES = 3
+
+
+def explain(conn: sqlite3.Connection, sql: str, params: Any = ()) -> List[str]:
+    """
+    query plan of a statement, one line per step, indented as a tree.
+    """
+    # plain cursor, so that the plan itself is neither timed nor traced
+    cur = sqlite3.Connection.cursor(conn, sqlite3.Cursor)
+    rows = sqlite3.Cursor.execute(cur, 'EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+
+    depths: Dict[int, int] = {}
+    lines = []
+    for row in rows:
+        node_id, parent, _, detail = tuple(row)
+        depths[node_id] = depths.get(parent, -1) + 1
+        lines.append('  ' * depths[node_id] + detail)
+    return lines
+
+
+class _Update:
+    __slots__ = ('name', 'statements', 'seconds', 'sites')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.statements = 0
+        self.seconds = 0.0
+        # call site => [statements, seconds]
+        self.sites: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+
+
+class SQLTracer:
+    """
+    receiver of statements from `fs._timed`, installed as `fs.tracer`.
+    """
+
+    def __init__(self, slow_seconds: float = 0.05):
+        """
+        :param slow_seconds: statements which take longer are logged with their plans.
+        """
+        self.slow_seconds = slow_seconds
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        self.statements = 0
+        self.slow = 0
+        self.updates = 0
+
+    def record(self, site: str, seconds: float, conn: sqlite3.Connection, many: bool,
+               sql: str, params: Any = ()):
+        """
+        account for an executed statement.
+
+        :param many: whether it has been executed with `executemany`, and `params` is
+            a sequence of parameters.
+        """
+        with self._lock:
+            self.statements += 1
+
+        update: Optional[_Update] = getattr(self._local, 'update', None)
+        if update is not None:
+            update.statements += 1
+            update.seconds += seconds
+            entry = update.sites[site]
+            entry[0] += 1
+            entry[1] += seconds
+
+        if seconds >= self.slow_seconds:
+            with self._lock:
+                self.slow += 1
+            self._log_slow(site, seconds, conn, many, sql, params)
+
+    def _log_slow(self, site: str, seconds: float, conn: sqlite3.Connection, many: bool,
+                  sql: str, params: Any):
+        statement = ' '.join(sql.split())
+        if many:
+            # generators of parameters are consumed by now
+            params = params[0] if isinstance(params, (list, tuple)) and len(params) > 0 else None
+
+        plan: List[str] = []
+        if params is not None and statement.split(' ', 1)[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE'):
+            try:
+                plan = explain(conn, sql, params)
+            except sqlite3.Error as e:
+                plan = ['(no plan: {})'.format(e)]
+
+        logger.warning("slow SQL %.1f ms%s in %s: %s%s",
+                       seconds * 1000, " (executemany)" if many else "", site, statement,
+                       ''.join('\n    ' + line for line in plan))
+
+    @contextmanager
+    def update(self, name: str) -> Iterator[None]:
+        """
+        sum up statements executed by the current thread in the block, e.g. by a handler.
+        """
+        if getattr(self._local, 'update', None) is not None:
+            yield
+            return
+
+        update = self._local.update = _Update(name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.update = None
+            with self._lock:
+                self.updates += 1
+            self._log_update(update, time.perf_counter() - started)
+
+    @staticmethod
+    def _log_update(update: _Update, elapsed: float):
+        if update.statements == 0:
+            return
+
+        sites: List[Tuple[str, List[float]]] = sorted(
+            update.sites.items(), key=lambda item: item[1][1], reverse=True)[:SUMMARY_SITES]
+        logger.info("%s executed %d statements, %.1f ms of %.1f ms; top: %s",
+                    update.name, update.statements, update.seconds * 1000, elapsed * 1000,
+                    ', '.join('{} {} ({:.1f} ms)'.format(site, int(count), seconds * 1000)
+                              for site, (count, seconds) in sites))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'statements': self.statements,
+                'slow': self.slow,
+                'updates': self.updates,
+            }
@@ -1,165 +1,388 @@
 """
 manager = StateManager()
 
-manager[message.from_user.id].
+manager[message.from_user].add_answer(text)
+
+drafts are written together with the conversation state, see `PersistentConversationHandler`.
 """
 
 import json
 import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Hashable, Optional, Tuple
 
 from telegram import User
 from telegram.ext import ConversationHandler
 
 from . import log
-from .fs import DB_PATH
+from .fs import connection, on_commit
 from .model.poll import Poll
 
 logger = log.getLogger(__name__)
 
+# seconds to keep an idle conversation state cached
+CONVERSATION_TTL = 15 * 60
+
+# seconds to keep an idle draft in memory
+DRAFT_TTL = 15 * 60
+
 
 ###################
 # User-side state #
 ###################
 class UserState:
+    """
+    draft of a poll which a user is creating.
+
+    the topic is stored in user_states, and answers are appended to draft_answers one by
+    one.  changes are kept in memory until `flush`, which writes only what has changed since
+    the previous flush.
+    """
+
     def __init__(self, user: User):
         self.user = user
-        self.state = {}
         self.poll = Poll(self.user, '')
+        self.used = time.monotonic()
+        """time of last use, for eviction."""
 
-    def load(self) -> dict:
-        with sqlite3.connect(DB_PATH) as conn:
+        # what's stored in the database; no row is the same as an empty topic
+        self._stored_topic = ''
+        self._stored_answers = 0
+        self._reset = False
+
+    def load(self) -> Poll:
+        with connection() as conn:
             cur = conn.cursor()
             cur.execute("""SELECT state FROM user_states WHERE id = ?""", (self.user.id,))
             blob = cur.fetchone()
 
-            self.state = {}
+            state = {}
             if blob is not None:
                 try:
-                    self.state = json.loads(blob[0].decode('utf-8'))
+                    state = json.loads(blob[0].decode('utf-8'))
                 except ValueError:
                     pass
 
-            logger.debug('loaded user %d state: %s', self.user.id, self.state)
+            cur.execute("""
+                SELECT txt FROM draft_answers WHERE user_id = ? ORDER BY position
+                """, (self.user.id,))
+            answers = [text for (text,) in cur]
 
-            return self.state
+        logger.debug('loaded user %d state: %s, %d answers', self.user.id, state, len(answers))
 
-    def load_poll(self) -> Poll:
-        self.poll = Poll(self.user, self.state.get('topic', ''))
-        for answer in self.state.get('answers', []):
+        self.poll = Poll(self.user, state.get('topic', ''))
+        for answer in answers:
             self.poll.add_answer(answer)
+
+        self._stored_topic = self.poll.topic
+        self._stored_answers = len(answers)
+        self._reset = False
         return self.poll
 
-    def store(self):
-        blob = json.dumps(self.state).encode('utf-8')
-        with sqlite3.connect(DB_PATH) as conn:
-            cur = conn.cursor()
+    def dirty(self) -> bool:
+        return (self._reset
+                or self._stored_topic != self.poll.topic
+                or self._stored_answers != len(self.poll.answers()))
+
+    def flush(self, cur: sqlite3.Cursor):
+        """
+        write changes of the draft in the current transaction.
+        """
+        topic = self.poll.topic
+        answers = [answer.text for answer in self.poll.answers()]
+        stored_topic, stored_answers = self._stored_topic, self._stored_answers
+
+        if self._reset:
+            cur.execute("""DELETE FROM user_states WHERE id = ?""", (self.user.id,))
+            cur.execute("""DELETE FROM draft_answers WHERE user_id = ?""", (self.user.id,))
+            stored_topic, stored_answers = '', 0
+
+        if topic != stored_topic:
+            blob = json.dumps({'topic': topic}).encode('utf-8')
             cur.execute("""
                 INSERT OR REPLACE INTO user_states (id, state)
                 VALUES (?, ?)
                 """, (self.user.id, blob))
 
-            logger.debug('wrote user %d state: %s', self.user.id, self.state)
+        if len(answers) > stored_answers:
+            cur.executemany("""
+                INSERT INTO draft_answers (user_id, position, txt)
+                VALUES (?, ?, ?)
+                """, [(self.user.id, position, answers[position])
+                      for position in range(stored_answers, len(answers))])
+
+        logger.debug('wrote user %d state: topic %r, answers %d..%d',
+                     self.user.id, topic, stored_answers, len(answers))
+
+        on_commit(lambda: self._stored(topic, len(answers)))
+
+    def _stored(self, topic: str, answers: int):
+        self._stored_topic = topic
+        self._stored_answers = answers
+        self._reset = False
 
     def reset(self):
-        with sqlite3.connect(DB_PATH) as conn:
-            cur = conn.cursor()
-            cur.execute("""DELETE FROM user_states WHERE id = ?""", (self.user.id,))
+        if self._stored_topic or self._stored_answers:
+            self._reset = True
         self.poll = Poll(self.user, '')
 
     def add_question(self, topic: str):
-        data = self.load()
-        data['topic'] = topic
-        self.store()
+        self.poll.topic = topic
 
     def add_answer(self, answer: str) -> Poll:
-        data = self.load()
-        data.setdefault('answers', []).append(answer)
-        poll = self.load_poll()
-        self.store()
-        return poll
+        self.poll.add_answer(answer)
+        return self.poll
 
     def create_poll(self) -> Poll:
-        self.load()
-        poll = self.load_poll()
+        poll = self.poll
         self.reset()
         return poll
 
 
 class StateManager:
-    def __init__(self):
-        pass
+    """
+    live drafts of users, kept in memory while they are being edited.
+
+    a draft is loaded from the database on first access.  drafts idle for longer than
+    `ttl` seconds are evicted, unless they have changes which are not flushed yet.
+    """
+
+    def __init__(self, ttl: float = DRAFT_TTL):
+        """
+        :param ttl: seconds to keep a draft in memory since it was last used.
+        """
+        self.ttl = ttl
+
+        self._sessions: Dict[int, UserState] = {}
+        self._lock = threading.RLock()
+        self._pruned = time.monotonic()
 
     def __getitem__(self, user: User) -> UserState:
-        return UserState(user)
+        now = time.monotonic()
+
+        with self._lock:
+            session = self._sessions.get(user.id)
+            if session is None:
+                self._prune(now)
+                session = self._sessions[user.id] = UserState(user)
+                session.load()
+
+            session.user = session.poll.owner = user
+            session.used = now
+            return session
+
+    def flush(self, user_id: int):
+        """
+        write changes of a user's draft, in the current transaction if there is one.
+        """
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None or not session.dirty():
+                return
+
+            with connection() as conn:
+                session.flush(conn.cursor())
+
+    def _prune(self, now: float):
+        if now - self._pruned < self.ttl:
+            return
+        self._pruned = now
+
+        for user_id in [user_id for user_id, session in self._sessions.items()
+                        if now - session.used > self.ttl and not session.dirty()]:
+            del self._sessions[user_id]
+
+    def __len__(self):
+        return len(self._sessions)
 
 
 ######################
 # Conversation state #
 ######################
 class SQLiteDictProxy(dict):
+    """
+    conversation states stored in a table, with a write-through cache in front of it.
+
+    every looked up key is cached, including missing ones, so `in`, `get` and `pop` made
+    by `ConversationHandler` for each update cost at most one query.  `pop` of a key which
+    is not cached uses `DELETE ... RETURNING`, so on SQLite older than 3.35 it takes two
+    queries, to read and then to delete the state.  conversations idle
+    for longer than `ttl` seconds are evicted from the cache, but stay in the table.
+    """
     table = "persistent_conversation_state"
 
-    def __init__(self, db: str):
+    def __init__(self, ttl: float = CONVERSATION_TTL,
+                 on_write: Optional[Callable[[Hashable], None]] = None):
+        """
+        :param ttl: seconds to keep a conversation cached since it was last used.
+        :param on_write: called with the key inside the transaction of every write.
+        """
         super().__init__()
-        self.db = db
+        self.ttl = ttl
+        self.on_write = on_write
 
-    def __contains__(self, key):
-        return self[key] is not None
+        # key => (state or None if there's no conversation, time of last use)
+        self._cache: Dict[Hashable, Tuple[Optional[int], float]] = {}
+        self._lock = threading.RLock()
+        self._pruned = time.monotonic()
 
-    def __getitem__(self, key):
-        logger.debug('load state for key %s hash %d', key, hash(key))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
-        with sqlite3.connect(self.db) as conn:
-            conn.row_factory = sqlite3.Row
-            cur = conn.cursor()
+    def _load(self, key) -> Optional[int]:
+        now = time.monotonic()
 
-            cur.execute("""
-                SELECT * FROM {table} WHERE id = ?
-                """.format(table=self.table),
-                        (hash(key),))
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._cache[key] = (entry[0], now)
+                return entry[0]
 
-            row = cur.fetchone()
-            if row is not None:
-                return row['state']
+            logger.debug('load state for key %s hash %d', key, hash(key))
+
+            with connection() as conn:
+                cur = conn.cursor()
+
+                cur.execute("""
+                    SELECT * FROM {table} WHERE id = ?
+                    """.format(table=self.table),
+                            (hash(key),))
+
+                row = cur.fetchone()
+                state = row['state'] if row is not None else None
+
+            self.misses += 1
+            self._cache[key] = (state, now)
+            self._prune(now)
+            return state
+
+    def _cached(self, key, state: Optional[int]):
+        with self._lock:
+            self._cache[key] = (state, time.monotonic())
+
+    def _prune(self, now: float):
+        if now - self._pruned < self.ttl:
+            return
+        self._pruned = now
+
+        for key in [key for key, (_, used) in self._cache.items() if now - used > self.ttl]:
+            del self._cache[key]
+            self.evictions += 1
+
+    def __contains__(self, key):
+        return self._load(key) is not None
+
+    def __getitem__(self, key):
+        return self._load(key)
 
     def __setitem__(self, key, value: int):
         logger.debug('store state for key %s hash %d value %s', key, hash(key), value)
 
-        with sqlite3.connect(self.db) as conn:
-            cur = conn.cursor()
+        with self._lock:
+            entry = self._cache.get(key)
 
-            cur.execute("""
-                INSERT OR REPLACE
-                  INTO {table} (id, state)
-                VALUES (?, ?)
-                """.format(table=self.table),
-                        (hash(key), value))
+            with connection() as conn:
+                if entry is None or entry[0] != value:
+                    # until committed, the state is read from the database
+                    self._cache.pop(key, None)
+
+                    cur = conn.cursor()
+
+                    cur.execute("""
+                        INSERT OR REPLACE
+                          INTO {table} (id, state)
+                        VALUES (?, ?)
+                        """.format(table=self.table),
+                                (hash(key), value))
+
+                    on_commit(lambda: self._cached(key, value))
+
+                if self.on_write is not None:
+                    self.on_write(key)
 
     def __delitem__(self, key):
-        logger.debug('clear state for key %s hash %d', key, hash(key))
+        with self._lock:
+            entry = self._cache.get(key)
 
-        with sqlite3.connect(self.db) as conn:
-            cur = conn.cursor()
+            with connection() as conn:
+                if entry is None or entry[0] is not None:
+                    logger.debug('clear state for key %s hash %d', key, hash(key))
 
-            cur.execute("""
-                DELETE FROM {table}
-                 WHERE id = ?
-                """.format(table=self.table),
-                        (hash(key),))
+                    self._cache.pop(key, None)
+
+                    cur = conn.cursor()
+
+                    cur.execute("""
+                        DELETE FROM {table}
+                         WHERE id = ?
+                        """.format(table=self.table),
+                                (hash(key),))
+
+                    on_commit(lambda: self._cached(key, None))
+
+                if self.on_write is not None:
+                    self.on_write(key)
 
     def get(self, key, default=None):
-        if key in self:
-            return self[key]
-        return default
+        state = self._load(key)
+        return state if state is not None else default
 
     def pop(self, key, default=None):
-        value = self.get(key, default)
-        del self[key]
-        return value
+        with self._lock:
+            if key in self._cache or sqlite3.sqlite_version_info < (3, 35, 0):
+                value = self.get(key, default)
+                del self[key]
+                return value
+
+            logger.debug('pop state for key %s hash %d', key, hash(key))
+
+            with connection() as conn:
+                cur = conn.cursor()
+
+                cur.execute("""
+                    DELETE FROM {table}
+                     WHERE id = ?
+                    RETURNING state
+                    """.format(table=self.table),
+                            (hash(key),))
+
+                # fetch all, so that the statement is finished before commit
+                rows = cur.fetchall()
+                state = rows[0]['state'] if len(rows) != 0 else None
+
+                self.misses += 1
+                on_commit(lambda: self._cached(key, None))
+
+                if self.on_write is not None:
+                    self.on_write(key)
+
+            return state if state is not None else default
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
 
 
 class PersistentConversationHandler(ConversationHandler):
-    def __init__(self, *args, **kw):
+    def __init__(self, *args, drafts: Optional[StateManager] = None, **kw):
+        """
+        :param drafts: drafts to write in the same transaction as the conversation state
+            of their user.  conversations must be `per_user`.
+        """
         super().__init__(*args, **kw)
 
-        self.conversations = SQLiteDictProxy(DB_PATH)
+        on_write = None
+        if drafts is not None:
+            assert self.per_user
+            # key is (chat_id, user_id) or (user_id,)
+            on_write = lambda key: drafts.flush(key[-1])  # noqa: E731
+
+        self.conversations = SQLiteDictProxy(on_write=on_write)
@@ -0,0 +1,7 @@
+"""
+benchmarks for this app.
+
+run from the repository root with `src` on the python path, e.g.:
+
+    PYTHONPATH=src python -m bench.render
+"""
@@ -0,0 +1,167 @@
+"""
+generator of databases of realistic size for benchmarks.
+
+creates a data directory with a migrated database full of polls, answers, users and
+votes, and `bench.json` which describes it:
+
+    PYTHONPATH=src python -m bench.generate /tmp/bench-db --votes 1000000 --distribution zipf
+
+votes are spread over polls either uniformly, or by Zipf's law, so that a few hot polls
+get most of the votes.  every vote is a row in `votes`, so triggers maintain counters
+exactly as they do for votes of real users.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import time
+from collections import Counter
+from os.path import join
+from typing import Any, Dict, List
+
+from telegram import User
+
+from app import fs
+from app.model.poll import MAX_ANSWERS, Poll
+from app.model.user import profiles
+
+META = 'bench.json'
+
+DISTRIBUTIONS = ('uniform', 'zipf')
+
+# polls or votes written in one transaction
+BATCH = 10000
+
+WORDS = ('lunch', 'dinner', 'pizza', 'sushi', 'games', 'movie', 'trip', 'weekend', 'meeting',
+         'standup', 'release', 'party', 'music', 'books', 'sport', 'football', 'hiking',
+         'coffee', 'office', 'remote', 'holiday', 'budget', 'design', 'logo', 'colour',
+         'name', 'venue', 'date', 'time', 'topic', 'talk', 'course', 'team', 'project')
+
+
+def topic(rnd: random.Random) -> str:
+    return ' '.join(rnd.sample(WORDS, rnd.randint(2, 5)))
+
+
+def generate(data_dir: str, owners: int = 100, polls_per_owner: int = 10, answers: int = 5,
+             voters: int = 10000, votes: int = 100000, distribution: str = 'zipf',
+             zipf_s: float = 1.1, seed: int = 0) -> Dict[str, Any]:
+    """
+    fill a new database in `data_dir`.
+
+    :param answers: answers of each poll, up to `MAX_ANSWERS`.
+    :param votes: votes to cast; repeated votes of a user for an answer are dropped, so
+        slightly less are stored.
+    :param zipf_s: exponent of Zipf's law; popularity of a poll of rank k is 1/k^s.
+    :return: description of the database, also written to `META` file.
+    """
+    assert 1 <= answers <= MAX_ANSWERS
+    assert distribution in DISTRIBUTIONS
+
+    rnd = random.Random(seed)
+    started = time.perf_counter()
+
+    fs.configure_data_dir(data_dir)
+    fs.migrate()
+    fs.configure_pool()
+    with fs.connection() as conn:
+        (existing,), = conn.execute("SELECT count(*) FROM polls").fetchall()
+    if existing:
+        raise SystemExit("database in {} is not empty".format(data_dir))
+
+    polls: List[Poll] = []
+    for owner_id in range(1, owners + 1):
+        owner = User(owner_id, is_bot=False, first_name='owner', last_name=str(owner_id),
+                     username='owner{}'.format(owner_id))
+        for _ in range(polls_per_owner):
+            poll = Poll(owner, topic(rnd))
+            for j in range(answers):
+                poll.add_answer('{} #{}'.format(rnd.choice(WORDS), j + 1))
+            polls.append(poll)
+
+    for i in range(0, len(polls), BATCH):
+        with fs.connection():
+            for poll in polls[i:i + BATCH]:
+                poll.store()
+
+    first_voter = owners + 1
+    for i in range(0, voters, BATCH):
+        with fs.connection() as conn:
+            profiles.store(conn.cursor(), [
+                User(user_id, is_bot=False, first_name='voter', last_name=str(user_id))
+                for user_id in range(first_voter + i, first_voter + min(voters, i + BATCH))])
+
+    if distribution == 'zipf':
+        ranks = list(range(1, len(polls) + 1))
+        rnd.shuffle(ranks)
+        weights = [1 / rank ** zipf_s for rank in ranks]
+    else:
+        weights = [1.0] * len(polls)
+    cum_weights = list(itertools.accumulate(weights))
+
+    # votes are drawn in batches, so that millions of them don't have to fit in memory
+    per_poll: 'Counter[int]' = Counter()
+    for i in range(0, votes, BATCH):
+        indices = rnd.choices(range(len(polls)), cum_weights=cum_weights, k=min(BATCH, votes - i))
+        per_poll.update(indices)
+        rows = [(first_voter + rnd.randrange(voters), polls[index].id, rnd.choice(polls[index].answers()).id)
+                for index in indices]
+        with fs.connection() as conn:
+            conn.executemany("""
+                INSERT OR IGNORE INTO votes (user_id, poll_id, answer_id)
+                VALUES (?, ?, ?)
+                """, rows)
+
+    with fs.connection() as conn:
+        (stored,), = conn.execute("SELECT count(*) FROM votes").fetchall()
+
+    hot_index = max(range(len(polls)), key=lambda index: per_poll[index])
+    hot = polls[hot_index]
+    cold = polls[min(range(len(polls)), key=lambda index: per_poll[index])]
+    meta = {
+        'owners': owners,
+        'polls_per_owner': polls_per_owner,
+        'answers': answers,
+        'voters': voters,
+        'votes': stored,
+        'distribution': distribution,
+        'seed': seed,
+        'first_voter': first_voter,
+        'hot_poll': hot.id,
+        'hot_poll_votes': per_poll[hot_index],
+        'hot_owner': hot.owner.id,
+        'cold_poll': cold.id,
+        'seconds': round(time.perf_counter() - started, 1),
+    }
+    with open(join(data_dir, META), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def load_meta(data_dir: str) -> Dict[str, Any]:
+    with open(join(data_dir, META), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="generate a database for benchmarks.")
+    parser.add_argument('data_dir', help="new data directory")
+    parser.add_argument('--owners', type=int, default=100)
+    parser.add_argument('--polls-per-owner', type=int, default=10)
+    parser.add_argument('--answers', type=int, default=5, help="up to {}".format(MAX_ANSWERS))
+    parser.add_argument('--voters', type=int, default=10000)
+    parser.add_argument('--votes', type=int, default=100000)
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='zipf')
+    parser.add_argument('--zipf-s', type=float, default=1.1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    meta = generate(args.data_dir, owners=args.owners, polls_per_owner=args.polls_per_owner,
+                    answers=args.answers, voters=args.voters, votes=args.votes,
+                    distribution=args.distribution, zipf_s=args.zipf_s, seed=args.seed)
+    print(json.dumps(meta, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+"""
+end-to-end load test of update handling.
+
+builds the real dispatcher with `configure_updater`, backed by a fresh database and a
+fake in-process Bot API with configurable latency, and feeds it synthetic updates in
+a few scenarios:
+
+- vote_storm: many users vote in a single hot poll;
+- cold_polls: votes are spread over many polls;
+- inline_typing: owners type queries for their polls character by character;
+- conversations: users create polls with /start, a question, answers and /done.
+
+for each scenario it reports updates per second, p50/p99 handler latency, SQL
+statements per update and Bot API calls, as JSON which can be kept as a baseline and
+compared against later with `--compare`:
+
+    PYTHONPATH=src python -m bench.load --output load.json
+    PYTHONPATH=src python -m bench.load --compare load.json
+"""
+import argparse
+import json
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Iterator, List
+
+from telegram import Bot, Update, User
+from telegram.ext import Updater
+
+import app.main as bot_main
+from app import fs
+from app.lanes import Lanes
+from app.model.poll import Poll
+from app.request import TimedRequest
+from app.sqltrace import SQLTracer
+
+TOKEN = '123456:load-test'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'load test', 'username': 'load_test_bot'}
+
+Scenario = Callable[['argparse.Namespace', random.Random], Iterator[Dict[str, Any]]]
+
+
+class FakeBotAPI(TimedRequest):
+    """
+    Bot API which answers every request locally after `latency` seconds.
+
+    requests are still serialized and parsed by `Request`, and timed by `TimedRequest`.
+    """
+
+    def __init__(self, latency: float, **kw):
+        super().__init__(**kw)
+        self.latency = latency
+        self.calls: 'Counter[str]' = Counter()
+        self._lock = threading.Lock()
+        self._message_id = 0
+
+    def _request_wrapper(self, method, url, body=None, fields=None, headers=None, **kw) -> bytes:
+        api_method = url.rsplit('/', 1)[-1]
+        data: Dict[str, Any] = json.loads(body) if body is not None else dict(fields or {})
+
+        with self._lock:
+            self.calls[api_method] += 1
+            self._message_id += 1
+            message_id = self._message_id
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        return json.dumps({'ok': True, 'result': self._result(api_method, data, message_id)}).encode('utf-8')
+
+    @staticmethod
+    def _result(api_method: str, data: Dict[str, Any], message_id: int) -> Any:
+        if api_method == 'getMe':
+            return BOT_USER
+        if api_method == 'getMyCommands':
+            return []
+        if api_method == 'editMessageText' and 'inline_message_id' in data:
+            return True
+        if api_method in ('sendMessage', 'editMessageText', 'sendDocument'):
+            message = {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': int(data.get('chat_id', 0)), 'type': 'private'},
+                'from': BOT_USER,
+            }
+            if api_method == 'sendDocument':
+                message['document'] = {'file_id': 'document{}'.format(message_id),
+                                       'file_unique_id': 'document{}'.format(message_id)}
+            else:
+                message['text'] = data.get('text', '')
+            return message
+        return True
+
+
+class LatencyTracer(SQLTracer):
+    """tracer which keeps handler times instead of logging summaries of updates."""
+
+    def __init__(self):
+        super().__init__(slow_seconds=float('inf'))
+        self.latencies: List[float] = []
+
+    def _log_update(self, update, elapsed: float):
+        with self._lock:
+            self.latencies.append(elapsed)
+
+    def reset(self):
+        with self._lock:
+            self.latencies = []
+
+
+def user(user_id: int) -> Dict[str, Any]:
+    return {'id': user_id, 'is_bot': False, 'first_name': 'user{}'.format(user_id)}
+
+
+def create_polls(count: int, answers: int, owners: int, rnd: random.Random) -> List[Poll]:
+    polls = []
+    for i in range(count):
+        owner_id = 1 + i % owners
+        poll = Poll(User(owner_id, is_bot=False, first_name='owner{}'.format(owner_id)),
+                    'poll {} about {}'.format(i, rnd.choice(['lunch', 'games', 'movies', 'trips'])))
+        for j in range(answers):
+            poll.add_answer('answer {}'.format(j))
+        poll.store()
+        polls.append(poll)
+    return polls
+
+
+def votes(polls: List[Poll], count: int, voters: int, rnd: random.Random) -> Iterator[Dict[str, Any]]:
+    for i in range(count):
+        poll = rnd.choice(polls)
+        answer = rnd.choice(poll.answers())
+        yield {'callback_query': {
+            'id': str(i),
+            'from': user(1000 + rnd.randrange(voters)),
+            'chat_instance': 'load',
+            'inline_message_id': 'inline{}'.format(poll.id),
+            'data': '.vote {} {}'.format(poll.id, answer.id),
+        }}
+
+
+def vote_storm(args: argparse.Namespace, rnd: random.Random) -> Iterator[Dict[str, Any]]:
+    polls = create_polls(1, args.answers, 1, rnd)
+    yield from votes(polls, args.updates, args.voters, rnd)
+
+
+def cold_polls(args: argparse.Namespace, rnd: random.Random) -> Iterator[Dict[str, Any]]:
+    polls = create_polls(args.polls, args.answers, args.owners, rnd)
+    yield from votes(polls, args.updates, args.voters, rnd)
+
+
+def inline_typing(args: argparse.Namespace, rnd: random.Random) -> Iterator[Dict[str, Any]]:
+    polls = create_polls(args.polls, args.answers, args.owners, rnd)
+    i = 0
+    while i < args.updates:
+        poll = rnd.choice(polls)
+        for end in range(len(poll.topic) + 1):
+            if i >= args.updates:
+                break
+            yield {'inline_query': {
+                'id': str(i),
+                'from': user(poll.owner.id),
+                'query': poll.topic[:end],
+                'offset': '',
+            }}
+            i += 1
+
+
+def conversations(args: argparse.Namespace, rnd: random.Random) -> Iterator[Dict[str, Any]]:
+    def message(user_id: int, text: str) -> Dict[str, Any]:
+        message = {
+            'message_id': rnd.randrange(1 << 30),
+            'from': user(user_id),
+            'chat': {'id': user_id, 'type': 'private'},
+            'date': int(time.time()),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'message': message}
+
+    i = 0
+    while i < args.updates:
+        user_id = 1000 + rnd.randrange(args.voters)
+        steps = ['/start', 'question {}'.format(i)]
+        steps += ['answer {}'.format(j) for j in range(args.answers)]
+        steps.append('/done')
+        for text in steps[:args.updates - i]:
+            yield message(user_id, text)
+            i += 1
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    'vote_storm': vote_storm,
+    'cold_polls': cold_polls,
+    'inline_typing': inline_typing,
+    'conversations': conversations,
+}
+
+
+def percentile(values: List[float], q: float) -> float:
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run(name: str, args: argparse.Namespace, api: FakeBotAPI, updater: Updater,
+        tracer: LatencyTracer) -> Dict[str, Any]:
+    rnd = random.Random(args.seed)
+    # setup, e.g. polls, is neither timed nor counted
+    updates = [Update.de_json(dict(data, update_id=i + 1), updater.bot)
+               for i, data in enumerate(SCENARIOS[name](args, rnd))]
+
+    errors: List[BaseException] = []
+    updater.dispatcher.error_handlers.clear()
+    updater.dispatcher.add_error_handler(lambda update, context: errors.append(context.error))
+
+    bot_main.lanes = Lanes(args.lanes) if args.lanes > 0 else None
+    if bot_main.lanes is not None:
+        bot_main.lanes.start()
+    tracer.reset()
+    api.calls.clear()
+    statements = tracer.stats()['statements']
+
+    started = time.perf_counter()
+    for update in updates:
+        updater.dispatcher.process_update(update)
+    if bot_main.lanes is not None:
+        bot_main.lanes.stop()
+    bot_main.edits.flush()
+    elapsed = time.perf_counter() - started
+
+    statements = tracer.stats()['statements'] - statements
+    return {
+        'updates': len(updates),
+        'seconds': round(elapsed, 3),
+        'updates_per_second': round(len(updates) / elapsed, 1),
+        'handler_p50_ms': round(percentile(tracer.latencies, 0.50) * 1000, 3),
+        'handler_p99_ms': round(percentile(tracer.latencies, 0.99) * 1000, 3),
+        'statements': statements,
+        'statements_per_update': round(statements / max(1, len(updates)), 2),
+        'errors': len(errors),
+        'api_calls': dict(sorted(api.calls.items())),
+    }
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]]):
+    keys = ('updates_per_second', 'handler_p50_ms', 'handler_p99_ms', 'statements_per_update')
+    print("{:15} {:22} {:>12} {:>12} {:>8}".format('scenario', 'metric', 'baseline', 'current', 'ratio'))
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        for key in keys:
+            ratio = result[key] / old[key] if old[key] else float('nan')
+            print("{:15} {:22} {:12.3f} {:12.3f} {:8.2f}".format(name, key, old[key], result[key], ratio))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="end-to-end load test of update handling.")
+    parser.add_argument('scenarios', nargs='*', metavar='SCENARIO',
+                        help="scenarios to run, all by default: {}".format(', '.join(SCENARIOS)))
+    parser.add_argument('--updates', type=int, default=2000, help="updates per scenario")
+    parser.add_argument('--polls', type=int, default=200, help="polls in cold_polls and inline_typing")
+    parser.add_argument('--owners', type=int, default=20)
+    parser.add_argument('--answers', type=int, default=5)
+    parser.add_argument('--voters', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.005, help="Bot API latency, seconds")
+    parser.add_argument('--lanes', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', help="database directory, a temporary one by default")
+    parser.add_argument('--output', metavar='FILE', help="write results as JSON")
+    parser.add_argument('--compare', metavar='FILE', help="compare with results written earlier")
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error("unknown scenario {}".format(name))
+
+    with tempfile.TemporaryDirectory(prefix='multi_vote_bot-load-') as tmp:
+        fs.configure_data_dir(args.data_dir or tmp)
+        fs.migrate()
+        fs.tracer = tracer = LatencyTracer()
+        fs.configure_pool(factory=fs.TimedConnection)
+
+        api = FakeBotAPI(args.latency, con_pool_size=8 + args.lanes)
+        updater = Updater(bot=Bot(TOKEN, request=api), use_context=True)
+        bot_main.configure_updater(updater)
+
+        results: Dict[str, Dict[str, Any]] = {}
+        for name in args.scenarios or SCENARIOS:
+            results[name] = run(name, args, api, updater, tracer)
+            print(name, json.dumps(results[name]), file=sys.stderr)
+
+        fs.pool.close()
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(results, json.load(f))
+    elif args.output is None:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
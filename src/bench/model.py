@@ -0,0 +1,171 @@
+"""
+microbenchmarks of the model layer over a generated database.
+
+times loading, searching, rendering and voting in polls, statistics export and steps of
+poll creation, and measures their peak memory.  results can be saved as a baseline, and
+later runs fail if any result regresses beyond a threshold:
+
+    PYTHONPATH=src python -m bench.generate /tmp/bench-db --votes 1000000
+    PYTHONPATH=src python -m bench.model /tmp/bench-db --save baseline.json
+    PYTHONPATH=src python -m bench.model /tmp/bench-db --baseline baseline.json
+
+without a data directory, a small database is generated in a temporary one.
+"""
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+from telegram import User
+
+from app import export, fs
+from app.model.poll import Poll
+from app.state import StateManager
+
+from .generate import generate, load_meta
+
+Benchmark = Callable[[], Any]
+
+# differences smaller than these are noise, not regressions, whatever the threshold
+NOISE = {'ms': 0.01, 'peak_kib': 4.0}
+
+
+def benchmarks(meta: Dict[str, Any]) -> Dict[str, Benchmark]:
+    hot, cold, owner = meta['hot_poll'], meta['cold_poll'], meta['hot_owner']
+    voter = User(meta['first_voter'], is_bot=False, first_name='voter', last_name=str(meta['first_voter']))
+    author = User(meta['first_voter'] + meta['voters'], is_bot=False, first_name='author')
+
+    hot_counts = Poll.load(hot, voters=False)
+    hot_voters = Poll.load(hot)
+    answer_id = hot_counts.answers()[0].id
+
+    def toggle_vote():
+        # twice, so that the database stays the same
+        hot_counts.toggle_vote(voter, answer_id)
+        hot_counts.toggle_vote(voter, answer_id)
+
+    def export_poll(fmt: str) -> Benchmark:
+        def run():
+            with export.export(hot_counts, fmt) as f:
+                f.seek(0, 2)
+
+        return run
+
+    states = StateManager()
+
+    def conversation():
+        # every step is written as it happens, like ConversationHandler does
+        state = states[author]
+        with fs.connection():
+            state.add_question('benchmark')
+            states.flush(author.id)
+        for i in range(3):
+            with fs.connection():
+                state.add_answer('answer #{}'.format(i))
+                states.flush(author.id)
+        with fs.connection():
+            state.create_poll()
+            states.flush(author.id)
+
+    return {
+        'load_hot_voters': lambda: Poll.load(hot),
+        'load_hot_counts': lambda: Poll.load(hot, voters=False),
+        'load_cold_voters': lambda: Poll.load(cold),
+        'query_recent': lambda: Poll.query(owner, '', voters=False),
+        'query_search': lambda: Poll.query(owner, 'lunch', voters=False),
+        'render_hot_counts': lambda: str(hot_counts),
+        'render_hot_voters': lambda: str(hot_voters),
+        'toggle_vote_twice': toggle_vote,
+        'export_json': export_poll('json'),
+        'export_csv': export_poll('csv'),
+        'conversation': conversation,
+    }
+
+
+def measure(benchmark: Benchmark, repeat: int, number: int) -> Dict[str, float]:
+    """median time of a call in ms, and peak of memory allocated during a call in KiB."""
+    benchmark()  # warm up caches, e.g. of prepared statements
+
+    times = timeit.repeat(benchmark, repeat=repeat, number=number)
+
+    tracemalloc.start()
+    try:
+        benchmark()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'ms': round(statistics.median(times) / number * 1000, 4),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def regressions(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+                threshold: float) -> List[Tuple[str, str, float, float]]:
+    """(benchmark, metric, baseline, current) of results worse than baseline by `threshold`."""
+    found = []
+    for name, result in results.items():
+        for metric, value in result.items():
+            old = baseline.get(name, {}).get(metric)
+            if old is not None and value > old * (1 + threshold) and value - old > NOISE[metric]:
+                found.append((name, metric, old, value))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="microbenchmarks of the model layer.")
+    parser.add_argument('data_dir', nargs='?', help="directory made by bench.generate")
+    parser.add_argument('--only', action='append', metavar='NAME', help="run only these benchmarks")
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--number', type=int, default=10, help="calls per repetition")
+    parser.add_argument('--save', metavar='FILE', help="write results as a baseline")
+    parser.add_argument('--baseline', metavar='FILE', help="fail on regressions against a baseline")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="allowed regression, relative; 0.25 by default")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='multi_vote_bot-bench-') as tmp:
+        if args.data_dir is None:
+            meta = generate(tmp, owners=20, polls_per_owner=10, voters=2000, votes=20000)
+        else:
+            meta = load_meta(args.data_dir)
+            fs.configure_data_dir(args.data_dir)
+            fs.migrate()
+            fs.configure_pool()
+
+        suite = benchmarks(meta)
+        results: Dict[str, Dict[str, float]] = {}
+        print("{:20} {:>12} {:>12}".format('benchmark', 'ms', 'peak KiB'))
+        for name, benchmark in suite.items():
+            if args.only and name not in args.only:
+                continue
+            results[name] = measure(benchmark, args.repeat, args.number)
+            print("{:20} {:12.4f} {:12.1f}".format(name, results[name]['ms'], results[name]['peak_kib']))
+
+        fs.pool.close()
+
+    if args.save is not None:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'database': meta, 'results': results}, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if {key: value for key, value in baseline['database'].items() if key != 'seconds'} != \
+                {key: value for key, value in meta.items() if key != 'seconds'}:
+            print("warning: baseline was measured over a different database", file=sys.stderr)
+
+        found = regressions(results, baseline['results'], args.threshold)
+        for name, metric, old, new in found:
+            print("REGRESSION {} {}: {} => {} (+{:.0f}%)".format(name, metric, old, new, (new / old - 1) * 100))
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+microbenchmark of poll message rendering.
+
+compares `Poll.render`, which computes a single `Tally` per poll, with the previous
+implementation, which recomputed the number of unique voters and the maximum count of
+votes for every answer.  both must produce identical text.
+"""
+import argparse
+import random
+import timeit
+
+from telegram import User
+
+from app.model.answer import Answer
+from app.model.poll import Poll
+
+
+def legacy_render_answer(answer: Answer) -> str:
+    total = legacy_total_voters(answer.poll())
+    count = len(answer.voters())
+    max_count: int = max(len(answer.voters()) for answer in answer.poll().answers())
+    relative_percentage: float = count / max_count if max_count != 0 else 0
+    percentage: float = count / total if total != 0 else 0  # 0..1
+
+    if count == 0:
+        bar = "\u25AB 0%"
+    else:
+        bar = "{:\U0001f44d<{}} {}%".format(
+            '',
+            max(1, int(relative_percentage * 8)),
+            int(percentage * 100))
+
+    return "{} - {}\n{}".format(answer.text, count, bar)
+
+
+def legacy_total_voters(poll: Poll) -> int:
+    return len(set(voter.id
+                   for answer in poll.answers()
+                   for voter in answer.voters()))
+
+
+def legacy_render(poll: Poll) -> str:
+    footer = "\U0001f465 "
+    total = legacy_total_voters(poll)
+
+    if total == 0:
+        footer += "Nobody voted so far."
+
+    else:
+        footer += "{} people voted so far.".format(total)
+
+    return "{}\n\n{}\n\n{}".format(poll.topic,
+                                   "\n\n".join(map(legacy_render_answer, poll.answers())),
+                                   footer)
+
+
+def make_poll(answers: int, voters: int, seed: int) -> Poll:
+    """
+    in-memory poll where each voter voted for 1 to 3 random answers.
+    """
+    rnd = random.Random(seed)
+
+    poll = Poll(User(0, is_bot=False, first_name='owner'), 'benchmark')
+    poll.id = 1
+    for i in range(answers):
+        poll.add_answer('answer #{}'.format(i))
+        poll.answers()[-1].id = i + 1
+
+    for user_id in range(1, voters + 1):
+        user = User(user_id, is_bot=False, first_name='voter')
+        for answer in rnd.sample(poll.answers(), min(answers, rnd.randint(1, 3))):
+            answer.voters().append(user)
+
+    return poll
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--answers', type=int, default=50)
+    parser.add_argument('--voters', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    poll = make_poll(args.answers, args.voters, args.seed)
+    assert poll.render() == legacy_render(poll), "rendering differs from legacy implementation"
+
+    legacy = min(timeit.repeat(lambda: legacy_render(poll), number=1, repeat=args.repeat))
+    current = min(timeit.repeat(lambda: poll.render(), number=1, repeat=args.repeat))
+
+    print("answers {}, voters {}".format(args.answers, args.voters))
+    print("legacy  {:10.3f} ms".format(legacy * 1000))
+    print("current {:10.3f} ms".format(current * 1000))
+    print("speedup {:10.1f}x".format(legacy / current))
+
+
+if __name__ == '__main__':
+    main()
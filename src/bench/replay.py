@@ -0,0 +1,164 @@
+"""
+replay of updates recorded by `app.recorder` against a fake Bot API.
+
+the bot runs on a copy of a database, so that the original one is never written, and
+updates are fed to the dispatcher thread at recorded pace, N times faster, or as fast
+as possible:
+
+    PYTHONPATH=src python -m bench.replay ~/.local/share/multi_vote_bot/updates \\
+        --db ~/.local/share/multi_vote_bot/data.db --speed 10
+
+reports handler latencies by handler, and end-to-end latencies from the moment an update
+was due to the end of its handling, which includes time in queues of the dispatcher and
+lanes.
+"""
+import argparse
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from os.path import isdir, join
+from typing import Dict, List, Tuple
+
+from telegram import Bot, Update
+from telegram.ext import Updater
+
+import app.main as bot_main
+from app import fs, recorder
+from app.lanes import Lanes
+from app.sqltrace import SQLTracer
+
+from .load import TOKEN, FakeBotAPI, percentile
+
+
+class ReplayTracer(SQLTracer):
+    """tracer which keeps handler times and completion times of updates."""
+
+    def __init__(self):
+        super().__init__(slow_seconds=float('inf'))
+        self.handlers: Dict[str, List[float]] = defaultdict(list)
+        self.completed: Dict[int, float] = {}
+
+    def _log_update(self, update, elapsed: float):
+        # see `app.main.sql_trace` for the name
+        handler, _, update_id = update.name.rpartition(' of update ')
+        with self._lock:
+            self.handlers[handler].append(elapsed)
+            self.completed[int(update_id)] = time.perf_counter()
+
+
+def copy_database(source: str, data_dir: str):
+    """consistent copy of a live database, with the backup API."""
+    src = sqlite3.connect('file:{}?mode=ro'.format(source), uri=True)
+    dst = sqlite3.connect(join(data_dir, 'data.db'))
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def load(paths: List[str]) -> List[Tuple[float, dict]]:
+    entries = []
+    for path in paths:
+        files = recorder.recordings(path) if isdir(path) else [path]
+        for file in files:
+            entries.extend(recorder.read(file))
+    entries.sort(key=lambda entry: entry[0])
+    return entries
+
+
+def distribution(values: List[float]) -> Dict[str, float]:
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+        'p90_ms': round(percentile(values, 0.90) * 1000, 3),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+        'max_ms': round(max(values, default=0.0) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="replay recorded updates.")
+    parser.add_argument('recordings', nargs='+', help="recorded files or directories with them")
+    parser.add_argument('--db', help="database to copy, an empty one by default")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="1 for recorded pace, N for N times faster, 0 for as fast as possible")
+    parser.add_argument('--latency', type=float, default=0.05, help="Bot API latency, seconds")
+    parser.add_argument('--lanes', type=int, default=4)
+    parser.add_argument('--output', metavar='FILE', help="write results as JSON")
+    args = parser.parse_args()
+
+    entries = load(args.recordings)
+    if len(entries) == 0:
+        parser.error("no recorded updates")
+
+    with tempfile.TemporaryDirectory(prefix='multi_vote_bot-replay-') as tmp:
+        if args.db is not None:
+            copy_database(args.db, tmp)
+        fs.configure_data_dir(tmp)
+        fs.migrate()
+        fs.tracer = tracer = ReplayTracer()
+        fs.configure_pool(factory=fs.TimedConnection)
+
+        api = FakeBotAPI(args.latency, con_pool_size=8 + args.lanes)
+        updater = Updater(bot=Bot(TOKEN, request=api), use_context=True)
+        bot_main.configure_updater(updater)
+        dp = updater.dispatcher
+
+        errors: List[BaseException] = []
+        dp.add_error_handler(lambda update, context: errors.append(context.error))
+
+        bot_main.lanes = Lanes(args.lanes) if args.lanes > 0 else None
+        if bot_main.lanes is not None:
+            bot_main.lanes.start()
+        ready = threading.Event()
+        thread = threading.Thread(target=dp.start, kwargs={'ready': ready}, name='dispatcher')
+        thread.start()
+        ready.wait()
+
+        due: Dict[int, float] = {}
+        first = entries[0][0]
+        started = time.perf_counter()
+        for recorded, data in entries:
+            if args.speed > 0:
+                delay = started + (recorded - first) / args.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            update = Update.de_json(data, updater.bot)
+            due[update.update_id] = time.perf_counter()
+            dp.update_queue.put(update)
+
+        dp.update_queue.join()
+        dp.stop()
+        thread.join()
+        if bot_main.lanes is not None:
+            bot_main.lanes.stop()
+        bot_main.edits.flush()
+        elapsed = time.perf_counter() - started
+
+        fs.pool.close()
+
+    end_to_end = [tracer.completed[update_id] - at
+                  for update_id, at in due.items() if update_id in tracer.completed]
+    results = {
+        'updates': len(entries),
+        'recorded_seconds': round(entries[-1][0] - first, 3),
+        'seconds': round(elapsed, 3),
+        'updates_per_second': round(len(entries) / elapsed, 1),
+        'errors': len(errors),
+        'end_to_end': distribution(end_to_end),
+        'handlers': {name: distribution(values) for name, values in sorted(tracer.handlers.items())},
+        'api_calls': dict(sorted(api.calls.items())),
+    }
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from app import fs  # noqa: E402
+from app.model.user import profiles  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    """fresh migrated database in a temporary data directory, with a timed pool."""
+    # profiles known to be stored in a database of another test
+    profiles.clear()
+    fs.configure_data_dir(str(tmp_path))
+    fs.migrate()
+    pool = fs.configure_pool(factory=fs.TimedConnection)
+    # open a connection now, so that its pragmas are not counted by tests
+    with pool.connection():
+        pass
+    yield pool
+    pool.close()
@@ -0,0 +1,40 @@
+import os
+import sqlite3
+
+import pytest
+
+from app import backup, fs
+
+
+def test_backup_is_a_copy(db, tmp_path):
+    with fs.connection() as conn:
+        conn.execute("INSERT INTO user_states (id, state) VALUES (1, x'7b7d')")
+
+    result = backup.backup(str(tmp_path / 'backups'), pages=1, sleep=0)
+    assert result['path'] == backup.backups(str(tmp_path / 'backups'))[-1]
+    assert result['bytes'] == os.path.getsize(result['path'])
+    assert result['steps'] > 1
+
+    conn = sqlite3.connect(result['path'])
+    try:
+        assert conn.execute("SELECT id FROM user_states").fetchall() == [(1,)]
+    finally:
+        conn.close()
+
+
+def test_rotation_keeps_latest(db, tmp_path):
+    directory = str(tmp_path / 'backups')
+    made = [backup.backup(directory, keep=3)['path'] for _ in range(5)]
+
+    # made within a second, yet in order and none overwritten
+    assert made == sorted(set(made))
+    assert backup.backups(directory) == made[-3:]
+
+    made.append(backup.backup(directory, keep=0)['path'])
+    assert backup.backups(directory) == made[-4:]
+
+
+def test_missing_database(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        backup.backup(str(tmp_path / 'backups'), db_path=str(tmp_path / 'missing.db'))
+    assert backup.backups(str(tmp_path / 'backups')) == []
@@ -0,0 +1,28 @@
+from app import fs
+from bench.generate import generate, load_meta
+from bench.model import benchmarks, measure, regressions
+
+
+def test_regressions():
+    baseline = {'load': {'ms': 1.0, 'peak_kib': 100.0}, 'render': {'ms': 0.001, 'peak_kib': 1.0}}
+    results = {
+        'load': {'ms': 1.3, 'peak_kib': 110.0},
+        # beyond the threshold, but within noise
+        'render': {'ms': 0.005, 'peak_kib': 4.0},
+        'new': {'ms': 100.0, 'peak_kib': 100.0},
+    }
+    assert regressions(results, baseline, threshold=0.25) == [('load', 'ms', 1.0, 1.3)]
+    assert regressions(results, baseline, threshold=0.5) == []
+
+
+def test_benchmarks_run_on_generated_database(db, tmp_path):
+    try:
+        meta = generate(str(tmp_path), owners=3, polls_per_owner=4, voters=50, votes=500)
+        assert load_meta(str(tmp_path)) == meta
+        assert 0 < meta['votes'] <= 500
+
+        for name, benchmark in benchmarks(meta).items():
+            result = measure(benchmark, repeat=1, number=1)
+            assert result['ms'] >= 0, name
+    finally:
+        fs.pool.close()
@@ -0,0 +1,39 @@
+import time
+
+from telegram.error import RetryAfter
+
+from app.coalesce import EditCoalescer
+
+
+def test_edits_are_coalesced():
+    edits = EditCoalescer(0.1)
+    sent = []
+    for version in range(5):
+        edits.submit('message', version, lambda version=version: sent.append(version))
+    time.sleep(0.2)
+
+    assert sent == [0, 4]
+    assert edits.stats() == {'submitted': 5, 'executed': 2, 'retries': 0, 'pending': 0, 'saved': 3}
+
+
+def test_flood_limit_is_retried_with_latest_content():
+    edits = EditCoalescer(0.05)
+    sent = []
+
+    def edit(version: int):
+        def send():
+            if len(sent) == 0 and edits.retries == 0:
+                raise RetryAfter(0.2)
+            sent.append((version, time.monotonic()))
+        return send
+
+    started = time.monotonic()
+    edits.submit('message', 1, edit(1))
+    assert edits.pending() == 1
+
+    edits.submit('message', 2, edit(2))
+    time.sleep(0.4)
+
+    assert [version for version, _ in sent] == [2]
+    assert sent[0][1] - started >= 0.2
+    assert edits.stats() == {'submitted': 2, 'executed': 1, 'retries': 1, 'pending': 0, 'saved': 1}
@@ -0,0 +1,22 @@
+import pytest
+
+from app.config import ConfigurationError, EnvConfigurationSource
+
+
+def test_explicit_zero_is_kept(monkeypatch):
+    monkeypatch.setenv('TOKEN', '123:abc')
+    monkeypatch.setenv('RENDER_CACHE_WEIGHT', '0')
+    config = EnvConfigurationSource().partial().build()
+    assert config.render_cache_weight == 0
+
+    monkeypatch.delenv('RENDER_CACHE_WEIGHT')
+    config = EnvConfigurationSource().partial().build()
+    assert config.render_cache_weight == 16 * 1024 * 1024
+
+
+@pytest.mark.parametrize('key', ['PORT', 'EDIT_INTERVAL'])
+def test_malformed_number_names_key(monkeypatch, key):
+    monkeypatch.setenv('TOKEN', '123:abc')
+    monkeypatch.setenv(key, 'many')
+    with pytest.raises(ConfigurationError, match=key):
+        EnvConfigurationSource().partial()
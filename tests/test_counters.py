@@ -0,0 +1,57 @@
+import random
+
+from telegram import User
+
+from app.fs import connection
+from app.model.poll import Poll
+
+
+def counters(poll_id: int):
+    with connection() as conn:
+        (distinct_voters, version), = conn.execute(
+            "SELECT distinct_voters, version FROM polls WHERE id = ?", (poll_id,)).fetchall()
+        counts = dict(conn.execute(
+            "SELECT answer_id, votes FROM answer_counts WHERE poll_id = ?", (poll_id,)).fetchall())
+    return distinct_voters, version, counts
+
+
+def test_counters_follow_votes(db):
+    poll = Poll(User(1, is_bot=False, first_name='owner'), 'topic')
+    for i in range(3):
+        poll.add_answer('answer #{}'.format(i))
+    poll.store()
+
+    rnd = random.Random(0)
+    votes = set()
+    _, version, _ = counters(poll.id)
+    for _ in range(200):
+        user_id, answer = rnd.randint(2, 12), rnd.choice(poll.answers())
+        voted = poll.toggle_vote(User(user_id, is_bot=False, first_name='voter'), answer.id)
+        assert voted == ((user_id, answer.id) not in votes)
+        votes ^= {(user_id, answer.id)}
+
+        distinct_voters, new_version, counts = counters(poll.id)
+        assert distinct_voters == len({user_id for user_id, _ in votes})
+        assert new_version == version + 1
+        assert counts == {a.id: sum(1 for _, answer_id in votes if answer_id == a.id) for a in poll.answers()}
+        version = new_version
+
+
+def test_count_only_poll_follows_counters(db):
+    poll = Poll(User(1, is_bot=False, first_name='owner'), 'topic')
+    poll.add_answer('yes')
+    poll.add_answer('no')
+    poll.store()
+
+    loaded = Poll.load(poll.id, voters=False)
+    voter = User(2, is_bot=False, first_name='voter')
+    for answer in loaded.answers():
+        loaded.toggle_vote(voter, answer.id)
+    # someone else votes on another copy of the poll
+    poll.toggle_vote(User(3, is_bot=False, first_name='voter'), poll.answers()[0].id)
+    loaded.toggle_vote(voter, loaded.answers()[1].id)
+
+    distinct_voters, version, counts = counters(poll.id)
+    assert (loaded.total_voters(), loaded.version) == (distinct_voters, version) == (2, 4)
+    assert [answer.count() for answer in loaded.answers()] == [2, 0]
+    assert [counts[answer.id] for answer in loaded.answers()] == [2, 0]
@@ -0,0 +1,79 @@
+import json
+import sqlite3
+
+import pytest
+from telegram import User
+from yoyo import get_backend, read_migrations
+
+from app import fs
+from app.state import PersistentConversationHandler, StateManager
+
+USER = User(1, is_bot=False, first_name='author')
+KEY = (USER.id, USER.id)
+
+
+def stored_draft():
+    """topic and answers of the draft as a fresh manager loads it from the database."""
+    poll = StateManager()[USER].poll
+    return poll.topic, [answer.text for answer in poll.answers()]
+
+
+def test_drafts_are_written_with_conversation_state(db):
+    drafts = StateManager()
+    handler = PersistentConversationHandler(entry_points=[], states={}, fallbacks=[], drafts=drafts)
+    conversations = handler.conversations
+
+    draft = drafts[USER]
+    draft.add_question('lunch')
+    conversations[KEY] = 1
+    assert stored_draft() == ('lunch', [])
+
+    for answer in ('pizza', 'sushi'):
+        draft.add_answer(answer)
+        conversations[KEY] = 2
+    assert stored_draft() == ('lunch', ['pizza', 'sushi'])
+
+    with pytest.raises(RuntimeError):
+        with fs.connection():
+            draft.add_answer('pasta')
+            conversations[KEY] = 2
+            raise RuntimeError
+    assert stored_draft() == ('lunch', ['pizza', 'sushi'])
+    assert conversations.get(KEY) == 2
+
+    # the answer is still in memory, and written with the next state
+    conversations[KEY] = 2
+    assert stored_draft() == ('lunch', ['pizza', 'sushi', 'pasta'])
+
+    poll = draft.create_poll()
+    assert [answer.text for answer in poll.answers()] == ['pizza', 'sushi', 'pasta']
+    del conversations[KEY]
+    assert stored_draft() == ('', [])
+    assert conversations.get(KEY) is None
+
+
+def test_migration_moves_answers_out_of_state(tmp_path):
+    fs.configure_data_dir(str(tmp_path))
+    backend = get_backend('sqlite:///' + fs.DB_PATH)
+    migrations = read_migrations(fs.MIGRATIONS_DIR)
+    with backend.lock():
+        backend.apply_migrations(backend.to_apply(
+            migrations.filter(lambda migration: migration.id < '20261017_06')))
+
+    backend.connection.close()
+
+    # a draft as stored before the migration
+    with sqlite3.connect(fs.DB_PATH) as conn:
+        conn.execute("INSERT INTO user_states (id, state) VALUES (?, ?)",
+                     (USER.id, json.dumps({'topic': 'lunch', 'answers': ['pizza', 'sushi']}).encode('utf-8')))
+    conn.close()
+
+    assert fs.migrate()
+    pool = fs.configure_pool()
+    try:
+        assert stored_draft() == ('lunch', ['pizza', 'sushi'])
+        with fs.connection() as conn:
+            (blob,), = conn.execute("SELECT state FROM user_states WHERE id = ?", (USER.id,)).fetchall()
+        assert json.loads(blob.decode('utf-8')) == {'topic': 'lunch'}
+    finally:
+        pool.close()
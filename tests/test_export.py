@@ -0,0 +1,69 @@
+import csv
+import io
+import json
+
+from telegram import User
+
+from app import export, fs
+from app.export import VOTER_FIELDS
+from app.model.poll import Poll
+
+
+def queries() -> int:
+    return sum(value for _, _, _, value in fs.sql_queries.samples())
+
+
+def make_poll() -> Poll:
+    poll = Poll(User(1, is_bot=False, first_name='owner'), 'lunch')
+    for text in ('pizza', 'sushi, "fresh"', 'nothing'):
+        poll.add_answer(text)
+    poll.store()
+    for i in range(6):
+        user = User(100 + i, is_bot=False, first_name='voter',
+                    last_name='#{}'.format(i) if i % 2 else None, username='v{}'.format(i))
+        poll.toggle_vote(user, poll.answers()[i % 2].id)
+    poll.toggle_vote(User(100, is_bot=False, first_name='voter', username='v0'), poll.answers()[1].id)
+    return Poll.load(poll.id)
+
+
+def voters(poll: Poll):
+    for answer in poll.answers():
+        for voter in answer.voters():
+            yield answer, {k: getattr(voter, k) for k in VOTER_FIELDS if getattr(voter, k)}
+
+
+def read(poll: Poll, fmt: str) -> str:
+    with export.export(Poll.load(poll.id, voters=False), fmt) as f:
+        return f.read().decode('utf-8')
+
+
+def test_json(db):
+    poll = make_poll()
+    expected = {'answers': [
+        {'id': answer.id, 'text': answer.text, 'voters': {
+            'total': answer.count(),
+            '_': [v for a, v in voters(poll) if a is answer],
+        }}
+        for answer in poll.answers()
+    ]}
+    loaded = Poll.load(poll.id, voters=False)
+    before = queries()
+    with export.export(loaded, 'json') as f:
+        assert f.read().decode('utf-8') == json.dumps(expected, indent=4, ensure_ascii=False)
+    assert queries() - before == 1
+
+
+def test_jsonl(db):
+    poll = make_poll()
+    expected = [dict({'answer_id': answer.id, 'answer': answer.text}, **voter)
+                for answer, voter in voters(poll)]
+    assert [json.loads(line) for line in read(poll, 'jsonl').splitlines()] == expected
+
+
+def test_csv(db):
+    poll = make_poll()
+    expected = [['answer_id', 'answer', *VOTER_FIELDS]] + [
+        [str(answer.id), answer.text] + [str(voter.get(k, '')) for k in VOTER_FIELDS]
+        for answer, voter in voters(poll)]
+    assert list(csv.reader(io.StringIO(read(poll, 'csv')))) == expected
+
@@ -0,0 +1,45 @@
+import os
+import shutil
+import sqlite3
+import sys
+
+from app import fs
+
+MIGRATION = '''
+from yoyo import step
+
+__depends__ = {{'{depends}'}}
+
+steps = [
+    step("CREATE TABLE migrate_test (id INTEGER PRIMARY KEY)"),
+]
+'''
+
+
+def tables():
+    conn = sqlite3.connect(fs.DB_PATH)
+    try:
+        return {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        conn.close()
+
+
+def test_migrate_only_when_migrations_change(tmp_path, monkeypatch):
+    migrations_dir = str(tmp_path / 'migrations')
+    shutil.copytree(fs.MIGRATIONS_DIR, migrations_dir, ignore=shutil.ignore_patterns('__pycache__'))
+    fs.configure_data_dir(str(tmp_path / 'data'))
+
+    assert fs.migrate(migrations_dir=migrations_dir)
+    assert 'polls' in tables()
+
+    # the schema is current: yoyo is not even imported
+    with monkeypatch.context() as m:
+        m.setitem(sys.modules, 'yoyo', None)
+        assert not fs.migrate(migrations_dir=migrations_dir)
+
+    latest = max(name[:-len('.py')] for name in os.listdir(migrations_dir) if name.endswith('.py'))
+    (tmp_path / 'migrations' / '29991231_01_Test-migrate.py').write_text(MIGRATION.format(depends=latest))
+
+    assert fs.migrate(migrations_dir=migrations_dir)
+    assert 'migrate_test' in tables()
+    assert not fs.migrate(migrations_dir=migrations_dir)
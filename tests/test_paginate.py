@@ -0,0 +1,83 @@
+import re
+from typing import List, Optional, Tuple
+
+from telegram import User
+
+from app.main import POLLS_PER_PAGE, manage_polls_page
+from app.model.poll import Poll
+
+OWNER = User(1, is_bot=False, first_name='owner')
+
+# see callback_query_manage
+MANAGE = re.compile(r"\.manage (\d+)(?: (next|prev) (\d+))?")
+
+
+def make_polls(count: int) -> List[int]:
+    ids = []
+    for i in range(count):
+        poll = Poll(OWNER, 'poll #{}'.format(i))
+        poll.add_answer('answer')
+        poll.store()
+        ids.append(poll.id)
+    return ids
+
+
+def test_summaries_pages(db):
+    ids = make_polls(7)[::-1]
+    # a poll of another user in between
+    other = Poll(User(2, is_bot=False, first_name='other'), 'other')
+    other.add_answer('answer')
+    other.store()
+
+    def page(**kw) -> List[int]:
+        return [summary.id for summary in Poll.summaries(OWNER.id, 3, **kw)]
+
+    assert page() == ids[:3]
+    assert page(before=ids[2]) == ids[3:6]
+    assert page(before=ids[5]) == ids[6:]
+    assert page(after=ids[6]) == ids[3:6]
+    assert page(after=ids[3]) == ids[:3]
+    assert page(after=ids[0]) == []
+    assert page(offset=3) == ids[3:6]
+
+
+def open_page(data: str) -> Tuple[List[int], Optional[str], Optional[str]]:
+    """ids of polls on a page opened by a button, and data of its buttons."""
+    offset, direction, poll_id = MANAGE.fullmatch(data).groups()
+    poll_id = int(poll_id) if poll_id is not None else None
+    text, markup = manage_polls_page(OWNER.id, int(offset),
+                                     before=poll_id if direction == 'next' else None,
+                                     after=poll_id if direction == 'prev' else None)
+    ids = [int(poll_id) for poll_id in re.findall(r'/view_(\d+)', text)]
+
+    row = markup.inline_keyboard[0]
+    previous = next((button.callback_data for button in row if 'previous' in button.text), None)
+    following = next((button.callback_data for button in row if 'next' in button.text), None)
+    return ids, previous, following
+
+
+def test_manage_pages_forward_and_back(db):
+    ids = make_polls(2 * POLLS_PER_PAGE + 2)[::-1]
+    pages = [ids[i:i + POLLS_PER_PAGE] for i in range(0, len(ids), POLLS_PER_PAGE)]
+
+    first, previous, after_first = open_page('.manage 0')
+    assert (first, previous) == (pages[0], None)
+
+    second, back_to_first, after_second = open_page(after_first)
+    third, back_to_second, last = open_page(after_second)
+    assert (second, third, last) == (pages[1], pages[2], None)
+
+    assert open_page(back_to_second)[:2] == (pages[1], back_to_first)
+    assert open_page(back_to_first) == (pages[0], None, after_first)
+
+    # numbering continues across pages
+    text, _ = manage_polls_page(OWNER.id, POLLS_PER_PAGE, before=pages[0][-1])
+    assert text.split('\n\n')[1].startswith('{}. '.format(POLLS_PER_PAGE + 1))
+
+
+def test_legacy_offset_links(db):
+    ids = make_polls(2 * POLLS_PER_PAGE + 2)[::-1]
+
+    assert open_page('.manage {}'.format(POLLS_PER_PAGE)) == open_page(open_page('.manage 0')[2])
+    assert open_page('.manage {}'.format(2 * POLLS_PER_PAGE))[0] == ids[2 * POLLS_PER_PAGE:]
+    assert manage_polls_page(OWNER.id, 100)[0] is None
@@ -0,0 +1,52 @@
+from telegram import User
+
+from app import fs
+from app.model.poll import Poll
+
+
+def queries() -> int:
+    return sum(value for _, _, _, value in fs.sql_queries.samples())
+
+
+def make_poll(owner: User, topic: str, answers: int, voters: int) -> Poll:
+    poll = Poll(owner, topic)
+    for i in range(answers):
+        poll.add_answer('answer #{}'.format(i))
+    poll.store()
+    for i in range(voters):
+        voter = User(100 + i, is_bot=False, first_name='voter #{}'.format(i))
+        poll.toggle_vote(voter, poll.answers()[i % answers].id)
+    return poll
+
+
+def test_load_many_executes_two_statements(db):
+    owner = User(1, is_bot=False, first_name='owner')
+    polls = [make_poll(owner, 'poll #{}'.format(i), answers=3, voters=i * 4) for i in range(5)]
+    ids = [poll.id for poll in polls]
+
+    for voters in (True, False):
+        before = queries()
+        loaded = Poll.load_many(ids + [10 ** 6], voters=voters)
+        assert queries() - before == 2
+
+        assert [poll.id for poll in loaded] == ids
+        assert [str(poll) for poll in loaded] == [str(poll) for poll in polls]
+
+
+def test_load_missing(db):
+    assert Poll.load(10 ** 6) is None
+
+
+def test_store_keeps_votes_made_meanwhile(db):
+    owner = User(1, is_bot=False, first_name='owner')
+    poll = make_poll(owner, 'topic', answers=2, voters=2)
+
+    loaded = Poll.load(poll.id)
+    assert poll.toggle_vote(User(200, is_bot=False, first_name='late voter'), poll.answers()[0].id)
+
+    loaded.topic = 'renamed'
+    loaded.store()
+
+    stored = Poll.load(poll.id)
+    assert stored.topic == 'renamed'
+    assert [[voter.id for voter in answer.voters()] for answer in stored.answers()] == [[200, 100], [101]]
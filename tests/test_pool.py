@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pytest
+
+from app import fs
+
+
+def test_connections_are_reused(tmp_path):
+    pool = fs.ConnectionPool(str(tmp_path / 'data.db'), size=2)
+    with pool.connection() as conn:
+        with pool.connection() as nested:
+            assert nested is conn
+    with pool.connection() as again:
+        assert again is conn
+    assert pool.stats()['connections'] == 1
+    pool.close()
+
+
+def test_close_wakes_waiters(tmp_path, monkeypatch):
+    monkeypatch.setattr(fs, 'ACQUIRE_POLL_INTERVAL', 0.05)
+    pool = fs.ConnectionPool(str(tmp_path / 'data.db'), size=1)
+    errors = []
+    borrowed = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with pool.connection():
+            borrowed.set()
+            release.wait()
+
+    def wait():
+        try:
+            with pool.connection():
+                pass
+        except fs.PoolClosedError as e:
+            errors.append(e)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    borrowed.wait()
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    time.sleep(0.1)
+
+    pool.close()
+    waiter.join(timeout=1)
+    assert not waiter.is_alive()
+    assert len(errors) == 1
+
+    # connection in use is closed and forgotten once returned
+    release.set()
+    holder.join()
+    assert pool.stats()['connections'] == 0
+
+    with pytest.raises(fs.PoolClosedError):
+        with pool.connection():
+            pass
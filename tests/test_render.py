@@ -0,0 +1,22 @@
+import pytest
+from telegram import User
+
+from app.model.poll import Poll
+from bench.render import legacy_render, make_poll
+
+
+@pytest.mark.parametrize('answers, voters, seed', [(1, 0, 0), (3, 1, 1), (5, 40, 2), (20, 500, 3)])
+def test_render_matches_legacy(answers, voters, seed):
+    poll = make_poll(answers, voters, seed)
+    assert str(poll) == legacy_render(poll)
+
+
+def test_count_only_render_matches_legacy(db):
+    poll = Poll(User(1, is_bot=False, first_name='owner'), 'topic')
+    for i in range(4):
+        poll.add_answer('answer #{}'.format(i))
+    poll.store()
+    for i in range(30):
+        poll.toggle_vote(User(100 + i % 11, is_bot=False, first_name='voter'), poll.answers()[i % 3].id)
+
+    assert str(Poll.load(poll.id, voters=False)) == legacy_render(Poll.load(poll.id))
@@ -0,0 +1,54 @@
+from telegram import User
+
+from app.model.poll import Poll
+
+OWNER = User(1, is_bot=False, first_name='owner')
+
+
+def make_poll(topic: str, *answers: str, owner: User = OWNER) -> Poll:
+    poll = Poll(owner, topic)
+    for answer in answers:
+        poll.add_answer(answer)
+    poll.store()
+    return poll
+
+
+def search(text: str, user: User = OWNER):
+    return [poll.topic for poll in Poll.query(user.id, text, voters=False)]
+
+
+def test_prefix_of_every_word(db):
+    make_poll('lunch plans', 'pizza napoletana', 'sushi')
+    make_poll('dinner', 'pasta')
+
+    assert search('piz') == ['lunch plans']
+    assert search('lun su') == ['lunch plans']
+    assert search('lun pasta') == []
+
+
+def test_topic_ranks_higher_than_answers(db):
+    make_poll('pizza night', 'yes', 'no')
+    make_poll('friday', 'pizza', 'burgers')
+
+    assert search('pizza') == ['pizza night', 'friday']
+
+
+def test_polls_of_other_users_are_not_found(db):
+    make_poll('pizza', 'yes', owner=User(2, is_bot=False, first_name='other'))
+
+    assert search('pizza') == []
+
+
+def test_punctuation_only_lists_recent_polls(db):
+    make_poll('first', 'a')
+    make_poll('second', 'b')
+
+    for text in ('', '"', '*', '!?', '__'):
+        assert search(text) == ['second', 'first'], text
+
+
+def test_underscore_separates_words(db):
+    make_poll('lunch', 'pizza')
+
+    assert search('__ pi') == ['lunch']
+    assert search('pizza_lunch') == ['lunch']
@@ -0,0 +1,70 @@
+import sqlite3
+import time
+
+import pytest
+
+from app import fs
+from app.state import SQLiteDictProxy
+
+
+def queries() -> int:
+    return sum(value for _, _, _, value in fs.sql_queries.samples())
+
+
+def test_lookups_are_cached(db):
+    states = SQLiteDictProxy()
+    key = (1, 2)
+
+    before = queries()
+    assert key not in states
+    assert states.get(key) is None
+    assert states.pop(key, 'default') == 'default'
+    assert queries() - before == 1
+    assert states.stats() == {'entries': 1, 'hits': 2, 'misses': 1, 'evictions': 0}
+
+    states[key] = 3
+    before = queries()
+    assert states[key] == 3
+    assert key in states
+    states[key] = 3
+    assert queries() - before == 0
+
+
+def test_writes_go_through(db):
+    key = (1, 2)
+    SQLiteDictProxy()[key] = 5
+
+    states = SQLiteDictProxy()
+    assert states.get(key) == 5
+
+    del states[key]
+    assert SQLiteDictProxy().get(key) is None
+
+
+@pytest.mark.parametrize('version, expected', [((3, 35, 0), 1), ((3, 27, 2), 2)])
+def test_pop_of_uncached_key(db, monkeypatch, version, expected):
+    monkeypatch.setattr(sqlite3, 'sqlite_version_info', version)
+    key = (1, 2)
+    SQLiteDictProxy()[key] = 7
+
+    states = SQLiteDictProxy()
+    before = queries()
+    assert states.pop(key) == 7
+    assert key not in states
+    assert queries() - before == expected
+    assert SQLiteDictProxy().get(key) is None
+
+
+def test_idle_conversations_are_evicted(db):
+    states = SQLiteDictProxy(ttl=0.05)
+    states[(1, 2)] = 1
+    assert states.get((1, 2)) == 1
+
+    time.sleep(0.1)
+    # a miss prunes the cache
+    assert states.get((3, 4)) is None
+    assert states.stats()['evictions'] == 1
+
+    before = queries()
+    assert states.get((1, 2)) == 1
+    assert queries() - before == 1
@@ -0,0 +1,54 @@
+import pytest
+from telegram import User
+
+from app.fs import connection
+from app.model.user import UserProfiles
+
+
+def store(profiles: UserProfiles, *users: User):
+    with connection() as conn:
+        profiles.store(conn.cursor(), users)
+
+
+def stored(user_id: int):
+    with connection() as conn:
+        return tuple(conn.execute(
+            "SELECT first_name, last_name, username FROM users WHERE id = ?", (user_id,)).fetchone())
+
+
+def counts(profiles: UserProfiles):
+    stats = profiles.stats()
+    return stats['skipped'], stats['unchanged'], stats['written']
+
+
+def test_unchanged_profiles_are_skipped(db):
+    profiles = UserProfiles()
+    store(profiles, User(1, is_bot=False, first_name='ann'), User(2, is_bot=False, first_name='bob'))
+    assert counts(profiles) == (0, 0, 2)
+
+    store(profiles, User(1, is_bot=False, first_name='ann'), User(2, is_bot=False, first_name='bob'))
+    assert counts(profiles) == (2, 0, 2)
+
+    store(profiles, User(1, is_bot=False, first_name='ann', username='ann'))
+    assert counts(profiles) == (2, 0, 3)
+    assert stored(1) == ('ann', None, 'ann')
+
+
+def test_profiles_unknown_to_cache_are_not_rewritten(db):
+    store(UserProfiles(), User(1, is_bot=False, first_name='ann'))
+
+    profiles = UserProfiles()
+    store(profiles, User(1, is_bot=False, first_name='ann'))
+    assert counts(profiles) == (0, 1, 0)
+
+
+def test_rolled_back_profiles_are_not_cached(db):
+    profiles = UserProfiles()
+    with pytest.raises(RuntimeError):
+        with connection() as conn:
+            profiles.store(conn.cursor(), [User(1, is_bot=False, first_name='ann')])
+            raise RuntimeError
+
+    store(profiles, User(1, is_bot=False, first_name='ann'))
+    assert counts(profiles) == (0, 0, 2)
+    assert stored(1) == ('ann', None, None)
@@ -0,0 +1,37 @@
+import random
+import threading
+
+from telegram import User
+
+from app.model.poll import Poll
+from app.model.vote_queue import VoteQueue
+
+
+def test_concurrent_votes_are_written(db, tmp_path):
+    poll = Poll(User(1, is_bot=False, first_name='owner'), 'hot')
+    for i in range(5):
+        poll.add_answer('answer #{}'.format(i))
+    poll.store()
+
+    queue = VoteQueue(str(tmp_path / 'journal'), interval=0.01, max_batch=50)
+    queue.start()
+
+    def vote(seed: int):
+        rnd = random.Random(seed)
+        for _ in range(200):
+            loaded = queue.read(lambda: Poll.load(poll.id, voters=False))
+            voter = User(rnd.randint(2, 40), is_bot=False, first_name='voter')
+            queue.toggle(rnd.choice(loaded.answers()), voter)
+
+    threads = [threading.Thread(target=vote, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    queued = queue.read(lambda: Poll.load(poll.id, voters=False))
+    queue.stop()
+
+    assert queue.stats()['written'] == queue.stats()['votes'] == 1600
+    assert str(queued) == str(Poll.load(poll.id, voters=False)) == str(Poll.load(poll.id))
+    assert list((tmp_path / 'journal').iterdir()) == []